@@ -0,0 +1,284 @@
+"""Локальный HTTP-двойник приватных фьючерсных эндпоинтов MEXC для бенчмарков
+
+Запросы аккаунтов обслуживает SimulatedExchange (аккаунт определяется по заголовку
+authorization). Служебные эндпоинты /_bench/* управляют сценарием и отдают
+серверные отметки времени: когда главный аккаунт «увидел» событие и когда
+до сервера дошли ордера ведомых.
+
+На том же порту работает двойник приватного WebSocket-потока (/edge): после входа
+главный аккаунт получает push.personal.position и push.personal.order о событиях
+сценария. /_bench/drop_streams рвёт все подключения, а событие с "push": false
+не отправляется в поток - так проверяется восстановление после разрыва.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+from simulator import SimulatedExchange
+
+MASTER_UID = "BENCH-main"
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class BenchState:
+    """Сценарий: события главного аккаунта и серверные отметки их копирования"""
+
+    def __init__(self, exchange: SimulatedExchange):
+        self.exchange = exchange
+        self.events = []
+        self.current = None
+        self.requests = 0
+        self.started = time.time()
+        self.streams = {}  # {writer: uid} - подключения к WebSocket-потоку после входа
+
+    def _master_position(self, symbol: str, side: int):
+        return next((p for p in self.exchange.account(MASTER_UID).positions.values()
+                     if p['symbol'] == symbol and p['positionType'] == (1 if side == 1 else 2)), None)
+
+    def start_event(self, kind: str, symbol: str, side: int, vol: int = 10, push: bool = True):
+        before = self._master_position(symbol, side)
+        if kind == 'open':
+            result = self.exchange.open_market(MASTER_UID, symbol, side, vol)
+        else:
+            result = self.exchange.close_market(MASTER_UID, symbol, side)
+
+        position = self._master_position(symbol, side)
+        self.current = {
+            'kind': kind,
+            'symbol': symbol,
+            'side': side,
+            'position_id': (position or {}).get('positionId', self._last_position_id(symbol)),
+            't_event': time.time(),
+            't_detect': None,
+            'dispatch': {},
+        }
+        self.events.append(self.current)
+
+        if push and MASTER_UID in self.streams.values():
+            history = self.exchange.account(MASTER_UID).history
+            if history:
+                self.push(MASTER_UID, 'push.personal.order', history[-1])
+            if position:
+                self.push(MASTER_UID, 'push.personal.position', position)
+            elif before:
+                self.push(MASTER_UID, 'push.personal.position', {**before, 'holdVol': 0, 'state': 3})
+            # Из потока бот узнаёт о событии в момент отправки сообщения
+            self.current['t_detect'] = time.time()
+        return result
+
+    def _last_position_id(self, symbol):
+        for order in reversed(self.exchange.account(MASTER_UID).history):
+            if order['symbol'] == symbol:
+                return order['positionId']
+
+    def on_master_positions(self, positions: list):
+        """Первый ответ главному аккаунту, отражающий событие, - момент обнаружения"""
+        event = self.current
+        if not event or event['t_detect']:
+            return
+        present = any(p['positionId'] == event['position_id'] for p in positions)
+        if present == (event['kind'] == 'open'):
+            event['t_detect'] = time.time()
+
+    def on_order_create(self, uid: str, body: dict):
+        event = self.current
+        if not event or uid == MASTER_UID or uid in event['dispatch']:
+            return
+        is_open = int(body.get('side', 0)) in (1, 3)
+        if is_open == (event['kind'] == 'open') and body.get('symbol') == event['symbol']:
+            event['dispatch'][uid] = time.time()
+
+    def push(self, uid: str, channel: str, data: dict):
+        message = json.dumps({'channel': channel, 'data': data, 'ts': int(time.time() * 1000)}).encode('utf-8')
+        for writer, stream_uid in list(self.streams.items()):
+            if stream_uid == uid:
+                write_frame(writer, message)
+
+    def drop_streams(self):
+        for writer in list(self.streams):
+            writer.close()
+        self.streams.clear()
+
+    def slaves_with_position(self, symbol: str, side: int):
+        return sum(1 for uid in self.exchange.accounts
+                   if uid != MASTER_UID and self.exchange.has_position(uid, symbol, side))
+
+
+async def handle_connection(state: BenchState, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if headers.get('upgrade', '').lower() == 'websocket':
+                await websocket_session(state, reader, writer, headers)
+                return
+
+            body = None
+            length = int(headers.get('content-length', 0))
+            if length:
+                body = json.loads(await reader.readexactly(length))
+
+            status, payload = await route(state, method, target, headers, body)
+            data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status} OK\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: keep-alive\r\n\r\n".encode('latin-1') + data
+            )
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def write_frame(writer: asyncio.StreamWriter, payload: bytes, opcode: int = 0x1):
+    """Кадр WebSocket от сервера (без маски)"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    writer.write(header + payload)
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Кадр WebSocket от клиента: (opcode, payload)"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0f, payload
+
+
+async def websocket_session(state: BenchState, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                            headers: dict):
+    """Двойник wss://contract.mexc.com/edge: login, ping и приватные push-сообщения"""
+    accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode()).digest()).decode()
+    writer.write(
+        "HTTP/1.1 101 Switching Protocols\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode('latin-1')
+    )
+    try:
+        while True:
+            opcode, payload = await read_frame(reader)
+            if opcode == 0x8:
+                write_frame(writer, payload[:2], 0x8)
+                break
+            if opcode == 0x9:
+                write_frame(writer, payload, 0xA)
+                continue
+            if opcode != 0x1:
+                continue
+
+            message = json.loads(payload)
+            if message.get('method') == 'login':
+                uid = (message.get('param') or {}).get('token', '')
+                state.streams[writer] = uid
+                reply = {'channel': 'rs.login', 'data': 'success', 'ts': int(time.time() * 1000)}
+            elif message.get('method') == 'ping':
+                reply = {'channel': 'pong', 'data': int(time.time() * 1000)}
+            else:
+                continue
+            write_frame(writer, json.dumps(reply).encode('utf-8'))
+            await writer.drain()
+    finally:
+        state.streams.pop(writer, None)
+
+
+async def route(state: BenchState, method: str, target: str, headers: dict, body):
+    parts = urlsplit(target)
+    query = dict(parse_qsl(parts.query))
+
+    if parts.path.startswith('/_bench/'):
+        return admin(state, parts.path, query, body)
+
+    state.requests += 1
+    uid = headers.get('authorization', '')
+    if method == 'POST' and parts.path.endswith('/order/create'):
+        state.on_order_create(uid, body or {})
+
+    await state.exchange.delay(uid)
+    response = state.exchange.handle(uid, method, target, None, body)
+    payload = response.json()
+
+    if uid == MASTER_UID and parts.path.endswith('/position/open_positions'):
+        state.on_master_positions(payload.get('data') or [])
+    return response.status_code, payload
+
+
+def admin(state: BenchState, path: str, query: dict, body):
+    if path == '/_bench/open':
+        return 200, state.start_event('open', body['symbol'], int(body['side']), int(body.get('vol', 10)),
+                                      body.get('push', True))
+    if path == '/_bench/close':
+        return 200, state.start_event('close', body['symbol'], int(body['side']), push=body.get('push', True))
+    if path == '/_bench/drop_streams':
+        count = len(state.streams)
+        state.drop_streams()
+        return 200, {'dropped': count}
+    if path == '/_bench/status':
+        return 200, {'slaves_with_position': state.slaves_with_position(query['symbol'], int(query['side']))}
+    if path == '/_bench/stats':
+        return 200, {
+            'requests': state.requests,
+            'elapsed': time.time() - state.started,
+            'endpoints': dict(state.exchange.requests),
+            'events': state.events,
+        }
+    return 404, {'success': False, 'message': f'Unknown admin endpoint {path}'}
+
+
+async def serve(port: int = 0, latency: float = 0.0, jitter: float = 0.0, ready=None):
+    """Запускает сервер; фактический порт передаётся в ready (multiprocessing.Queue)"""
+    state = BenchState(SimulatedExchange(latency, jitter))
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(state, reader, writer), '127.0.0.1', port)
+    actual_port = server.sockets[0].getsockname()[1]
+    if ready is not None:
+        ready.put(actual_port)
+    else:
+        print(f"🟢 Мок MEXC слушает http://127.0.0.1:{actual_port}")
+    async with server:
+        await server.serve_forever()
+
+
+def run_server(port: int = 0, latency: float = 0.0, jitter: float = 0.0, ready=None):
+    asyncio.run(serve(port, latency, jitter, ready))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальный мок приватных эндпоинтов MEXC")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    args = parser.parse_args()
+    run_server(args.port, args.latency, args.jitter)
@@ -0,0 +1,200 @@
+"""Сквозной бенчмарк задержки копирования против локального мока MEXC
+
+Для каждого размера флота (по умолчанию 1, 10, 100, 500 ведомых) поднимает
+мок-сервер в отдельном процессе, запускает настоящий main() и проигрывает
+сценарий открытий и закрытий на главном аккаунте. Результаты пишутся в JSON,
+чтобы сравнивать релизы между собой.
+
+    python -m bench.run_bench --accounts 1 10 100 500 --events 10 --output bench_results.json
+
+С --stream изменения главного аккаунта приходят через двойник WebSocket-потока,
+а не опросом REST.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import subprocess
+import time
+
+from curl_cffi import AsyncSession
+
+from bench.mock_server import MASTER_UID, run_server
+from api.mexc import Mexc, FUTURES_HOST, WWW_HOST, FUTURES_WS_URL, ORDER_CREATE_URL
+from transport import Transport
+
+SYMBOL = "BTC_USDT"
+
+
+class TimingTransport(Transport):
+    """Обёртка над транспортом: время отправки и получения ответа на order/create"""
+
+    def __init__(self, inner: Transport, acks: list):
+        self.inner = inner
+        self.acks = acks
+
+    async def request(self, method: str, url: str, params=None, json=None, headers=None, timeout: float = 10):
+        sent = time.time()
+        response = await self.inner.request(method, url, params=params, json=json, headers=headers, timeout=timeout)
+        if url == ORDER_CREATE_URL:
+            self.acks.append({'sent': sent, 'ack': time.time()})
+        return response
+
+    async def reset(self):
+        await self.inner.reset()
+
+    async def close(self):
+        await self.inner.close()
+
+
+def percentile(values: list, p: float):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: list):
+    values = [round(value, 3) for value in values]
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50),
+        'p99_ms': percentile(values, 99),
+        'max_ms': max(values) if values else None,
+    }
+
+
+def start_server(latency: float, jitter: float):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_server, args=(0, latency, jitter, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=10)
+
+
+async def wait_for_slaves(admin: AsyncSession, base: str, side: int, expected: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        r = await admin.get(f"{base}/_bench/status", params={'symbol': SYMBOL, 'side': side})
+        if r.json()['slaves_with_position'] == expected:
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+async def run_scenario(accounts: int, events: int, latency: float, jitter: float, timeout: float,
+                       stream: bool = False):
+    import main as bot
+
+    process, port = start_server(latency, jitter)
+    base = f"http://127.0.0.1:{port}"
+    ws_host = FUTURES_WS_URL.rsplit('/', 1)[0]
+    host_map = {FUTURES_HOST: base, WWW_HOST: base, ws_host: f"ws://127.0.0.1:{port}"}
+
+    acks = []
+    main_mexc = Mexc(MASTER_UID, None, host_map=host_map)
+    accounts_mexc = []
+    for i in range(accounts):
+        mexc = Mexc(f"BENCH-{i}", None, host_map=host_map)
+        mexc.transport = TimingTransport(mexc.transport, acks)
+        accounts_mexc.append(mexc)
+
+    bot.notifier.enabled = False
+    bot.STATE_JOURNAL_FILE = None
+    bot.ledger.entries.clear()
+    bot.MASTER_STREAM_ENABLED = stream
+    admin = AsyncSession()
+    completed = 0
+    try:
+        # Вывод бота на сотнях аккаунтов сам по себе нагружает цикл - глушим его
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot_task = asyncio.create_task(bot.main(main_mexc, accounts_mexc))
+            await asyncio.sleep(1)
+
+            for n in range(events):
+                side = 1 if n % 2 == 0 else 3
+                await admin.post(f"{base}/_bench/open", json={'symbol': SYMBOL, 'side': side, 'vol': 10})
+                completed += await wait_for_slaves(admin, base, side, accounts, timeout)
+                await admin.post(f"{base}/_bench/close", json={'symbol': SYMBOL, 'side': side})
+                completed += await wait_for_slaves(admin, base, side, 0, timeout)
+
+            bot_task.cancel()
+            for task in list(bot.background_tasks):
+                task.cancel()
+        stats = (await admin.get(f"{base}/_bench/stats")).json()
+    finally:
+        await admin.close()
+        process.terminate()
+
+    detect_to_dispatch = []
+    event_to_detect = []
+    for event in stats['events']:
+        if event['t_detect'] is None:
+            continue
+        event_to_detect.append((event['t_detect'] - event['t_event']) * 1000)
+        detect_to_dispatch.extend((t - event['t_detect']) * 1000 for t in event['dispatch'].values())
+
+    return {
+        'accounts': accounts,
+        'mode': 'stream' if stream else 'poll',
+        'events': events * 2,
+        'events_completed': completed,
+        'event_to_detect': summarize(event_to_detect),
+        'detect_to_dispatch': summarize(detect_to_dispatch),
+        'dispatch_to_ack': summarize([(a['ack'] - a['sent']) * 1000 for a in acks]),
+        'requests': stats['requests'],
+        'requests_per_sec': stats['requests'] / stats['elapsed'] if stats['elapsed'] else None,
+        'endpoints': stats['endpoints'],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(accounts_list: list, events: int, latency: float, jitter: float, timeout: float, output: str,
+              stream: bool = False):
+    results = []
+    for accounts in accounts_list:
+        print(f"⏱️ Сценарий: {accounts} ведомых аккаунтов ({'поток' if stream else 'опрос'})...")
+        result = await run_scenario(accounts, events, latency, jitter, timeout, stream)
+        results.append(result)
+        print(f"  event→detect p50={result['event_to_detect']['p50_ms']} мс | "
+              f"detect→dispatch p50={result['detect_to_dispatch']['p50_ms']} мс "
+              f"p99={result['detect_to_dispatch']['p99_ms']} мс | "
+              f"dispatch→ack p50={result['dispatch_to_ack']['p50_ms']} мс "
+              f"p99={result['dispatch_to_ack']['p99_ms']} мс | "
+              f"{result['requests_per_sec']:.0f} запросов/сек")
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency': latency,
+        'jitter': jitter,
+        'scenarios': results,
+    }
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"📄 Результаты записаны в {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк задержки копирования против локального мока MEXC")
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--events", type=int, default=10, help="Пар открытие/закрытие на сценарий")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка обработки запроса моком (сек)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=60, help="Ожидание копирования одного события (сек)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--stream", action="store_true", help="Изменения главного аккаунта через WebSocket-поток")
+    args = parser.parse_args()
+    asyncio.run(run(args.accounts, args.events, args.latency, args.jitter, args.timeout, args.output, args.stream))
@@ -0,0 +1,70 @@
+import asyncio
+from metrics import metrics
+
+
+class Coalescer:
+    """Объединяет однотипные вызовы одного аккаунта, пришедшие за короткое окно, в один запрос.
+
+    send(items) - пакетный вызов биржи (например, отмена списка ордеров). Первый submit()
+    открывает окно на window секунд; всё, что пришло за это время, уходит одним вызовом
+    (не больше limit элементов, остальное - следующими). Каждый ожидающий получает общий
+    результат вызова со своей частью элементов.
+    """
+
+    def __init__(self, name: str, account_id: str, send, window: float = 0.005, limit: int = 50):
+        self.name = name
+        self.account_id = account_id
+        self.send = send
+        self.window = window
+        self.limit = limit
+        self.pending = []  # [(элементы, future)]
+        self.size = 0  # Элементов в pending
+        self.flush_handle = None
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    async def submit(self, items: list):
+        """Ставит элементы в текущее окно и ждёт результат пакетного вызова"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((list(items), future))
+        self.size += len(items)
+        if self.size >= self.limit:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending, self.size = self.pending, [], 0
+
+        # Пачки по limit элементов; вызовы одного ожидающего не делятся между пачками
+        batch, batch_size = [], 0
+        for items, future in pending:
+            if batch and batch_size + len(items) > self.limit:
+                asyncio.ensure_future(self._send(batch))
+                batch, batch_size = [], 0
+            batch.append((items, future))
+            batch_size += len(items)
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch: list):
+        items = [item for batch_items, _ in batch for item in batch_items]
+        metrics.inc('coalesced_calls_total', len(batch), operation=self.name, account=self.account_id)
+        metrics.inc('coalesced_requests_total', operation=self.name, account=self.account_id)
+        try:
+            result = await self.send(items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(result)
@@ -13,3 +13,95 @@ LEVERAGE_RANDOM_MAX = 5  # Максимальное плечо
 TELEGRAM_BOT_TOKEN = "твои значения"
 
 TELEGRAM_CHAT_ID = "твои значения"
+
+# Интервал keep-alive соединений с MEXC (сек): простаивающие дольше соединения пингуются
+KEEP_ALIVE_INTERVAL = 20
+
+# Максимум параллельных запросов истории при сборе отчётов
+REPORT_CONCURRENCY = 10
+
+# Подтверждение закрытия: опрос истории ордеров с нарастающей паузой
+CLOSE_CONFIRM_TIMEOUT = 20  # Максимальное время ожидания закрывающих ордеров (сек)
+CLOSE_CONFIRM_MIN_DELAY = 0.5  # Первая пауза между опросами (сек)
+CLOSE_CONFIRM_MAX_DELAY = 3  # Максимальная пауза между опросами (сек)
+CLOSE_CONFIRM_CLOCK_SKEW_MS = 2000  # Допуск расхождения часов с биржей (мс)
+
+# Уведомления Telegram
+TELEGRAM_QUEUE_SIZE = 100  # Размер очереди сообщений (лишние отбрасываются)
+TELEGRAM_DIGEST_WINDOW = 2  # Окно склейки всплеска событий в один дайджест (сек)
+TELEGRAM_MIN_INTERVAL = 3  # Минимальный интервал между сообщениями в чат (сек)
+
+# Кэш позиций ведомых аккаунтов (закрытие без запроса позиций у биржи)
+LEDGER_MAX_AGE = 120  # Возраст записи, после которого позиция перезапрашивается (сек)
+LEDGER_RECONCILE_INTERVAL = 30  # Период сверки кэша с биржей (сек)
+LEDGER_REFRESH_DELAY = 1  # Задержка сверки после открытия позиции (сек)
+
+# Метрики задержек и пропускной способности
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108  # Prometheus-эндпоинт http://METRICS_HOST:METRICS_PORT/metrics (0 - выключить)
+METRICS_DUMP_FILE = "metrics.json"  # Периодический JSON-снимок метрик ("" - выключить)
+METRICS_DUMP_INTERVAL = 60  # Период записи JSON-снимка (сек)
+
+# Трассировки событий главного аккаунта с correlation ID (JSON Lines, "" - выключить)
+TRACE_FILE = "traces.jsonl"
+
+# Обработка событий главного аккаунта: число воркеров, рассылающих действия ведомым
+ACTION_WORKERS = 8
+
+# Приватный WebSocket-поток главного аккаунта вместо частого опроса (опрос остаётся страховкой)
+MASTER_STREAM_ENABLED = False
+MASTER_STREAM_POLL_INTERVAL = 5  # Страховочный опрос REST при подключённом потоке (сек)
+MASTER_STREAM_PING_INTERVAL = 15  # Ping в поток (сек); без ответов 3 интервала - переподключение
+MASTER_STREAM_RECONNECT_MAX_DELAY = 30  # Максимальная пауза между переподключениями (сек)
+
+# Планировщик запросов к бирже: ограничение одновременных запросов (0 - без ограничения).
+# Закрытия и отмены проходят раньше открытий, открытия - раньше отчётов
+DISPATCH_CONCURRENCY = 64  # Всего по всем аккаунтам
+DISPATCH_PROXY_CONCURRENCY = 4  # На один прокси
+
+# Повторы запросов к бирже: общий срок операции и таймаут одной попытки (сек).
+# Повторяются только сетевые ошибки, 5xx и ответы о превышении лимита (с учётом Retry-After)
+ORDER_REQUEST_DEADLINE = 5  # Создание, отмена и изменение ордеров
+ORDER_REQUEST_TIMEOUT = 1.5  # Создание: повтор безопасен, перед ним ордер ищется по externalOid
+ORDER_CHANGE_TIMEOUT = 2  # Отмена и изменение: повтор только после проверки открытых ордеров
+QUERY_REQUEST_DEADLINE = 15  # Позиции, ордера, история
+QUERY_REQUEST_TIMEOUT = 5
+RETRY_BASE_DELAY = 0.2  # Пауза перед повтором: случайная, растёт вдвое до RETRY_MAX_DELAY
+RETRY_MAX_DELAY = 2
+
+# Здоровье ведомых аккаунтов: после CIRCUIT_FAILURE_THRESHOLD неудачных операций подряд
+# (или отказа авторизации) аккаунт исключается из рассылок на CIRCUIT_OPEN_SECONDS,
+# затем пробуется в фоне и после восстановления досинхронизируется с главным
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_OPEN_SECONDS = 30
+HEALTH_PROBE_INTERVAL = 5  # Как часто проверять, не пора ли пробовать исключённые аккаунты (сек)
+
+# Журнал состояния копирования: позиции, ордера и связи с ордерами ведомых переживают перезапуск.
+# Изменения дописываются в журнал, каждые STATE_COMPACT_EVERY записей он сворачивается в снимок.
+# При старте состояние сверяется с живыми данными - недостающее досылается без дублей (None - без журнала)
+STATE_JOURNAL_FILE = "state.journal"
+STATE_SNAPSHOT_FILE = "state.snapshot.json"
+STATE_COMPACT_EVERY = 1000
+
+# Шардированный режим для больших парков ведомых: главный аккаунт опрашивает процесс-координатор,
+# ведомые распределяются по SHARD_PROCESSES процессам (аккаунты одного прокси - в одном процессе).
+# 0 или 1 - всё в одном процессе. Общий DISPATCH_CONCURRENCY делится между шардами
+SHARD_PROCESSES = 0
+# Отчёт о событии координатор отправляет, когда строки ведомых прислали все шарды, но не позже чем
+# через SHARD_REPORT_WAIT секунд (шард перезапускается или досылает событие один)
+SHARD_REPORT_WAIT = 15
+
+# Кэш истории исполненных ордеров аккаунта (отчёты): догружаются только ордера новее уже известных
+ORDER_HISTORY_PAGE_SIZE = 20  # Ордеров на страницу запроса
+ORDER_HISTORY_MAX_PAGES = 5  # Страниц за одно обновление
+ORDER_HISTORY_KEEP = 100  # Ордеров в кэше на символ и сторону
+
+# Окно объединения запросов аккаунта (секунды): отмены и запросы ордеров, пришедшие за это время,
+# уходят одним запросом к бирже
+COALESCE_WINDOW = 0.005
+
+# Сколько ждать позицию от исполненного лимитного ордера (сек): после этого отметка забывается
+LIMIT_MARKER_TTL = 300
+# Сколько исполнение лимитки в открытую позицию ждёт роста этой позиции (сек): рост на объём
+# исполнения не копируется по маркету, несовпавшее исполнение забывается с предупреждением
+LIMIT_FILL_TTL = 10
@@ -0,0 +1,94 @@
+import time
+from metrics import metrics
+
+CLOSED = 'closed'  # Аккаунт работает
+OPEN = 'open'  # Аккаунт исключён, запросы сразу отклоняются
+HALF_OPEN = 'half_open'  # Идёт проба - решается, вернуть ли аккаунт
+
+
+class AccountUnavailable(Exception):
+    """Запрос не отправлен: breaker аккаунта открыт"""
+
+
+class AccountHealth:
+    """Здоровье аккаунта (успехи, ошибки, задержка, авторизация) и circuit breaker.
+
+    После failure_threshold неудачных операций подряд или отказа авторизации breaker
+    открывается: запросы аккаунта отклоняются сразу, рассылки его пропускают. Через
+    open_seconds фоновая проба решает, вернуть ли аккаунт.
+    """
+
+    def __init__(self, account_id: str, failure_threshold: int = 3, open_seconds: float = 30, breaker: bool = True):
+        self.account_id = account_id
+        self.breaker = breaker  # False - только статистика, аккаунт не исключается (главный)
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.successes = 0
+        self.failures = 0
+        self.auth_failures = 0
+        self.consecutive_failures = 0
+        self.latency = None  # Скользящее среднее длительности успешных запросов (сек)
+        self.last_error = None
+        self.opened_at = 0.0
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    @property
+    def available(self):
+        """Аккаунт участвует в рассылках"""
+        return self.state == CLOSED
+
+    def allow_request(self):
+        return self.state != OPEN
+
+    @property
+    def success_rate(self):
+        total = self.successes + self.failures
+        return self.successes / total if total else None
+
+    def record_success(self, seconds: float):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.latency = seconds if self.latency is None else self.latency * 0.8 + seconds * 0.2
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+
+    def record_failure(self, cause: str):
+        """Операция не удалась после всех повторов"""
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = cause
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def record_auth_failure(self):
+        """u_id истёк или отозван - повторы бесполезны до восстановления"""
+        self.auth_failures += 1
+        self.failures += 1
+        self.last_error = 'auth'
+        self._open()
+
+    def probe_due(self):
+        return self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds
+
+    def start_probe(self):
+        self._set_state(HALF_OPEN)
+
+    def _open(self):
+        if not self.breaker:
+            return
+        self.opened_at = time.monotonic()
+        if self.state != OPEN:
+            self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        previous, self.state = self.state, state
+        metrics.inc('account_breaker_transitions_total', account=self.account_id, state=state)
+        if state == OPEN:
+            print(f"🔌 Аккаунт {self.account_id} исключён из рассылок "
+                  f"(ошибок подряд: {self.consecutive_failures}, последняя: {self.last_error})")
+        elif state == CLOSED and previous != CLOSED:
+            print(f"🔋 Аккаунт {self.account_id} снова доступен")
@@ -0,0 +1,93 @@
+import asyncio
+from metrics import metrics
+
+OPEN_SIDES = (1, 3)
+CLOSE_SIDES = (2, 4)
+
+
+class OrderHistory:
+    """Локальная история исполненных ордеров аккаунта.
+
+    Индексы: orderId -> ордер и (символ, сторона) -> ордера, новые первыми. По каждому
+    символу хранится отметка createTime самого нового ордера: обновление запрашивает
+    страницы, пока не дойдёт до уже известных ордеров. Одновременные обновления одного
+    символа разделяют один запрос.
+    """
+
+    def __init__(self, mexc, page_size: int = 20, max_pages: int = 5, keep: int = 100):
+        self.mexc = mexc
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.keep = keep  # Ордеров на (символ, сторону); старые вытесняются
+        self.orders = {}  # {orderId: ордер}
+        self.by_key = {}  # {(symbol, side): [ордер, ...]} - новые первыми
+        self.high_water = {}  # {symbol: createTime самого нового ордера}
+        self.inflight = {}  # {symbol: задача обновления}
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    async def refresh(self, symbol: str):
+        """Догружает новые ордера символа; если обновление уже идёт - ждёт его"""
+        task = self.inflight.get(symbol)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(symbol))
+            self.inflight[symbol] = task
+            task.add_done_callback(lambda _: self.inflight.pop(symbol, None))
+        else:
+            metrics.inc('order_history_shared_total', account=self.mexc.account_id)
+        # Отмена одного ожидающего не должна отменять общий запрос
+        await asyncio.shield(task)
+
+    async def _fetch(self, symbol: str):
+        high_water = self.high_water.get(symbol)
+        for page_num in range(1, self.max_pages + 1):
+            orders = await self.mexc.get_order_history(symbol, limit=self.page_size, page_num=page_num)
+            metrics.inc('order_history_pages_total', account=self.mexc.account_id)
+            self.add(orders)
+            # Без отметки достаточно последней страницы; дальше - пока страница целиком новая
+            if high_water is None or len(orders) < self.page_size or \
+                    min(order.get('createTime', 0) for order in orders) <= high_water:
+                break
+
+    def add(self, orders: list):
+        changed = set()
+        for order in orders:
+            order_id = order.get('orderId')
+            if order_id is None:
+                continue
+            key = (order.get('symbol'), order.get('side'))
+            previous = self.orders.get(order_id)
+            if previous is not None:
+                self.by_key[key].remove(previous)
+            self.orders[order_id] = order
+            self.by_key.setdefault(key, []).append(order)
+            changed.add(key)
+            created = order.get('createTime', 0)
+            if created > self.high_water.get(key[0], 0):
+                self.high_water[key[0]] = created
+
+        for key in changed:
+            indexed = self.by_key[key]
+            indexed.sort(key=lambda order: order.get('createTime', 0), reverse=True)
+            for order in indexed[self.keep:]:
+                self.orders.pop(order.get('orderId'), None)
+            del indexed[self.keep:]
+
+    def get(self, order_id):
+        return self.orders.get(order_id)
+
+    def latest(self, symbol: str, sides=OPEN_SIDES, since_ms: int = None, before_ms: int = None):
+        """Самый новый исполненный ордер символа со стороной из sides (createTime в [since_ms, before_ms))"""
+        return next(iter(self.filled(symbol, sides, since_ms, before_ms)), None)
+
+    def filled(self, symbol: str, sides=OPEN_SIDES, since_ms: int = None, before_ms: int = None):
+        """Исполненные ордера символа со сторонами из sides, новые первыми"""
+        orders = [order for side in sides for order in self.by_key.get((symbol, side), ())
+                  if order.get('dealVol', 0) > 0 and
+                  (since_ms is None or order.get('createTime', 0) >= since_ms) and
+                  (before_ms is None or order.get('createTime', 0) < before_ms)]
+        if len(sides) > 1:
+            orders.sort(key=lambda order: order.get('createTime', 0), reverse=True)
+        return orders
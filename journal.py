@@ -0,0 +1,99 @@
+import json
+import os
+
+
+class StateJournal:
+    """Журнал состояния копирования: append-only JSON Lines поверх периодического снимка.
+
+    Состояние - словарь секций {секция: {ключ: значение}}. write() дописывает в журнал
+    только изменения с прошлой записи; после compact_every записей состояние целиком
+    сохраняется в снимок (атомарной заменой файла), а журнал начинается заново.
+    Ключи хранятся в JSON как есть, списки при загрузке становятся кортежами.
+    """
+
+    def __init__(self, path: str, snapshot_path: str, compact_every: int = 1000):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.compact_every = compact_every
+        self.state = {}  # Последнее записанное состояние
+        self.records = 0  # Записей в журнале после снимка
+        self.file = None
+
+    def load(self) -> dict:
+        """Снимок + изменения из журнала. Оборванная при падении последняя строка пропускается"""
+        state = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as file:
+                snapshot = json.load(file)
+            for section, items in snapshot.items():
+                state[section] = {self._key(key): value for key, value in items}
+
+        records = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        print(f"⚠️ Пропущена повреждённая запись журнала: {line[:100]!r}")
+                        continue
+                    items = state.setdefault(record['s'], {})
+                    if 'v' in record:
+                        items[self._key(record['k'])] = record['v']
+                    else:
+                        items.pop(self._key(record['k']), None)
+                    records += 1
+
+        self.state = state
+        self.records = records
+        return {section: dict(items) for section, items in state.items()}
+
+    @staticmethod
+    def _key(key):
+        return tuple(key) if isinstance(key, list) else key
+
+    def write(self, state: dict):
+        """Дописывает отличия state от последнего записанного состояния"""
+        lines = []
+        for section in set(state) | set(self.state):
+            new = state.get(section, {})
+            old = self.state.get(section, {})
+            for key, value in new.items():
+                if key not in old or old[key] != value:
+                    lines.append(json.dumps({'s': section, 'k': key, 'v': value}, separators=(',', ':')))
+            for key in old.keys() - new.keys():
+                lines.append(json.dumps({'s': section, 'k': key}, separators=(',', ':')))
+        if not lines:
+            return
+
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+        self.state = {section: dict(items) for section, items in state.items()}
+        self.records += len(lines)
+
+        if self.records >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Снимок текущего состояния и пустой журнал"""
+        snapshot = {section: [[key, value] for key, value in items.items()]
+                    for section, items in self.state.items()}
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(snapshot, file, separators=(',', ':'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # Журнал очищаем только после того, как снимок надёжно на диске
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path, 'w')
+        self.records = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+
+class PositionLedger:
+    """Кэш позиций ведомых аккаунтов: (аккаунт, символ, сторона) -> позиция
+
+    Заполняется из ответов на создание ордеров и периодической сверкой с биржей,
+    чтобы закрытие не требовало запроса позиций всех аккаунтов.
+    """
+
+    def __init__(self, max_age: float = 120):
+        self.max_age = max_age
+        # {(account_id, symbol, side): {'positionId', 'vol', 'leverage', 'openType', 'orderId', 'updated'}}
+        self.entries = {}
+        # {(account_id, symbol, side): [orderId открывающих ордеров]} - для отчёта о закрытии, сверка их не трогает
+        self.open_order_ids = {}
+        # {(account_id, symbol, side): объём ведомого / объём главного при открытии} - для доборов и частичных закрытий
+        self.ratios = {}
+
+    def record_order(self, mexc, symbol, side, leverage, vol, open_type, response, master_vol=None):
+        """Запоминает открытие по ответу order/create (positionId придёт при сверке).
+        master_vol - объём главного при открытии позиции: по нему запоминается пропорция ведомого"""
+        try:
+            r_json = response.json()
+        except Exception:
+            return
+        if not r_json.get("success"):
+            return
+
+        key = (mexc.account_id, symbol, side)
+        order_id = (r_json.get('data') or {}).get('orderId')
+        if order_id:
+            self.open_order_ids.setdefault(key, []).append(order_id)
+        if master_vol:
+            self.ratios[key] = vol / master_vol
+        entry = self.entries.get(key, {})
+        entry.update({
+            'positionId': entry.get('positionId'),
+            'vol': entry.get('vol', 0) + vol if entry.get('positionId') else vol,
+            'leverage': leverage,
+            'openType': open_type,
+            'orderId': order_id,
+            # Объём мог измениться - позиция требует сверки
+            'updated': 0.0,
+        })
+        self.entries[key] = entry
+
+    def update_from_positions(self, mexc, positions: list):
+        """Заменяет записи аккаунта живыми данными get_open_positions. Позиции, которые были
+        открыты и исчезли (стоп-лосс, ликвидация на ведомом), забываются вместе с их ордерами"""
+        now = time.monotonic()
+        live = {(mexc.account_id, position['symbol'], position['side']) for position in positions}
+        for key in [key for key in self.entries if key[0] == mexc.account_id]:
+            # Запись без positionId - открытие, которое могло ещё не дойти до позиций
+            if key not in live and self.entries[key]['positionId']:
+                self.open_order_ids.pop(key, None)
+                self.ratios.pop(key, None)
+            del self.entries[key]
+
+        for position in positions:
+            self.entries[(mexc.account_id, position['symbol'], position['side'])] = {
+                'positionId': position['positionId'],
+                'vol': position['vol'],
+                'leverage': position['leverage'],
+                'openType': position['openType'],
+                'orderId': None,
+                'updated': now,
+            }
+
+    def get(self, mexc, symbol, side):
+        """Свежая запись с известным positionId или None"""
+        entry = self.entries.get((mexc.account_id, symbol, side))
+        if not entry or not entry['positionId']:
+            return None
+        if time.monotonic() - entry['updated'] > self.max_age:
+            return None
+        return entry
+
+    def remove(self, mexc, symbol, side):
+        self.entries.pop((mexc.account_id, symbol, side), None)
+        self.ratios.pop((mexc.account_id, symbol, side), None)
+
+    def adjust(self, mexc, symbol, side, vol_delta):
+        """Добор или частичное закрытие: объём меняется сразу, точные данные - при сверке"""
+        entry = self.entries.get((mexc.account_id, symbol, side))
+        if entry is not None:
+            entry['vol'] = max(0, entry['vol'] + vol_delta)
+            entry['updated'] = 0.0
+
+    def invalidate(self, mexc, symbol, side):
+        """Исход ордера неясен (ошибка, таймаут) - запись аккаунта требует сверки"""
+        entry = self.entries.get((mexc.account_id, symbol, side))
+        if entry is not None:
+            entry['updated'] = 0.0
+
+    def mark_stale(self, symbol, side):
+        """Объём позиций символа мог измениться без нашего ордера (исполнилась копия лимитки,
+        главный изменил объём) - записи всех аккаунтов требуют сверки перед закрытием"""
+        for key, entry in self.entries.items():
+            if key[1] == symbol and key[2] == side:
+                entry['updated'] = 0.0
+
+    def ratio(self, mexc, symbol, side, master_vol):
+        """Пропорция объёма ведомого к главному: записанная при открытии, иначе по текущим объёмам"""
+        key = (mexc.account_id, symbol, side)
+        if key in self.ratios:
+            return self.ratios[key]
+        entry = self.entries.get(key)
+        if entry is None or not master_vol:
+            return None
+        return entry['vol'] / master_vol
+
+    def pop_open_orders(self, mexc, symbol, side) -> list:
+        """orderId открывающих ордеров позиции (позиция закрывается - список больше не нужен)"""
+        return self.open_order_ids.pop((mexc.account_id, symbol, side), [])
+
+    async def refresh(self, mexc):
+        positions = await mexc.get_open_positions()
+        self.update_from_positions(mexc, positions)
+        return positions
+
+    async def reconcile(self, mexcs: list, concurrency: int = 10):
+        """Сверка кэша с биржей для списка аккаунтов"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def refresh_one(mexc):
+            async with semaphore:
+                try:
+                    await self.refresh(mexc)
+                except Exception as e:
+                    print(f"⚠️ Ошибка сверки позиций аккаунта {mexc.account_id}: {e}")
+
+        await asyncio.gather(*[refresh_one(mexc) for mexc in mexcs])
+
+    async def run(self, mexcs: list, interval: float, concurrency: int = 10):
+        """Периодическая сверка в фоне"""
+        while True:
+            await self.reconcile(mexcs, concurrency)
+            await asyncio.sleep(interval)
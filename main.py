@@ -1,8 +1,21 @@
 import asyncio
-from api.mexc import Mexc
+import collections
+from api.mexc import Mexc, client_order_id, FUTURES_HOST, WWW_HOST
+from notifier import TelegramNotifier
+from ledger import PositionLedger
+from stream import MasterStream
+from journal import StateJournal
+from shards import Channel, ShardProcess, split_accounts
+from retry import ORDER_POLICY, ORDER_CHANGE_POLICY, QUERY_POLICY
+from health import HALF_OPEN
+from history import OPEN_SIDES, CLOSE_SIDES
+from records import PositionRecord, OrderRecord
+from scheduler import scheduler, current_priority, dispatch_priority, PRIORITY_CLOSE, PRIORITY_OPEN, PRIORITY_REPORT
+from metrics import metrics, process_memory_bytes
+from tracing import tracer, current_trace, span, tag, run_traced, finish_trace
 import os
-import requests
 import random
+import time
 from config import (
     DELAY_BETWEEN_CHECK_POSITIONS,
     VOL_RANDOM_MIN,
@@ -10,26 +23,111 @@ from config import (
     LEVERAGE_RANDOM_MIN,
     LEVERAGE_RANDOM_MAX,
     TELEGRAM_CHAT_ID,
-    TELEGRAM_BOT_TOKEN
+    TELEGRAM_BOT_TOKEN,
+    KEEP_ALIVE_INTERVAL,
+    REPORT_CONCURRENCY,
+    CLOSE_CONFIRM_TIMEOUT,
+    CLOSE_CONFIRM_MIN_DELAY,
+    CLOSE_CONFIRM_MAX_DELAY,
+    CLOSE_CONFIRM_CLOCK_SKEW_MS,
+    TELEGRAM_QUEUE_SIZE,
+    TELEGRAM_DIGEST_WINDOW,
+    TELEGRAM_MIN_INTERVAL,
+    LEDGER_MAX_AGE,
+    LEDGER_RECONCILE_INTERVAL,
+    LEDGER_REFRESH_DELAY,
+    METRICS_HOST,
+    METRICS_PORT,
+    METRICS_DUMP_FILE,
+    METRICS_DUMP_INTERVAL,
+    TRACE_FILE,
+    ACTION_WORKERS,
+    MASTER_STREAM_ENABLED,
+    MASTER_STREAM_POLL_INTERVAL,
+    MASTER_STREAM_PING_INTERVAL,
+    MASTER_STREAM_RECONNECT_MAX_DELAY,
+    DISPATCH_CONCURRENCY,
+    DISPATCH_PROXY_CONCURRENCY,
+    ORDER_REQUEST_DEADLINE,
+    ORDER_REQUEST_TIMEOUT,
+    ORDER_CHANGE_TIMEOUT,
+    QUERY_REQUEST_DEADLINE,
+    QUERY_REQUEST_TIMEOUT,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_OPEN_SECONDS,
+    HEALTH_PROBE_INTERVAL,
+    STATE_JOURNAL_FILE,
+    STATE_SNAPSHOT_FILE,
+    STATE_COMPACT_EVERY,
+    SHARD_PROCESSES,
+    SHARD_REPORT_WAIT,
+    ORDER_HISTORY_PAGE_SIZE,
+    ORDER_HISTORY_MAX_PAGES,
+    ORDER_HISTORY_KEEP,
+    COALESCE_WINDOW,
+    LIMIT_MARKER_TTL,
+    LIMIT_FILL_TTL
 )
 
+ORDER_FILLED = 3  # state ордера: исполнен
+ORDER_FINAL_STATES = (3, 4)  # Исполнен или отменён - дальше не изменится
+
 # === TELEGRAM ===
 
+# Уведомления уходят через очередь фоновым отправителем и не блокируют event loop
+notifier = TelegramNotifier(
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+    queue_size=TELEGRAM_QUEUE_SIZE,
+    digest_window=TELEGRAM_DIGEST_WINDOW,
+    min_interval=TELEGRAM_MIN_INTERVAL
+)
+
 
 async def send_telegram_message(message):
-    """Отправка сообщения в Telegram"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': TELEGRAM_CHAT_ID,
-        'text': message,
-        'parse_mode': 'HTML'
-    }
+    """Отправка сообщения в Telegram (в очередь нотификатора)"""
+    notifier.notify(message)
+
+
+# Шард отчёты не отправляет: report_sink(вид, [(ключ события, данные события, строки ведомых)])
+# передаёт строки координатору, общий отчёт с главным аккаунтом собирает он. None - отчёт отправляется здесь
+report_sink = None
+
+
+# Кэш позиций ведомых аккаунтов для быстрого закрытия
+ledger = PositionLedger(max_age=LEDGER_MAX_AGE)
+
+# Фоновые задачи (отчёты и т.п.) - храним ссылки, чтобы задачи не собрал GC
+background_tasks = set()
+
+
+def _on_background_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        print(f"❌ Ошибка фоновой задачи: {task.exception()}")
+
+
+def spawn(coro):
+    """Запускает корутину в фоне, не блокируя основной цикл"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_on_background_done)
+    return task
+
+
+async def timed_order(action, mexc: Mexc, coro, fanout_started):
+    """Замер ордера ведомого: задержка от начала рассылки до отправки и время до ответа биржи"""
+    sent = time.perf_counter()
+    metrics.observe('order_dispatch_seconds', sent - fanout_started, action=action, account=mexc.account_id)
     try:
-        response = requests.post(url, json=payload, timeout=10)
-        if response.status_code != 200:
-            print(f"❌ Ошибка отправки в Telegram: {response.text}")
-    except Exception as e:
-        print(f"❌ Ошибка отправки в Telegram: {e}")
+        with span('dispatch', action=action, account=mexc.account_id):
+            return await coro
+    finally:
+        metrics.observe('order_ack_seconds', time.perf_counter() - sent,
+                        action=action, account=mexc.account_id, proxy=mexc.proxy_label)
+
 
 def load_accounts():
     accounts = []
@@ -49,27 +147,48 @@ def load_accounts():
     return accounts
 
 
-async def open_positions(main_mexc, mexcs: list[Mexc], symbol, side, leverage, stop_loss_price, vol, open_type):
+def _ms(seconds):
+    return f"{seconds * 1000:.0f} ms" if seconds is not None else "—"
+
+
+async def warm_up_accounts(main_mexc: Mexc, mexcs: list[Mexc]):
+    """Прогрев соединений и проверка u_id всех аккаунтов одновременно - до первой сделки.
+    Печатает отчёт о готовности: время установки соединений и проверки по каждому аккаунту"""
+    started = time.perf_counter()
+    # main_mexc=None - шард: главный аккаунт прогревает координатор
+    accounts = ([main_mexc] if main_mexc is not None else []) + mexcs
+    reports = await asyncio.gather(*[mexc.warm_up() for mexc in accounts])
+
+    print("📶 Готовность аккаунтов (futures | www | проверка u_id):")
+    ready = 0
+    for n, (mexc, report) in enumerate(zip(accounts, reports), len(mexcs) - len(accounts) + 1):
+        label = "главный" if n == 0 else f"#{n}"
+        hosts = report['hosts']
+        line = (f"{label} {mexc.account_id} [{mexc.proxy_label}]: {_ms(hosts.get(FUTURES_HOST))} | "
+                f"{_ms(hosts.get(WWW_HOST))} | {_ms(report['auth'])}")
+        if report['error'] is None:
+            ready += n > 0
+            print(f"  ✅ {line}")
+        else:
+            print(f"  ❌ {line} - {report['error']}")
+    if main_mexc is not None and reports[0]['error'] is not None:
+        print(f"❌ Главный аккаунт не готов: {reports[0]['error']}")
+
+    slowest = max((seconds for report in reports for seconds in report['hosts'].values() if seconds is not None),
+                  default=None)
+    print(f"📶 Готово {ready}/{len(mexcs)} ведомых за {time.perf_counter() - started:.2f}s, "
+          f"самое долгое соединение {_ms(slowest)}\n")
+    metrics.observe('startup_warm_up_seconds', time.perf_counter() - started)
+
+
+async def open_positions(main_mexc, mexcs: list[Mexc], symbol, side, leverage, stop_loss_price, vol, open_type,
+                         event_id=None):
     tasks = []
     print(
         f"🚀 Открываем позицию {symbol} ({side}) для всех аккаунтов | SL={stop_loss_price} | базовый vol={vol} | базовый leverage={leverage} | openType={open_type}")
 
-    # Получаем текущую цену и маржу для главного аккаунта из истории ордеров
-    main_margin = "N/A"
-    main_entry_price = "N/A"
-
-    try:
-        main_orders = await main_mexc.get_order_history(symbol, limit=5)
-        # Ищем последний открывающий ордер
-        open_orders = [order for order in main_orders if order.get('side') in [1, 3] and order.get('state') == 3]
-        if open_orders:
-            latest_open = open_orders[0]
-            main_entry_price = latest_open.get('dealAvgPrice', latest_open.get('dealAvgPriceStr', 'N/A'))
-            main_margin = latest_open.get('orderMargin', 'N/A')
-    except Exception as e:
-        print(f"⚠️ Ошибка получения данных главного аккаунта: {e}")
-
     account_results = []
+    fanout_started = time.perf_counter()
 
     for mexc in mexcs:
         # Генерируем случайный leverage для каждого аккаунта
@@ -84,43 +203,118 @@ async def open_positions(main_mexc, mexcs: list[Mexc], symbol, side, leverage, s
 
         print(f"  📊 Аккаунт: leverage={random_leverage}, vol={random_vol} ({vol_change_percent:+d}%)")
 
-        tasks.append(mexc.open_position(
-            symbol, side, random_leverage, stop_loss_price, random_vol, open_type))
+        # externalOid из события: повтор после таймаута не откроет вторую позицию
+        external_oid = client_order_id(event_id, mexc.account_id) if event_id else None
+        tasks.append(timed_order('open', mexc, mexc.open_position(
+            symbol, side, random_leverage, stop_loss_price, random_vol, open_type, external_oid), fanout_started))
         account_results.append((random_leverage, random_vol))
 
-    results = await asyncio.gather(*tasks)
+    # Сначала отправляем ордера, отчёт собирается в фоне и не держит основной цикл
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    for mexc, (acc_leverage, acc_vol), result in zip(mexcs, account_results, results):
+        ledger.record_order(mexc, symbol, side, acc_leverage, acc_vol, open_type, result, master_vol=vol)
+
+    spawn(refresh_ledger_later(mexcs))
+    spawn(report_open_positions(main_mexc, mexcs, account_results, symbol, side, leverage,
+                                [response_order_id(result) for result in results], event_id))
+    return results
+
+
+async def refresh_ledger_later(mexcs: list[Mexc]):
+    """Подтягивает positionId новых позиций в кэш, чтобы закрытие не ходило за позициями"""
+    # Сверка не относится к событию - не засоряем его трассировку и не мешаем ордерам
+    current_trace.set(None)
+    current_priority.set(PRIORITY_REPORT)
+    await asyncio.sleep(LEDGER_REFRESH_DELAY)
+    await ledger.reconcile(mexcs, REPORT_CONCURRENCY)
+
+
+async def get_latest_open_data(mexc: Mexc, symbol, semaphore: asyncio.Semaphore, order_id=None):
+    """Цена входа и маржа открывающего ордера: по его orderId, иначе последнего из истории"""
+    latest_open = None
+    if order_id is not None:
+        async with semaphore:
+            orders = await mexc.query_orders([order_id])
+        latest_open = next((order for order in orders if order.get('state') == ORDER_FILLED), None)
+
+    if latest_open is None:
+        # Ордер неизвестен (главный аккаунт) или ещё не исполнен - последний открывающий из истории
+        async with semaphore:
+            await mexc.history.refresh(symbol)
+        latest_open = mexc.history.latest(symbol, OPEN_SIDES)
+    if latest_open is None:
+        return "N/A", "N/A"
+
+    entry_price = latest_open.get('dealAvgPrice', latest_open.get('dealAvgPriceStr', 'N/A'))
+    margin = latest_open.get('orderMargin', 'N/A')
+    return entry_price, margin
+
+
+async def report_open_positions(main_mexc, mexcs: list[Mexc], account_results, symbol, side, leverage,
+                                order_ids=None, event_id=None):
+    """Фоновый отчёт об открытии: данные всех аккаунтов собираются параллельно.
+    order_ids - orderId ордеров ведомых из ответов order/create"""
+    current_priority.set(PRIORITY_REPORT)
+    semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+    try:
+        with metrics.timer('report_seconds', kind='open'), span('report', kind='open'):
+            if report_sink is not None:
+                slave_data = await open_slave_data(mexcs, account_results, symbol, semaphore, order_ids)
+            else:
+                (main_entry_price, main_margin), slave_data = await asyncio.gather(
+                    open_main_data(main_mexc, symbol, semaphore),
+                    open_slave_data(mexcs, account_results, symbol, semaphore, order_ids)
+                )
+    finally:
+        # Отчёт - последний этап события
+        finish_trace()
+
+    if report_sink is not None:
+        report_sink('open', [(event_id, {'symbol': symbol, 'side': side, 'leverage': leverage}, slave_data)])
+        return
+    await send_telegram_message(open_report_message(symbol, side, leverage, main_entry_price, main_margin,
+                                                    slave_data))
+
+
+async def open_main_data(main_mexc: Mexc, symbol, semaphore: asyncio.Semaphore):
+    """Цена входа и маржа главного аккаунта - последний открывающий ордер из истории"""
+    try:
+        return await get_latest_open_data(main_mexc, symbol, semaphore)
+    except Exception as e:
+        print(f"⚠️ Ошибка получения данных главного аккаунта: {e}")
+        return "N/A", "N/A"
+
+
+async def open_slave_data(mexcs: list[Mexc], account_results, symbol, semaphore: asyncio.Semaphore,
+                          order_ids=None):
+    """Строки отчёта ведомых: плечо, объём, цена входа и маржа по orderId открывающих ордеров"""
+    order_ids = order_ids or [None] * len(mexcs)
+    all_data = await asyncio.gather(
+        *[get_latest_open_data(mexc, symbol, semaphore, order_id) for mexc, order_id in zip(mexcs, order_ids)],
+        return_exceptions=True
+    )
 
     # Получаем маржу и цены входа для ведомых аккаунтов из истории ордеров
     slave_data = []
-    for mexc, (acc_leverage, acc_vol) in zip(mexcs, account_results):
-        try:
-            orders = await mexc.get_order_history(symbol, limit=5)
-            # Ищем последний открывающий ордер
-            open_orders = [order for order in orders if order.get('side') in [1, 3] and order.get('state') == 3]
-
-            entry_price = "N/A"
-            margin = "N/A"
-
-            if open_orders:
-                latest_open = open_orders[0]
-                entry_price = latest_open.get('dealAvgPrice', latest_open.get('dealAvgPriceStr', 'N/A'))
-                margin = latest_open.get('orderMargin', 'N/A')
-
-            slave_data.append({
-                'leverage': acc_leverage,
-                'vol': acc_vol,
-                'entry_price': entry_price,
-                'margin': margin
-            })
-        except Exception as e:
-            print(f"⚠️ Ошибка получения данных аккаунта: {e}")
-            slave_data.append({
-                'leverage': acc_leverage,
-                'vol': acc_vol,
-                'entry_price': 'N/A',
-                'margin': 'N/A'
-            })
+    for data, (acc_leverage, acc_vol) in zip(all_data, account_results):
+        entry_price, margin = "N/A", "N/A"
+        if isinstance(data, Exception):
+            print(f"⚠️ Ошибка получения данных аккаунта: {data}")
+        else:
+            entry_price, margin = data
 
+        slave_data.append({
+            'leverage': acc_leverage,
+            'vol': acc_vol,
+            'entry_price': entry_price,
+            'margin': margin
+        })
+    return slave_data
+
+
+def open_report_message(symbol, side, leverage, main_entry_price, main_margin, slave_data):
+    """Текст отчёта об открытии позиции"""
     # Формируем сообщение для Telegram с реальной маржой
     side_text = "LONG📈" if side == 1 else "SHORT📉"
     message = f"🚀 Открытие позиции {symbol} {side_text} x{leverage}\n\n"
@@ -137,16 +331,15 @@ async def open_positions(main_mexc, mexcs: list[Mexc], symbol, side, leverage, s
             message += f"{i}) маржа = {float(margin):.2f} 💲, вход = {entry_price}\n"
         else:
             message += f"{i}) маржа = расчет недоступен, вход = {entry_price}\n"
-
-    await send_telegram_message(message)
-    return results
+    return message
 
 
-async def open_limit_orders(mexcs: list[Mexc], symbol, side, leverage, price, vol, open_type):
+async def open_limit_orders(mexcs: list[Mexc], symbol, side, leverage, price, vol, open_type, event_id=None):
     """Открыть лимитные ордера на всех аккаунтах"""
     tasks = []
     print(
         f"📝 Открываем лимитный ордер {symbol} ({side}) для всех аккаунтов | price={price} | базовый vol={vol} | базовый leverage={leverage} | openType={open_type}")
+    fanout_started = time.perf_counter()
 
     for mexc in mexcs:
         # Генерируем случайный leverage для каждого аккаунта
@@ -163,17 +356,20 @@ async def open_limit_orders(mexcs: list[Mexc], symbol, side, leverage, price, vo
         print(
             f"  📊 Аккаунт: leverage={random_leverage}, vol={random_vol} ({vol_change_percent:+d}%)")
 
-        tasks.append(mexc.open_position_limit(
-            symbol, side, random_leverage, price, random_vol, open_type))
+        external_oid = client_order_id(event_id, mexc.account_id) if event_id else None
+        tasks.append(timed_order('open_limit', mexc, mexc.open_position_limit(
+            symbol, side, random_leverage, price, random_vol, open_type, external_oid), fanout_started))
 
-    results = await asyncio.gather(*tasks)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
     return results
 
 
-async def change_limit_orders(mexcs_orders: list, price: str, vol: int):
-    """Изменить лимитные ордера на всех аккаунтах. Возвращает новые order_id"""
+async def change_limit_orders(mexcs_orders: list, price: str, vol: int, symbol: str = None, linked: dict = None):
+    """Изменить лимитные ордера на всех аккаунтах. Возвращает новые order_id.
+    linked - {account_id: orderId ведомых, связанные с ордерами главного}"""
     tasks = []
     print(f"✏️ Изменяем лимитные ордера | price={price} | базовый vol={vol}")
+    fanout_started = time.perf_counter()
 
     for mexc, order_id in mexcs_orders:
         # Генерируем случайное изменение vol в процентах
@@ -186,9 +382,10 @@ async def change_limit_orders(mexcs_orders: list, price: str, vol: int):
         print(
             f"  📊 Изменяем ордер {order_id}: vol={random_vol} ({vol_change_percent:+d}%)")
 
-        tasks.append(mexc.change_limit_order(order_id, price, random_vol))
+        tasks.append(timed_order('change_limit', mexc, mexc.change_limit_order(
+            order_id, price, random_vol, symbol, (linked or {}).get(mexc.account_id, ())), fanout_started))
 
-    results = await asyncio.gather(*tasks)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
 
     # Парсим новые orderId из ответов
     new_orders = []
@@ -209,533 +406,1801 @@ async def change_limit_orders(mexcs_orders: list, price: str, vol: int):
 
 async def cancel_limit_orders(mexcs_orders: list):
     """Отменить лимитные ордера на всех аккаунтах"""
+    # Один запрос на аккаунт; отмены других ордеров в том же окне к нему присоединяются
+    by_account = {}
+    for mexc, order_id in mexcs_orders:
+        by_account.setdefault(mexc, []).append(order_id)
     tasks = []
-    print(f"🚫 Отменяем лимитные ордера на {len(mexcs_orders)} аккаунтах")
+    print(f"🚫 Отменяем лимитные ордера на {len(by_account)} аккаунтах")
+    fanout_started = time.perf_counter()
 
-    for mexc, order_id in mexcs_orders:
-        tasks.append(mexc.cancel_order([order_id]))
+    for mexc, order_ids in by_account.items():
+        tasks.append(timed_order('cancel', mexc, mexc.cancel_orders(order_ids), fanout_started))
 
-    results = await asyncio.gather(*tasks)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
     return results
 
 
-# Обновленная функция close_positions с использованием истории ордеров
-async def close_positions(main_mexc, mexcs: list[Mexc], symbol, side, leverage, vol, open_type, main_position_data=None):
-    close_side = 4 if side == 1 else 2
+def response_success(result):
+    try:
+        return bool(result.json().get("success"))
+    except Exception:
+        return False
 
-    # Включаем главный аккаунт в список всех аккаунтов
-    all_mexcs = [main_mexc] + mexcs
-    print(f"🔍 Всего аккаунтов для проверки: {len(all_mexcs)} (главный + {len(mexcs)} ведомых)")
 
-    # Получаем позиции для всех аккаунтов
-    all_positions = await asyncio.gather(*[mexc.get_open_positions() for mexc in all_mexcs])
+def response_order_id(result):
+    """orderId из ответа order/create или None"""
+    try:
+        r_json = result.json()
+    except Exception:
+        return None
+    if not r_json.get("success"):
+        return None
+    return (r_json.get("data") or {}).get("orderId")
 
-    close_tasks = []
-    account_info = []
 
-    print(f"🔍 Поиск позиций {symbol} side={side} для закрытия...")
+async def close_account_position(mexc: Mexc, close: dict, from_cache: bool, i, total, fanout_started):
+    """Закрывает позицию ведомого аккаунта по кэшу позиций"""
+    symbol, side, event_id = close['symbol'], close['side'], close['event_id']
+    entry = ledger.get(mexc, symbol, side)
+    if entry is None:
+        print(f"    ❌ Позиция {symbol} ({side}) не найдена на ведомом аккаунте {i}")
+        return None
 
-    # Обрабатываем ВЕДОМЫЕ аккаунты - ищем открытые позиции
-    for i, (mexc, positions) in enumerate(zip(all_mexcs[1:], all_positions[1:]), 1):  # Пропускаем главный
-        is_main = False
+    print(f"    ✅ Найдена позиция {entry['positionId']} на ведомом аккаунте {i} "
+          f"(leverage={entry['leverage']}, vol={entry['vol']}{', из кэша' if from_cache else ''})")
 
-        print(f"  👤 Проверка ведомого аккаунта {i}/{len(mexcs)}")
-        print(f"    📊 Найдено позиций: {len(positions)}")
+    try:
+        external_oid = client_order_id(event_id, mexc.account_id) if event_id else None
+        result = await timed_order('close', mexc, mexc.close_position(
+            symbol, entry['positionId'], entry['leverage'], entry['vol'], close['close_side'], entry['openType'],
+            external_oid), fanout_started)
+
+        if from_cache and not response_success(result):
+            # Кэш мог разойтись с биржей - повторяем по живым данным
+            print(f"    🔄 Закрытие по кэшу не прошло на ведомом аккаунте {i}, сверяем позиции...")
+            await ledger.refresh(mexc)
+            live_entry = ledger.get(mexc, symbol, side)
+            if live_entry:
+                entry = live_entry
+                # Первый ордер отклонён - у повторного свой externalOid
+                external_oid = client_order_id(f"{event_id}:live", mexc.account_id) if event_id else None
+                result = await timed_order('close', mexc, mexc.close_position(
+                    symbol, entry['positionId'], entry['leverage'], entry['vol'], close['close_side'],
+                    entry['openType'], external_oid), fanout_started)
+    except Exception as e:
+        result = e
 
-        position_found = False
-        for position in positions:
-            print(
-                f"    🔍 Проверка позиции: {position['symbol']} side={position['side']} vs нужная: {symbol} side={side}")
-
-            if (position['symbol'] == symbol and position['side'] == side):
-                position_found = True
-                position_id = position['positionId']
-                position_vol = position['vol']
-                position_leverage = position['leverage']
-                position_open_type = position['openType']
-
-                print(f"    ✅ Найдена позиция {position_id} на ведомом аккаунте "
-                      f"(leverage={position_leverage}, vol={position_vol})")
-
-                close_tasks.append(mexc.close_position(
-                    symbol, position_id, position_leverage, position_vol, close_side, position_open_type))
-
-                account_info.append({
-                    'mexc': mexc,
-                    'symbol': symbol,
-                    'side': side,
-                    'is_main': False,
-                    'position_id': position_id
-                })
-                break
-
-        if not position_found:
-            print(f"    ❌ Позиция {symbol} ({side}) не найдена на ведомом аккаунте {i}")
-
-    # ОСОБАЯ ОБРАБОТКА ГЛАВНОГО АККАУНТА
-    # Используем сохраненные данные, так как позиция уже могла быть закрыта
-    print("  👑 Обработка главного аккаунта (используем сохраненные данные)")
-    if main_position_data:
-        # Добавляем главный аккаунт в обработку, даже если позиция уже закрыта
-        account_info.append({
-            'mexc': main_mexc,
-            'symbol': symbol,
-            'side': side,
-            'is_main': True,
-            'position_id': main_position_data.get('positionId', 'unknown')
-        })
-        print(
-            f"    ✅ Главный аккаунт добавлен в обработку (позиция: {main_position_data.get('positionId', 'unknown')})")
+    if response_success(result):
+        ledger.remove(mexc, symbol, side)
     else:
-        print(f"    ⚠️ Нет сохраненных данных главного аккаунта")
-
-    print(f"📊 Аккаунтов в обработке: {len(account_info)}")
-    print(f"👑 Главных аккаунтов: {len([acc for acc in account_info if acc['is_main']])}")
-    print(f"👥 Ведомых аккаунтов: {len([acc for acc in account_info if not acc['is_main']])}")
-
-    if account_info:  # Если есть аккаунты для обработки (хотя бы главный)
-        # Увеличиваем задержку для обновления данных (ведомые аккаунты закрываются)
-        if close_tasks:
-            print("🔄 Закрытие позиций на ведомых аккаунтах...")
-            results = await asyncio.gather(*close_tasks, return_exceptions=True)
-
-            # Обрабатываем результаты закрытия
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    print(f"  ❌ Ошибка при закрытии позиции на ведомом аккаунте: {result}")
-                else:
-                    try:
-                        r_json = result.json()
-                        if r_json.get("success"):
-                            print(f"  ✅ Позиция успешно закрыта на ведомом аккаунте")
-                        else:
-                            print(f"  ❌ Ошибка закрытия позиции на ведомом аккаунте: {r_json}")
-                    except Exception as e:
-                        print(f"  ❌ Ошибка парсинга ответа с ведомого аккаунта: {e}")
-
-            print("⏳ Ожидание обновления данных (7 сек)...")
-            await asyncio.sleep(7)
-        else:
-            print("⏳ Ожидание обновления данных (5 сек)...")
-            await asyncio.sleep(5)
+        # Позиция могла остаться открытой - следующее закрытие или изменение сверит её с биржей
+        ledger.invalidate(mexc, symbol, side)
+    return entry['positionId'], result
 
-        # Получаем данные о марже и PNL из истории ордеров для ВСЕХ аккаунтов
-        account_results = []
-        print("📊 Сбор данных о закрытых позициях...")
 
-        for acc_info in account_info:
-            mexc = acc_info['mexc']
-            symbol = acc_info['symbol']
-            side = acc_info['side']
-            is_main = acc_info['is_main']
+async def close_account_positions(mexc: Mexc, closes: list, i, total, fanout_started):
+    """Закрывает позиции ведомого аккаунта из одного снимка позиций: кэш, а при устаревших
+    записях - один запрос позиций на все закрытия аккаунта"""
+    from_cache = all(ledger.get(mexc, close['symbol'], close['side']) is not None for close in closes)
+    if not from_cache:
+        print(f"  👤 Кэш позиций ведомого аккаунта {i}/{total} устарел, запрашиваем позиции...")
+        try:
+            await ledger.refresh(mexc)
+        except Exception as e:
+            print(f"    ❌ Ошибка получения позиций ведомого аккаунта {i}: {e}")
+            return [None] * len(closes)
+
+    return await asyncio.gather(*[
+        close_account_position(mexc, close, from_cache, i, total, fanout_started) for close in closes
+    ])
+
+
+def close_request(pos_info: dict, event_id=None) -> dict:
+    """Закрытие позиции главного аккаунта для close_positions"""
+    return {
+        'symbol': pos_info['symbol'],
+        'side': pos_info['side'],
+        'close_side': 4 if pos_info['side'] == 1 else 2,
+        'leverage': pos_info['leverage'],
+        'position_id': pos_info.get('positionId'),
+        'event_id': event_id,
+    }
+
+
+def main_close_info(main_mexc: Mexc, close: dict) -> dict:
+    """Главный аккаунт в отчёте о закрытии: его позиция уже закрыта, данные берутся из истории"""
+    return {
+        'mexc': main_mexc,
+        'symbol': close['symbol'],
+        'side': close['side'],
+        'is_main': True,
+        'position_id': close['position_id']
+    }
 
-            try:
-                print(f"  🔍 Получение истории ордеров для {'главного' if is_main else 'ведомого'} аккаунта...")
-
-                # Получаем историю ордеров
-                orders = await mexc.get_order_history(symbol, limit=50)
-
-                if not orders:
-                    print(f"    ⚠️ История ордеров пуста для {'главного' if is_main else 'ведомого'} аккаунта")
-                    account_results.append({
-                        'is_main': is_main,
-                        'margin': 'N/A',
-                        'pnl': 'N/A',
-                        'entry_price': 'N/A',
-                        'exit_price': 'N/A'
-                    })
-                    continue
 
-                # Ищем закрывающие ордера (side 2 или 4)
-                close_orders = []
-                for order in orders:
-                    if (order.get('state') == 3 and  # Выполненный ордер
-                            order.get('side') in [2, 4] and  # Закрывающие стороны
-                            order.get('symbol') == symbol and  # Тот же символ
-                            order.get('dealVol', 0) > 0):  # Есть объем сделки
-                        close_orders.append(order)
-
-                # Ищем открывающие ордера (side 1 или 3) - БОЛЕЕ ТОЧНЫЙ ПОИСК
-                open_orders = []
-                for order in orders:
-                    if (order.get('state') == 3 and  # Выполненный ордер
-                            order.get('side') in [1, 3] and  # Открывающие стороны
-                            order.get('symbol') == symbol and  # Тот же символ
-                            order.get('dealVol', 0) > 0):  # Есть объем сделки
-                        open_orders.append(order)
-
-                print(f"    📋 Найдено открывающих ордеров: {len(open_orders)}, закрывающих: {len(close_orders)}")
-
-                print(f"    📋 Найдено открывающих ордеров: {len(open_orders)}, закрывающих: {len(close_orders)}")
-
-                # Сортируем по времени (новые сначала)
-                close_orders.sort(key=lambda x: x.get('createTime', 0), reverse=True)
-                open_orders.sort(key=lambda x: x.get('createTime', 0), reverse=True)
-
-                margin = "N/A"
-                pnl = "N/A"
-                entry_price = "N/A"
-                exit_price = "N/A"
-
-                if close_orders and open_orders:
-                    # Берем самый последний закрывающий ордер
-                    latest_close = close_orders[0]
-                    exit_price = latest_close.get('dealAvgPrice',
-                                                  latest_close.get('dealAvgPriceStr', 'N/A'))
-                    pnl = latest_close.get('profit', 'N/A')
-                    close_time = latest_close.get('createTime', 0)
-
-                    print(f"    💰 Последний закрывающий ордер: exit_price={exit_price}, PNL={pnl}, time={close_time}")
-
-                    # Ищем соответствующий открывающий ордер по времени и объему
-                    corresponding_open = None
-                    for open_order in open_orders:
-                        open_time = open_order.get('createTime', 0)
-                        # Открывающий ордер должен быть раньше закрывающего и по тому же символу
-                        if (open_time < close_time and
-                                open_order.get('symbol') == symbol and
-                                abs(open_order.get('vol', 0) - latest_close.get('vol',
-                                                                                0)) <= 1):  # Примерно одинаковый объем
-                            corresponding_open = open_order
-                            break
-
-                    # Если не нашли по объему, берем просто последний открывающий до закрытия
-                    if not corresponding_open:
-                        for open_order in open_orders:
-                            if (open_order.get('createTime', 0) < close_time and
-                                    open_order.get('symbol') == symbol):
-                                corresponding_open = open_order
-                                break
-
-                    if corresponding_open:
-                        margin = corresponding_open.get('orderMargin', 'N/A')
-                        entry_price = corresponding_open.get('dealAvgPrice',
-                                                             corresponding_open.get('dealAvgPriceStr', 'N/A'))
-                        open_time = corresponding_open.get('createTime', 0)
-                        print(
-                            f"    📈 Найден открывающий ордер: entry_price={entry_price}, margin={margin}, time={open_time}")
+async def close_positions(main_mexc, mexcs: list[Mexc], closes: list):
+    """Закрывает позиции главного аккаунта, закрытые в одном снимке (close_request), на ведомых:
+    один снимок позиций на аккаунт, все закрывающие ордера - одной рассылкой, один отчёт"""
+    # Закрывающие ордера ведомых будут не старше этого момента
+    since_ms = int(time.time() * 1000) - CLOSE_CONFIRM_CLOCK_SKEW_MS
+
+    # Позиции берём из кэша - запрос к бирже только для аккаунтов с устаревшими данными
+    for close in closes:
+        print(f"🔄 Закрытие позиций {close['symbol']} side={close['side']} на {len(mexcs)} ведомых аккаунтах...")
+    fanout_started = time.perf_counter()
+    closed = await asyncio.gather(*[
+        close_account_positions(mexc, closes, i, len(mexcs), fanout_started)
+        for i, mexc in enumerate(mexcs, 1)
+    ])
+
+    reports = []
+    for n, close in enumerate(closes):
+        symbol, side = close['symbol'], close['side']
+        account_info = []
+
+        # Обрабатываем результаты закрытия
+        for mexc, account_closed in zip(mexcs, closed):
+            closed_data = account_closed[n]
+            # Ордера открытия этой позиции - для отчёта по orderId
+            open_order_ids = ledger.pop_open_orders(mexc, symbol, side)
+            if closed_data is None:
+                continue
+            position_id, result = closed_data
+            close_order_id = None if isinstance(result, Exception) else response_order_id(result)
+
+            if isinstance(result, Exception):
+                print(f"  ❌ Ошибка при закрытии позиции на ведомом аккаунте: {result}")
+            else:
+                try:
+                    r_json = result.json()
+                    if r_json.get("success"):
+                        print(f"  ✅ Позиция успешно закрыта на ведомом аккаунте")
                     else:
-                        print(f"    ⚠️ Не найден соответствующий открывающий ордер для закрытия")
-                        # Используем первый открывающий ордер как fallback
-                        if open_orders:
-                            corresponding_open = open_orders[0]
-                            margin = corresponding_open.get('orderMargin', 'N/A')
-                            entry_price = corresponding_open.get('dealAvgPrice',
-                                                                 corresponding_open.get('dealAvgPriceStr', 'N/A'))
-                            print(
-                                f"    📈 Используем первый открывающий ордер: entry_price={entry_price}, margin={margin}")
+                        print(f"  ❌ Ошибка закрытия позиции на ведомом аккаунте: {r_json}")
+                except Exception as e:
+                    print(f"  ❌ Ошибка парсинга ответа с ведомого аккаунта: {e}")
+
+            account_info.append({
+                'mexc': mexc,
+                'symbol': symbol,
+                'side': side,
+                'is_main': False,
+                'position_id': position_id,
+                'order_ids': {'open': open_order_ids, 'close': [close_order_id] if close_order_id else []}
+            })
+
+        # ОСОБАЯ ОБРАБОТКА ГЛАВНОГО АККАУНТА
+        # Используем сохраненные данные, так как позиция уже могла быть закрыта
+        main_position_id = close['position_id']
+        if report_sink is not None:
+            print("  👑 Данные главного аккаунта добавит координатор шардов")
+        elif main_position_id:
+            print("  👑 Обработка главного аккаунта (используем сохраненные данные)")
+            # Добавляем главный аккаунт в обработку, даже если позиция уже закрыта
+            account_info.append(main_close_info(main_mexc, close))
+            print(f"    ✅ Главный аккаунт добавлен в обработку (позиция: {main_position_id})")
+        else:
+            print(f"    ⚠️ Нет сохраненных данных главного аккаунта")
+
+        print(f"📊 Аккаунтов в обработке: {len(account_info)}")
+        print(f"👑 Главных аккаунтов: {len([acc for acc in account_info if acc['is_main']])}")
+        print(f"👥 Ведомых аккаунтов: {len([acc for acc in account_info if not acc['is_main']])}")
+
+        # Шард сообщает и о пустом закрытии - координатор не ждёт его строки до таймаута
+        if account_info or report_sink is not None:  # Если есть аккаунты для обработки (хотя бы главный)
+            reports.append((close, account_info))
+        else:
+            print(f"  ⚠️ {tag()}Не найдено аккаунтов для обработки {symbol} side={side}")
+
+    if reports:
+        # Подтверждение закрытия и отчёт - отдельной задачей, основной цикл не ждёт
+        spawn(report_close_positions(reports, since_ms))
+        return True
+
+    finish_trace()
+    return False
+
+
+async def adjust_account_position(mexc: Mexc, adjustment: dict, i, fanout_started):
+    """Изменение позиции на ведомом аккаунте: объём - в пропорции ведомого, стоп-лосс - как у главного"""
+    symbol, side, event_id = adjustment['symbol'], adjustment['side'], adjustment['event_id']
+    entry = ledger.get(mexc, symbol, side)
+    if entry is None:
+        print(f"    ❌ Позиция {symbol} ({side}) не найдена на ведомом аккаунте {i}")
+        return []
+
+    results = []
+    vol_delta = adjustment['vol_delta']
+    if vol_delta:
+        ratio = ledger.ratio(mexc, symbol, side, adjustment['old_vol']) or 1
+        vol = max(1, round(abs(vol_delta) * ratio))
+        external_oid = client_order_id(event_id, mexc.account_id)
+        try:
+            if vol_delta > 0:
+                print(f"    ➕ Добор {vol} на ведомом аккаунте {i} (пропорция {ratio:.3f})")
+                result = await timed_order('increase', mexc, mexc.open_position(
+                    symbol, side, entry['leverage'], adjustment['stop_loss_price'], vol, entry['openType'],
+                    external_oid), fanout_started)
+                ledger.record_order(mexc, symbol, side, entry['leverage'], vol, entry['openType'], result)
+            else:
+                # Частичное закрытие не должно закрыть позицию целиком: у главного она ещё открыта
+                vol = min(vol, entry['vol'] - 1)
+                if vol < 1:
+                    print(f"    ⚠️ Объём позиции на ведомом аккаунте {i} слишком мал для частичного закрытия")
+                    result = None
                 else:
+                    print(f"    ➖ Частичное закрытие {vol} на ведомом аккаунте {i} (пропорция {ratio:.3f})")
+                    result = await timed_order('reduce', mexc, mexc.close_position(
+                        symbol, entry['positionId'], entry['leverage'], vol, 4 if side == 1 else 2,
+                        entry['openType'], external_oid), fanout_started)
+                    if response_success(result):
+                        ledger.adjust(mexc, symbol, side, -vol)
+        except Exception as e:
+            result = e
+        if result is not None:
+            results.append(('increase' if vol_delta > 0 else 'reduce', result))
+
+    if adjustment['stop_loss_changed'] and adjustment['stop_loss_price']:
+        try:
+            stop_orders = await mexc.get_stop_orders(symbol)
+            stop_order = next((order for order in stop_orders
+                               if str(order.get('positionId')) == str(entry['positionId'])), None)
+            if stop_order is None:
+                print(f"    ⚠️ У позиции {entry['positionId']} на ведомом аккаунте {i} нет стоп-ордера")
+                result = None
+            else:
+                print(f"    🛑 Стоп-лосс {adjustment['stop_loss_price']} на ведомом аккаунте {i}")
+                result = await timed_order('stop_loss', mexc, mexc.change_stop_loss(
+                    stop_order['id'], adjustment['stop_loss_price'], stop_order.get('takeProfitPrice')),
+                    fanout_started)
+        except Exception as e:
+            result = e
+        if result is not None:
+            results.append(('stop_loss', result))
+    return results
+
+
+async def adjust_account_positions(mexc: Mexc, adjustments: list, i, total, fanout_started):
+    """Изменения позиций ведомого аккаунта по одному снимку позиций"""
+    if any(ledger.get(mexc, adjustment['symbol'], adjustment['side']) is None for adjustment in adjustments):
+        print(f"  👤 Кэш позиций ведомого аккаунта {i}/{total} устарел, запрашиваем позиции...")
+        try:
+            await ledger.refresh(mexc)
+        except Exception as e:
+            print(f"    ❌ Ошибка получения позиций ведомого аккаунта {i}: {e}")
+            return []
+
+    results = await asyncio.gather(*[
+        adjust_account_position(mexc, adjustment, i, fanout_started) for adjustment in adjustments
+    ])
+    return [result for adjustment_results in results for result in adjustment_results]
+
+
+async def adjust_positions(mexcs: list[Mexc], adjustments: list):
+    """Добор, частичное закрытие и перенос стоп-лосса открытых позиций главного (position_adjustment)
+    на всех ведомых одной рассылкой"""
+    for adjustment in adjustments:
+        print(f"🔧 Изменение позиции {adjustment['symbol']} side={adjustment['side']} на {len(mexcs)} ведомых: "
+              f"vol {adjustment['old_vol']}→{adjustment['old_vol'] + adjustment['vol_delta']}"
+              f"{', SL=' + str(adjustment['stop_loss_price']) if adjustment['stop_loss_changed'] else ''}")
+    fanout_started = time.perf_counter()
+    results = await asyncio.gather(*[
+        adjust_account_positions(mexc, adjustments, i, len(mexcs), fanout_started)
+        for i, mexc in enumerate(mexcs, 1)
+    ])
+
+    succeeded = failed = 0
+    for account_results in results:
+        for kind, result in account_results:
+            if response_success(result):
+                succeeded += 1
+            else:
+                failed += 1
+                print(f"  ❌ Ошибка изменения позиции ({kind}): "
+                      f"{result if isinstance(result, Exception) else result.json()}")
+    print(f"✅ Изменения позиций разосланы: успешно {succeeded}, с ошибкой {failed}")
+    finish_trace()
+
+
+def position_adjustment(old: dict, position: dict, event_id=None) -> dict:
+    """Изменение открытой позиции главного между снимками для adjust_positions"""
+    return {
+        'symbol': position['symbol'],
+        'side': position['side'],
+        'old_vol': old['vol'],
+        'vol_delta': position['vol'] - old['vol'],
+        # Без прежнего стоп-лосса у ведомых нет стоп-ордера, который можно перенести
+        'stop_loss_changed': old.get('stopLossPrice') is not None and
+                             position.get('stopLossPrice') != old.get('stopLossPrice'),
+        'stop_loss_price': position.get('stopLossPrice'),
+        'event_id': event_id,
+    }
+
+
+async def wait_for_close_orders(mexc: Mexc, symbol, since_ms, semaphore: asyncio.Semaphore):
+    """Догружает историю с нарастающей паузой, пока не появится закрывающий ордер или не выйдет срок"""
+    deadline = time.monotonic() + CLOSE_CONFIRM_TIMEOUT
+    delay = CLOSE_CONFIRM_MIN_DELAY
+
+    while True:
+        async with semaphore:
+            await mexc.history.refresh(symbol)
+
+        if mexc.history.latest(symbol, CLOSE_SIDES, since_ms) is not None:
+            return True
+
+        if time.monotonic() + delay > deadline:
+            print(f"    ⚠️ Закрывающий ордер {symbol} не появился в истории за {CLOSE_CONFIRM_TIMEOUT} сек")
+            return False
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, CLOSE_CONFIRM_MAX_DELAY)
+
+
+async def wait_for_orders(mexc: Mexc, order_ids: list, semaphore: asyncio.Semaphore):
+    """Детали ордеров по orderId с нарастающей паузой, пока все не придут в конечное состояние"""
+    deadline = time.monotonic() + CLOSE_CONFIRM_TIMEOUT
+    delay = CLOSE_CONFIRM_MIN_DELAY
+
+    while True:
+        async with semaphore:
+            orders = await mexc.query_orders(order_ids)
+
+        if len(orders) >= len(order_ids) and all(order.get('state') in ORDER_FINAL_STATES for order in orders):
+            return orders
+
+        if time.monotonic() + delay > deadline:
+            print(f"    ⚠️ Ордера {order_ids} не исполнились за {CLOSE_CONFIRM_TIMEOUT} сек")
+            return orders
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, CLOSE_CONFIRM_MAX_DELAY)
+
+
+def average_fill_price(orders: list):
+    """Средняя цена исполнения, взвешенная по объёму"""
+    if len(orders) == 1:
+        return orders[0].get('dealAvgPrice', orders[0].get('dealAvgPriceStr', 'N/A'))
+    volume = sum(order.get('dealVol', 0) for order in orders)
+    if not volume:
+        return "N/A"
+    return round(sum(float(order.get('dealAvgPrice', 0)) * order.get('dealVol', 0) for order in orders) / volume, 8)
+
+
+async def collect_fill_data(mexc: Mexc, order_ids: dict, semaphore: asyncio.Semaphore):
+    """Маржа, PNL, вход и выход по ордерам копирования (orderId известны) или None"""
+    orders = await wait_for_orders(mexc, order_ids['open'] + order_ids['close'], semaphore)
+    filled = {str(order.get('orderId')): order for order in orders if order.get('state') == ORDER_FILLED}
+    open_orders = [filled[str(order_id)] for order_id in order_ids['open'] if str(order_id) in filled]
+    close_orders = [filled[str(order_id)] for order_id in order_ids['close'] if str(order_id) in filled]
+    if not open_orders or not close_orders:
+        return None
+
+    data = {
+        'margin': sum(float(order.get('orderMargin', 0)) for order in open_orders),
+        'pnl': sum(float(order.get('profit', 0)) for order in close_orders),
+        'entry_price': average_fill_price(open_orders),
+        'exit_price': average_fill_price(close_orders),
+    }
+    print(f"    📋 По orderId: вход={data['entry_price']}, выход={data['exit_price']}, "
+          f"маржа={data['margin']}, PNL={data['pnl']}")
+    return data
+
+
+async def collect_close_data(acc_info, since_ms, semaphore: asyncio.Semaphore):
+    """Маржа, PNL, вход и выход закрытой позиции: по orderId ордеров копирования,
+    иначе (главный аккаунт, позиция открыта до перезапуска) - по истории ордеров"""
+    mexc = acc_info['mexc']
+    symbol = acc_info['symbol']
+    is_main = acc_info['is_main']
+
+    try:
+        order_ids = acc_info.get('order_ids') or {}
+        if order_ids.get('open') and order_ids.get('close'):
+            data = await collect_fill_data(mexc, order_ids, semaphore)
+            if data is not None:
+                return {'is_main': is_main, **data}
+            print("    ⚠️ Ордера копирования не найдены по orderId, ищем в истории...")
+
+        print(f"  🔍 Получение истории ордеров для {'главного' if is_main else 'ведомого'} аккаунта...")
+
+        # Главный аккаунт закрылся раньше, чем мы это заметили - его ордер уже в истории
+        await wait_for_close_orders(mexc, symbol, None if is_main else since_ms, semaphore)
+
+        # Исполненные ордера символа из кэша истории (новые первыми)
+        close_orders = mexc.history.filled(symbol, CLOSE_SIDES)
+        open_orders = mexc.history.filled(symbol, OPEN_SIDES)
+
+        if not close_orders and not open_orders:
+            print(f"    ⚠️ История ордеров пуста для {'главного' if is_main else 'ведомого'} аккаунта")
+            return {
+                'is_main': is_main,
+                'margin': 'N/A',
+                'pnl': 'N/A',
+                'entry_price': 'N/A',
+                'exit_price': 'N/A'
+            }
+
+        print(f"    📋 Найдено открывающих ордеров: {len(open_orders)}, закрывающих: {len(close_orders)}")
+
+        margin = "N/A"
+        pnl = "N/A"
+        entry_price = "N/A"
+        exit_price = "N/A"
+
+        if close_orders and open_orders:
+            # Берем самый последний закрывающий ордер
+            latest_close = close_orders[0]
+            exit_price = latest_close.get('dealAvgPrice',
+                                          latest_close.get('dealAvgPriceStr', 'N/A'))
+            pnl = latest_close.get('profit', 'N/A')
+            close_time = latest_close.get('createTime', 0)
+
+            print(f"    💰 Последний закрывающий ордер: exit_price={exit_price}, PNL={pnl}, time={close_time}")
+
+            # Ищем соответствующий открывающий ордер: раньше закрывающего, примерно того же объема
+            earlier_opens = mexc.history.filled(symbol, OPEN_SIDES, before_ms=close_time)
+            corresponding_open = next((open_order for open_order in earlier_opens
+                                       if abs(open_order.get('vol', 0) - latest_close.get('vol', 0)) <= 1), None)
+
+            # Если не нашли по объему, берем просто последний открывающий до закрытия
+            if not corresponding_open and earlier_opens:
+                corresponding_open = earlier_opens[0]
+
+            if corresponding_open:
+                margin = corresponding_open.get('orderMargin', 'N/A')
+                entry_price = corresponding_open.get('dealAvgPrice',
+                                                     corresponding_open.get('dealAvgPriceStr', 'N/A'))
+                open_time = corresponding_open.get('createTime', 0)
+                print(
+                    f"    📈 Найден открывающий ордер: entry_price={entry_price}, margin={margin}, time={open_time}")
+            else:
+                print(f"    ⚠️ Не найден соответствующий открывающий ордер для закрытия")
+                # Используем первый открывающий ордер как fallback
+                if open_orders:
+                    corresponding_open = open_orders[0]
+                    margin = corresponding_open.get('orderMargin', 'N/A')
+                    entry_price = corresponding_open.get('dealAvgPrice',
+                                                         corresponding_open.get('dealAvgPriceStr', 'N/A'))
                     print(
-                        f"    ⚠️ Недостаточно данных: close_orders={len(close_orders)}, open_orders={len(open_orders)}")
+                        f"    📈 Используем первый открывающий ордер: entry_price={entry_price}, margin={margin}")
+        else:
+            print(
+                f"    ⚠️ Недостаточно данных: close_orders={len(close_orders)}, open_orders={len(open_orders)}")
 
-                account_results.append({
-                    'is_main': is_main,
-                    'margin': margin,
-                    'pnl': pnl,
-                    'entry_price': entry_price,
-                    'exit_price': exit_price
-                })
+        return {
+            'is_main': is_main,
+            'margin': margin,
+            'pnl': pnl,
+            'entry_price': entry_price,
+            'exit_price': exit_price
+        }
 
-            except Exception as e:
-                print(f"  ❌ Ошибка получения данных закрытия для {'главного' if is_main else 'ведомого'} аккаунта: {e}")
-                account_results.append({
-                    'is_main': is_main,
-                    'margin': 'N/A',
-                    'pnl': 'N/A',
-                    'entry_price': 'N/A',
-                    'exit_price': 'N/A'
-                })
-
-        # Формируем сообщение для Telegram (остается без изменений)
-        side_text = "LONG📈" if side == 1 else "SHORT📉"
-        message = f"✅ Закрытие позиции {symbol} {side_text} x{leverage}\n\n"
-
-        # Данные главного аккаунта
-        main_data_list = [acc for acc in account_results if acc['is_main']]
-        if main_data_list:
-            main_data = main_data_list[0]
-            margin = main_data['margin']
-            pnl = main_data['pnl']
-            exit_price = main_data['exit_price']
-
-            message += f"<b>Главный аккаунт:</b>\n"
-            if margin != "N/A" and margin and pnl != "N/A" and pnl:
+    except Exception as e:
+        print(f"  ❌ Ошибка получения данных закрытия для {'главного' if is_main else 'ведомого'} аккаунта: {e}")
+        return {
+            'is_main': is_main,
+            'margin': 'N/A',
+            'pnl': 'N/A',
+            'entry_price': 'N/A',
+            'exit_price': 'N/A'
+        }
+
+
+async def report_close_positions(reports: list, since_ms):
+    """Фоновое подтверждение закрытия и общий отчёт по всем позициям снимка: [(close, account_info)]"""
+    print("📊 Сбор данных о закрытых позициях...")
+    current_priority.set(PRIORITY_REPORT)
+    semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+    try:
+        with metrics.timer('report_seconds', kind='close'), span('report', kind='close'):
+            # Подряд по аккаунту: запросы ордеров одного аккаунта по разным позициям объединяются
+            by_account = {}
+            for n, (_, account_info) in enumerate(reports):
+                for k, acc_info in enumerate(account_info):
+                    by_account.setdefault(acc_info['mexc'], []).append((n, k))
+            queue = [nk for account_queue in by_account.values() for nk in account_queue]
+            collected = await asyncio.gather(*[collect_close_data(reports[n][1][k], since_ms, semaphore)
+                                               for n, k in queue])
+            results = [[None] * len(account_info) for _, account_info in reports]
+            for (n, k), data in zip(queue, collected):
+                results[n][k] = data
+    finally:
+        # Отчёт - последний этап события
+        finish_trace()
+
+    if report_sink is not None:
+        report_sink('close', [(close['event_id'], close, account_results)
+                              for (close, _), account_results in zip(reports, results)])
+        return
+
+    # Сообщения позиций заканчиваются переводом строки - между ними остаётся пустая строка
+    message = "\n".join(close_report_message(close['symbol'], close['side'], close['leverage'], account_results)
+                        for (close, _), account_results in zip(reports, results))
+
+    print("📤 Отправка сообщения в Telegram...")
+    await send_telegram_message(message)
+
+
+def close_report_message(symbol, side, leverage, account_results):
+    """Текст отчёта о закрытии одной позиции"""
+    side_text = "LONG📈" if side == 1 else "SHORT📉"
+    message = f"✅ Закрытие позиции {symbol} {side_text} x{leverage}\n\n"
+
+    # Данные главного аккаунта
+    main_data_list = [acc for acc in account_results if acc['is_main']]
+    if main_data_list:
+        main_data = main_data_list[0]
+        margin = main_data['margin']
+        pnl = main_data['pnl']
+        exit_price = main_data['exit_price']
+
+        message += f"<b>Главный аккаунт:</b>\n"
+        if margin != "N/A" and margin and pnl != "N/A" and pnl:
+            try:
+                pnl_float = float(pnl)
+                margin_float = float(margin)
+                pnl_sign = "+" if pnl_float >= 0 else ""
+
+                if pnl_float >= 10.0:
+                    message += f" маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> ☠️\n"
+                elif pnl_float <= -5.0:
+                    message += f" маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 🤡\n"
+                elif pnl_float >= 0.0:
+                    message += f" маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 💰\n"
+                else:
+                    message += f"  маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 👹\n"
+            except (ValueError, TypeError) as e:
+                message += f"  маржа=${margin}, выход={exit_price}, PNL=ошибка конвертации\n"
+        else:
+            message += f"  маржа=расчет недоступен, PNL=расчет недоступен, выход={exit_price}\n"
+    else:
+        message += f"<b>Главный аккаунт:</b>\n"
+        message += f"  данные недоступны\n"
+
+    message += f"\n<b>Ведомые аккаунты:</b>\n"
+
+    # Данные ведомых аккаунтов
+    slave_count = 1
+    for acc_data in account_results:
+        if not acc_data['is_main']:
+            margin = acc_data['margin']
+            pnl = acc_data['pnl']
+            exit_price = acc_data['exit_price']
+
+            if (margin != "N/A" and margin and margin != "" and
+                    pnl != "N/A" and pnl and pnl != "" and pnl != "0"):
                 try:
                     pnl_float = float(pnl)
                     margin_float = float(margin)
                     pnl_sign = "+" if pnl_float >= 0 else ""
 
                     if pnl_float >= 10.0:
-                        message += f" маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> ☠️\n"
+                        message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> ☠️\n"
                     elif pnl_float <= -5.0:
-                        message += f" маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 🤡\n"
+                        message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 🤡\n"
                     elif pnl_float >= 0.0:
-                        message += f" маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 💰\n"
+                        message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 💰\n"
                     else:
-                        message += f"  маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 👹\n"
+                        message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 👹\n"
                 except (ValueError, TypeError) as e:
-                    message += f"  маржа=${margin}, выход={exit_price}, PNL=ошибка конвертации\n"
+                    message += f"{slave_count}) маржа=${margin}, выход={exit_price}, PNL=ошибка конвертации\n"
             else:
-                message += f"  маржа=расчет недоступен, PNL=расчет недоступен, выход={exit_price}\n"
-        else:
-            message += f"<b>Главный аккаунт:</b>\n"
-            message += f"  данные недоступны\n"
-
-        message += f"\n<b>Ведомые аккаунты:</b>\n"
-
-        # Данные ведомых аккаунтов
-        slave_count = 1
-        for acc_data in account_results:
-            if not acc_data['is_main']:
-                margin = acc_data['margin']
-                pnl = acc_data['pnl']
-                exit_price = acc_data['exit_price']
-
-                if (margin != "N/A" and margin and margin != "" and
-                        pnl != "N/A" and pnl and pnl != "" and pnl != "0"):
-                    try:
-                        pnl_float = float(pnl)
-                        margin_float = float(margin)
-                        pnl_sign = "+" if pnl_float >= 0 else ""
-
-                        if pnl_float >= 10.0:
-                            message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> ☠️\n"
-                        elif pnl_float <= -5.0:
-                            message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 🤡\n"
-                        elif pnl_float >= 0.0:
-                            message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 💰\n"
-                        else:
-                            message += f"{slave_count}) маржа = {margin_float:.2f}💲, выход = {exit_price} 🔚, PNL = <code>{pnl_sign}{pnl_float:.4f}</code> 👹\n"
-                    except (ValueError, TypeError) as e:
-                        message += f"{slave_count}) маржа=${margin}, выход={exit_price}, PNL=ошибка конвертации\n"
-                else:
-                    message += f"{slave_count}) маржа=расчет недоступен, PNL=расчет недоступен, выход={exit_price}\n"
-                slave_count += 1
-
-        print("📤 Отправка сообщения в Telegram...")
-        await send_telegram_message(message)
+                message += f"{slave_count}) маржа=расчет недоступен, PNL=расчет недоступен, выход={exit_price}\n"
+            slave_count += 1
+
+    return message
+
+
+# Приоритет запросов действий: закрытия и отмены раньше открытий и изменений
+ACTION_PRIORITY = {
+    'close_position': PRIORITY_CLOSE,
+    'cancel_limit': PRIORITY_CLOSE,
+    'open_position': PRIORITY_OPEN,
+    'open_limit': PRIORITY_OPEN,
+    'change_limit': PRIORITY_OPEN,
+    'adjust_position': PRIORITY_OPEN,
+    'limit_filled': PRIORITY_OPEN,
+    'resync_account': PRIORITY_OPEN,
+}
+
+
+class CopyEngine:
+    """Копирование главного аккаунта: поиск изменений отделён от рассылки ведомым.
+
+    Опрос главного аккаунта только сравнивает снимки и кладёт действия в очередь,
+    ордера ведомым отправляют воркеры - медленная рассылка не задерживает обнаружение
+    следующих событий. Действия с одним ключом (символ и сторона позиции, orderId
+    лимитного ордера) выполняются строго в порядке обнаружения.
+    """
+
+    def __init__(self, main_mexc: Mexc, accounts_mexc: list[Mexc]):
+        self.main_mexc = main_mexc
+        self.accounts_mexc = accounts_mexc
+        self.opened_positions = {}
+        self.opened_orders = {}  # {orderId: {symbol, price, vol, leverage, side}}
+        self.synced_orders = {}  # {main_orderId: [(mexc, acc_orderId), ...]}
+        # Позиции, которые появились от исполнения лимитных ордеров: {(symbol, side): время исполнения}
+        self.limit_positions = {}
+        self.filled_orders = set()  # Ордера, исполнение которых пришло из потока раньше позиции
+        # Объём исполнений лимиток главного в уже открытые позиции, ещё не сопоставленный с ростом
+        # позиции: {(symbol, side): [объём, время]} - этот рост у ведомых дают их копии ордеров
+        self.limit_fills = {}
+        # Текущий вид главного аккаунта: REST-снимок, дополненный обновлениями из потока
+        self.master_positions = {}  # {positionId: позиция}
+        self.master_orders = {}  # {orderId: ордер}
+        self.version = 0  # Растёт при каждом изменении вида - по нему отбрасываются устаревшие снимки
+        self.stream = None
+        self.journal = None  # StateJournal: состояние переживает перезапуск
+        self.on_action_done = None  # on_action_done(action, секунды, ошибка) - отчёт координатору шардов
+        self.resync = {}  # {account_id: пропущенное аккаунтом, пока breaker был открыт}
+        self.actions = asyncio.Queue()
+        self.key_locks = {}  # {ключ: deque очереди действий по ключу; первое - выполняется}
+
+    # ========== ОПРОС ГЛАВНОГО АККАУНТА ==========
+
+    async def poll_loop(self, interval: float, stream_interval: float = None):
+        """Опрос с постоянным шагом: время обработки не добавляется к паузе.
+        Пока поток подключён, опрос редкий (stream_interval) и лишь страхует его"""
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"❌ Ошибка опроса главного аккаунта: {e}")
+            step = stream_interval if self.stream is not None and self.stream.connected else interval
+            await asyncio.sleep(max(0.0, step - (time.monotonic() - started)))
+
+    async def poll(self):
+        """Позиции и ордера главного аккаунта запрашиваются одновременно"""
+        version = self.version
+        # Обнаружение событий не должно ждать за отчётами
+        with dispatch_priority(PRIORITY_CLOSE):
+            positions, orders = await asyncio.gather(
+                self._timed_poll('open_positions', self.main_mexc.get_open_positions()),
+                self._timed_poll('open_orders', self.main_mexc.get_open_orders())
+            )
+        self.apply_snapshot(positions, orders, time.time(), version)
+
+    @staticmethod
+    async def _timed_poll(endpoint, coro):
+        with metrics.timer('master_poll_seconds', endpoint=endpoint):
+            return await coro
+
+    def apply_snapshot(self, positions, orders, received_at, version=None):
+        """Полный снимок главного аккаунта. version - версия вида на момент запроса:
+        если пока шёл запрос пришли обновления из потока, снимок уже устарел"""
+        if version is not None and version != self.version:
+            metrics.inc('master_snapshots_stale_total')
+            return False
+        self.master_positions = {position['positionId']: position for position in positions}
+        self.master_orders = {order['orderId']: order for order in orders}
+        self._view_changed(received_at)
         return True
 
-    print("  ⚠️ Не найдено аккаунтов для обработки")
-    return False
-
-
-async def main():
-    print("🟢 Бот запущен пользователем.")
-    with open("./accounts/main.txt", "r") as file:
-        for line in file:
-            parts = line.strip().split("|")
-            uid = parts[0]
-            proxy = parts[1] if len(parts) > 1 else None
-            main_mexc = Mexc(uid, proxy)
-
-    accounts = load_accounts()
-    accounts_mexc = []
-    for account in accounts:
-        accounts_mexc.append(Mexc(account[0], account[1]))
-    slave_count = len(accounts_mexc)
-    print(f"\nУспешно загружено {slave_count} ведомых аккаунтов\n")
-    opened_positions = {}
-    opened_orders = {}  # {orderId: {symbol, price, vol, leverage, side}}
-    synced_orders = {}  # {main_orderId: [(mexc, acc_orderId), ...]}
-    limit_positions = set()  # Позиции которые появились от исполнения лимитных ордеров
-
-    while True:
-        positions = await main_mexc.get_open_positions()
-        # print(positions)
-
+    def apply_position_update(self, position, closed: bool, received_at):
+        """Обновление одной позиции из потока"""
+        if closed:
+            self.master_positions.pop(position['positionId'], None)
+        else:
+            self.master_positions[position['positionId']] = position
+        self._view_changed(received_at)
+
+    def apply_order_update(self, order, removed: bool, filled: bool, received_at):
+        """Обновление одного ордера из потока"""
+        if removed:
+            if self.master_orders.pop(order['orderId'], None) is not None and filled:
+                # Позиция от исполнения может прийти следующим сообщением - не считаем ордер отменённым
+                self.filled_orders.add(order['orderId'])
+        else:
+            self.master_orders[order['orderId']] = order
+        self._view_changed(received_at)
+
+    def _view_changed(self, received_at):
+        self.version += 1
+        self.detect_changes(list(self.master_positions.values()), list(self.master_orders.values()), received_at)
+        self._evict_markers()
+        self.persist()
+
+    def _evict_markers(self):
+        """Отметки исполненных лимиток, к которым так и не пришла позиция, устаревают"""
+        now = time.time()
+        for key in [key for key, marked in self.limit_positions.items() if marked < now - LIMIT_MARKER_TTL]:
+            del self.limit_positions[key]
+        for key in [key for key, (_, marked) in self.limit_fills.items() if marked < now - LIMIT_FILL_TTL]:
+            vol, _ = self.limit_fills.pop(key)
+            print(f"⚠️ Исполнение лимиток {key[0]} (side={key[1]}) на {vol} не совпало с ростом позиции главного")
+
+    def _credit_limit_fill(self, symbol, side, vol):
+        """Исполнение лимитки главного: такой же рост позиции не копируется по маркету"""
+        credit = self.limit_fills.setdefault((symbol, side), [0, 0.0])
+        credit[0] += vol
+        credit[1] = time.time()
+
+    def collect_metrics(self):
+        """Память процесса и размеры состояния - для статуса (/metrics, metrics.json)"""
+        memory = process_memory_bytes()
+        if memory is not None:
+            metrics.set('process_memory_bytes', memory)
+        sizes = {
+            'positions': len(self.opened_positions),
+            'orders': len(self.opened_orders),
+            'synced_orders': len(self.synced_orders),
+            'synced_links': sum(len(acc_orders) for acc_orders in self.synced_orders.values()),
+            'limit_markers': len(self.limit_positions),
+            'limit_fills': len(self.limit_fills),
+            'filled_orders': len(self.filled_orders),
+            'resync': len(self.resync),
+            'key_locks': len(self.key_locks),
+            'queued_actions': self.actions.qsize(),
+            'ledger_positions': len(ledger.entries),
+            'ledger_open_orders': len(ledger.open_order_ids),
+            'ledger_ratios': len(ledger.ratios),
+            'order_history': sum(len(mexc.history.orders) for mexc in [self.main_mexc] + self.accounts_mexc
+                                 if mexc is not None),
+            'background_tasks': len(background_tasks),
+        }
+        for kind, size in sizes.items():
+            metrics.set('state_entries', size, kind=kind)
+
+    def detect_changes(self, positions, orders, received_at):
+        """Сравнивает снимок главного аккаунта с известным состоянием и ставит действия в очередь"""
+        detect_started = time.perf_counter()
         current_position_ids = set(pos['positionId'] for pos in positions)
 
-        closed_position_ids = [pos_id for pos_id in opened_positions.keys()
+        closed_position_ids = [pos_id for pos_id in self.opened_positions.keys()
                                if pos_id not in current_position_ids]
+        new_position_ids = [pos['positionId'] for pos in positions if pos['positionId'] not in self.opened_positions]
+        metrics.observe('change_detection_seconds', time.perf_counter() - detect_started, kind='positions')
+        if closed_position_ids or new_position_ids:
+            metrics.inc('master_changes_total', len(closed_position_ids) + len(new_position_ids), kind='positions')
+
+        close_actions = []
+        for closed_pos_id in closed_position_ids:
+            pos_info = self.opened_positions.pop(closed_pos_id)
+            trace = tracer.start('close_position', position_id=closed_pos_id, symbol=pos_info['symbol'],
+                                 side=pos_info['side'])
+            trace.mark('detection', at=received_at)
+            print(f"❌ [{trace.id}] Позиция {closed_pos_id} закрыта на главном аккаунте, закрываем на всех остальных...")
+            print(f"📋 Информация о позиции: {pos_info['symbol']}, side={pos_info['side']}, "
+                  f"leverage={pos_info['leverage']}, vol={pos_info['vol']}")
+            close_actions.append(self._action(('position', pos_info['symbol'], pos_info['side']), 'close_position',
+                                              trace, position_id=closed_pos_id, pos_info=pos_info))
+        # Позиции, закрытые в одном снимке, закрываются одной рассылкой
+        self._submit_batch('close_batch', close_actions)
 
-        if closed_position_ids:
-            close_tasks = []
-            for closed_pos_id in closed_position_ids:
-                pos_info = opened_positions[closed_pos_id]
-                print(f"❌ Позиция {closed_pos_id} закрыта на главном аккаунте, закрываем на всех остальных...")
-                print(f"📋 Информация о позиции: {pos_info['symbol']}, side={pos_info['side']}, "
-                      f"leverage={pos_info['leverage']}, vol={pos_info['vol']}")
-
-                # ПРОВЕРКА: Убедимся что главный аккаунт доступен
-                print(f"🔍 Проверка главного аккаунта: {main_mexc.cookies.get('u_id', 'N/A')}")
-
-                close_tasks.append(close_positions(
-                    main_mexc,
-                    accounts_mexc,
-                    pos_info['symbol'],
-                    pos_info['side'],
-                    pos_info['leverage'],
-                    pos_info['vol'],
-                    pos_info['openType'],
-                    pos_info.get('main_position_data')  # ЭТА СТРОКА ДОЛЖНА БЫТЬ
-                ))
-
-            await asyncio.gather(*close_tasks)
-
-            for closed_pos_id in closed_position_ids:
-                del opened_positions[closed_pos_id]
-                print(f"✅ Позиция {closed_pos_id} закрыта на всех аккаунтах")
-
-        new_positions = [
-            pos for pos in positions if pos['positionId'] not in opened_positions]
-
-        if new_positions:
-            open_tasks = []
-            for position in new_positions:
-                positionId = position['positionId']
-                symbol = position['symbol']
-                side = position['side']
-                vol = position['vol']
-                leverage = position['leverage']
-                stopLossPrice = position['stopLossPrice']
-                openType = position['openType']
-
-                # Проверяем - не появилась ли эта позиция от исполнения лимитного ордера
-                position_key = (symbol, side)
-                if position_key in limit_positions:
-                    print(f"⏭️ Позиция {positionId} ({symbol}, side={side}) появилась от лимитного ордера - пропускаем")
-                    limit_positions.remove(position_key)
-
-                    opened_positions[positionId] = {
-                        'symbol': symbol,
-                        'side': side,
-                        'leverage': leverage,
-                        'vol': vol,
-                        'openType': openType,
-                        'main_position_data': position  # ДОБАВЬТЕ ЭТУ СТРОКУ
-                    }
-                    continue
-
-                print(f"🚀 Открываем позицию {positionId} ({symbol}, side={side}) для всех аккаунтов")
+        # ========== ОБРАБОТКА ЛИМИТНЫХ ОРДЕРОВ ==========
+        # Действия с лимитными ордерами одного снимка уходят одной пачкой и рассылаются одновременно
+        limit_actions = []
+        detect_started = time.perf_counter()
+        current_order_ids = set(order['orderId'] for order in orders)
 
-                open_tasks.append(open_positions(
-                    main_mexc,
-                    accounts_mexc, symbol, side, leverage, stopLossPrice, vol, openType))
+        # 1. ОБРАБОТКА УДАЛЁННЫХ/ИСПОЛНЕННЫХ ОРДЕРОВ
+        # Разбираем до новых позиций: позиция от исполненной лимитки приходит в том же снимке
+        removed_order_ids = [order_id for order_id in self.opened_orders.keys()
+                             if order_id not in current_order_ids]
+        metrics.observe('change_detection_seconds', time.perf_counter() - detect_started, kind='orders')
+
+        for removed_order_id in removed_order_ids:
+            order_info = self.opened_orders.pop(removed_order_id)
+            symbol = order_info['symbol']
+            side = order_info['side']
+
+            # Проверяем - появилась ли позиция (исполнился ордер)
+            position_exists = any(
+                pos['symbol'] == symbol and
+                pos['side'] == side
+                for pos in positions
+            )
+
+            if position_exists or removed_order_id in self.filled_orders:
+                self.filled_orders.discard(removed_order_id)
+                trace = tracer.start('limit_filled', order_id=removed_order_id, symbol=symbol, side=side)
+                trace.mark('detection', at=received_at)
+                print(
+                    f"✅ [{trace.id}] Лимитный ордер {removed_order_id} исполнился на главном аке ({symbol}, side={side})")
+                if any(pos['symbol'] == symbol and pos['side'] == side for pos in self.opened_positions.values()):
+                    # Исполнение в открытую позицию: её рост на остаток ордера не копируется
+                    self._credit_limit_fill(symbol, side, order_info['vol'] - (order_info['dealVol'] or 0))
+                else:
+                    # Помечаем что позиция появилась от лимитки - не открывать по маркету
+                    self.limit_positions[(symbol, side)] = time.time()
+                # У ведомых исполняются копии - объём в кэше позиций больше не верен
+                ledger.mark_stale(symbol, side)
+                # Связи с копиями больше не нужны - убираются после действий, уже стоящих в очереди по ордеру
+                limit_actions.append(self._action(('order', removed_order_id), 'limit_filled', trace,
+                                                  order_id=removed_order_id, symbol=symbol, side=side))
+            else:
+                # Ордер отменён пользователем - отменяем на всех аках
+                trace = tracer.start('cancel_limit_order', order_id=removed_order_id, symbol=symbol, side=side)
+                trace.mark('detection', at=received_at)
+                print(
+                    f"🚫 [{trace.id}] Лимитный ордер {removed_order_id} отменён на главном аке - отменяем на всех")
+                limit_actions.append(self._action(('order', removed_order_id), 'cancel_limit', trace,
+                                                  order_id=removed_order_id))
+        # Исполнения, не дошедшие до известного ордера, больше не понадобятся
+        self.filled_orders.intersection_update(self.opened_orders)
 
-                opened_positions[positionId] = {
-                    'symbol': symbol,
-                    'side': side,
-                    'leverage': leverage,
-                    'vol': vol,
-                    'openType': openType,
-                    'main_position_data': position  # ДОБАВЬТЕ ЭТУ СТРОКУ
-                }
+        # Частичные исполнения открытых лимиток: их у ведомых повторят копии ордеров
+        for order in orders:
+            order_info = self.opened_orders.get(order['orderId'])
+            known_deal_vol = (order_info['dealVol'] or 0) if order_info is not None else 0
+            deal_vol = order.get('dealVol') or 0
+            if deal_vol > known_deal_vol:
+                self._credit_limit_fill(order['symbol'], order['side'], deal_vol - known_deal_vol)
+                if order_info is not None:
+                    order_info['dealVol'] = deal_vol
+
+        # 2. ИЗМЕНЕНИЯ ОТКРЫТЫХ ПОЗИЦИЙ: добор, частичное закрытие, перенос стоп-лосса
+        adjust_actions = []
+        for position in positions:
+            positionId = position['positionId']
+            pos_info = self.opened_positions.get(positionId)
+            if pos_info is None:
+                continue
+            adjustment = position_adjustment(pos_info, position)
+            if not adjustment['vol_delta'] and not adjustment['stop_loss_changed']:
+                continue
+            symbol = position['symbol']
+            side = position['side']
+            self.opened_positions[positionId] = self._position_info(position)
+            if adjustment['vol_delta']:
+                ledger.mark_stale(symbol, side)
+
+            credit = self.limit_fills.get((symbol, side))
+            if adjustment['vol_delta'] > 0 and credit:
+                # Добор от исполненных лимиток - у ведомых исполняются их копии ордера, копируется остаток
+                explained = min(adjustment['vol_delta'], credit[0])
+                credit[0] -= explained
+                if not credit[0]:
+                    del self.limit_fills[(symbol, side)]
+                adjustment['vol_delta'] -= explained
+                remainder = f"остаток {adjustment['vol_delta']} копируем" if adjustment['vol_delta'] else "не копируем"
+                print(f"⏭️ Позиция {positionId} ({symbol}, side={side}) увеличена лимитным ордером на {explained} - "
+                      f"{remainder}")
+                if not adjustment['vol_delta'] and not adjustment['stop_loss_changed']:
+                    continue
 
-            if open_tasks:
-                all_results = await asyncio.gather(*open_tasks)
+            trace = tracer.start('adjust_position', position_id=positionId, symbol=symbol, side=side)
+            trace.mark('detection', at=received_at)
+            adjustment['event_id'] = f"adjust:{trace.id}"
+            print(f"🔧 [{trace.id}] Позиция {positionId} ({symbol}, side={side}) изменена на главном аккаунте: "
+                  f"vol {pos_info['vol']}→{position['vol']}, SL {pos_info.get('stopLossPrice')}→"
+                  f"{position.get('stopLossPrice')}")
+            adjust_actions.append(self._action(('position', symbol, side), 'adjust_position', trace,
+                                               position_id=positionId, adjustment=adjustment))
+        if adjust_actions:
+            metrics.inc('master_changes_total', len(adjust_actions), kind='adjustments')
+        # Изменения позиций одного снимка - одной рассылкой
+        self._submit_batch('adjust_batch', adjust_actions)
+
+        # 3. ОБРАБОТКА НОВЫХ ПОЗИЦИЙ
+        for position in positions:
+            positionId = position['positionId']
+            if positionId in self.opened_positions:
+                continue
+            symbol = position['symbol']
+            side = position['side']
+
+            self.opened_positions[positionId] = self._position_info(position)
+
+            # Проверяем - не появилась ли эта позиция от исполнения лимитного ордера
+            position_key = (symbol, side)
+            # Объём новой позиции целиком от исполнений - учтённые частичные исполнения не нужны
+            self.limit_fills.pop(position_key, None)
+            if position_key in self.limit_positions:
+                print(f"⏭️ Позиция {positionId} ({symbol}, side={side}) появилась от лимитного ордера - пропускаем")
+                del self.limit_positions[position_key]
+                continue
 
-                for results in all_results:
-                    for result in results:
-                        print(result.json())
+            trace = tracer.start('open_position', position_id=positionId, symbol=symbol, side=side)
+            trace.mark('detection', at=received_at)
+            print(f"🚀 [{trace.id}] Открываем позицию {positionId} ({symbol}, side={side}) для всех аккаунтов")
+            self.submit(('position', symbol, side), 'open_position', trace, position=position)
 
-        # ========== ОБРАБОТКА ЛИМИТНЫХ ОРДЕРОВ ==========
-        orders = await main_mexc.get_open_orders()
-        current_order_ids = set(order['orderId'] for order in orders)
+        # 4. ОБРАБОТКА НОВЫХ ОРДЕРОВ
+        for order in orders:
+            order_id = order['orderId']
+            if order_id in self.opened_orders:
+                continue
+            symbol = order['symbol']
+            side = order['side']
+            price = str(order['price'])
+            openType = order['openType']
 
-        # 1. ОБРАБОТКА УДАЛЁННЫХ/ИСПОЛНЕННЫХ ОРДЕРОВ
-        removed_order_ids = [order_id for order_id in opened_orders.keys()
-                             if order_id not in current_order_ids]
+            trace = tracer.start('open_limit_order', order_id=order_id, symbol=symbol, side=side)
+            trace.mark('detection', at=received_at)
+            print(
+                f"📝 [{trace.id}] Новый лимитный ордер {order_id} ({symbol}, side={side}, price={price}, openType={openType})")
 
-        if removed_order_ids:
-            for removed_order_id in removed_order_ids:
-                order_info = opened_orders[removed_order_id]
-                symbol = order_info['symbol']
-                side = order_info['side']
-                leverage = order_info['leverage']
-
-                # Проверяем - появилась ли позиция (исполнился ордер)
-                position_exists = any(
-                    pos['symbol'] == symbol and
-                    pos['side'] == side
-                    for pos in positions
-                )
+            self.opened_orders[order_id] = self._order_info(order)
+            limit_actions.append(self._action(('order', order_id), 'open_limit', trace,
+                                              order_id=order_id, order_info=dict(self.opened_orders[order_id])))
 
-                if position_exists:
-                    print(
-                        f"✅ Лимитный ордер {removed_order_id} исполнился на главном аке ({symbol}, side={side})")
-                    # Помечаем что позиция появилась от лимитки - не открывать по маркету
-                    limit_positions.add((symbol, side))
-                else:
-                    # Ордер отменён пользователем - отменяем на всех аках
-                    print(
-                        f"🚫 Лимитный ордер {removed_order_id} отменён на главном аке - отменяем на всех")
-                    if removed_order_id in synced_orders:
-                        await cancel_limit_orders(synced_orders[removed_order_id])
-                        del synced_orders[removed_order_id]
-
-                del opened_orders[removed_order_id]
-
-        # 2. ОБРАБОТКА НОВЫХ ОРДЕРОВ
-        new_orders = [
-            order for order in orders if order['orderId'] not in opened_orders]
-
-        if new_orders:
-            for order in new_orders:
-                order_id = order['orderId']
-                symbol = order['symbol']
-                side = order['side']
-                vol = order['vol']
-                leverage = order['leverage']
-                price = str(order['price'])
-                openType = order['openType']
+        # 5. ОБРАБОТКА ИЗМЕНЁННЫХ ОРДЕРОВ
+        for order in orders:
+            order_id = order['orderId']
+            old_order = self.opened_orders.get(order_id)
+            if old_order is None:
+                continue
+            new_price = str(order['price'])
+            new_vol = order['vol']
 
+            if old_order['price'] != new_price or old_order['vol'] != new_vol:
+                trace = tracer.start('change_limit_order', order_id=order_id, symbol=old_order['symbol'])
+                trace.mark('detection', at=received_at)
                 print(
-                    f"📝 Новый лимитный ордер {order_id} ({symbol}, side={side}, price={price}, openType={openType})")
-
-                # Открываем на всех аках
-                results = await open_limit_orders(
-                    accounts_mexc, symbol, side, leverage, price, vol, openType)
-
-                # Сохраняем связь
-                acc_orders = []
-                for mexc, result in zip(accounts_mexc, results):
-                    try:
-                        r_json = result.json()
-                        if r_json.get("success"):
-                            acc_order_id = r_json['data']['orderId']
-                            acc_orders.append((mexc, acc_order_id))
-                            print(f"  ✅ Ордер создан: {acc_order_id}")
-                        else:
-                            print(f"  ❌ Ошибка создания ордера: {r_json}")
-                    except Exception as e:
-                        print(f"  ❌ Ошибка парсинга: {e}")
-
-                synced_orders[order_id] = acc_orders
-                opened_orders[order_id] = {
-                    'symbol': symbol,
-                    'price': price,
-                    'vol': vol,
-                    'leverage': leverage,
-                    'side': side,
-                    'openType': openType
-                }
-
-        # 3. ОБРАБОТКА ИЗМЕНЁННЫХ ОРДЕРОВ
-        # Ищем по (symbol, leverage, side) ордера с изменившимся orderId или параметрами
+                    f"✏️ [{trace.id}] Ордер {order_id} изменён (price: {old_order['price']}→{new_price}, vol: {old_order['vol']}→{new_vol})")
+
+                # Обновляем информацию сразу - следующий снимок сравнивается уже с новыми параметрами
+                old_order['price'] = new_price
+                old_order['vol'] = new_vol
+                limit_actions.append(self._action(('order', order_id), 'change_limit', trace,
+                                                  order_id=order_id, price=new_price, vol=new_vol))
+
+        self._submit_batch('limit_batch', limit_actions)
+
+    @staticmethod
+    def _position_info(position):
+        return PositionRecord(
+            positionId=position['positionId'],
+            symbol=position['symbol'],
+            side=position['side'],
+            leverage=position['leverage'],
+            vol=position['vol'],
+            openType=position['openType'],
+            stopLossPrice=position.get('stopLossPrice'),
+        )
+
+    @staticmethod
+    def _order_info(order):
+        return OrderRecord(
+            symbol=order['symbol'],
+            price=str(order['price']),
+            vol=order['vol'],
+            leverage=order['leverage'],
+            side=order['side'],
+            openType=order['openType'],
+            dealVol=order.get('dealVol') or 0,
+        )
+
+    # ========== СОСТОЯНИЕ И ПЕРЕЗАПУСК ==========
+
+    def state(self) -> dict:
+        """Состояние копирования для журнала; ведомые аккаунты записываются по account_id"""
+        return {
+            'positions': {pos_id: dict(info) for pos_id, info in self.opened_positions.items()},
+            'orders': {order_id: dict(info) for order_id, info in self.opened_orders.items()},
+            'synced': {order_id: [[mexc.account_id, acc_order_id] for mexc, acc_order_id in acc_orders]
+                       for order_id, acc_orders in self.synced_orders.items()},
+            'limits': dict(self.limit_positions),
+            'fills': {key: list(credit) for key, credit in self.limit_fills.items()},
+        }
+
+    def persist(self):
+        if self.journal is None:
+            return
+        try:
+            self.journal.write(self.state())
+        except Exception as e:
+            print(f"⚠️ Ошибка записи журнала состояния: {e}")
+
+    def restore(self, state: dict):
+        """Состояние из журнала. Связи с аккаунтами, которых больше нет в списке, отбрасываются"""
+        accounts = {mexc.account_id: mexc for mexc in self.accounts_mexc}
+        self.opened_positions = {pos_id: PositionRecord.from_dict({**info, 'positionId': pos_id})
+                                 for pos_id, info in state.get('positions', {}).items()}
+        self.opened_orders = {order_id: OrderRecord.from_dict(info)
+                              for order_id, info in state.get('orders', {}).items()}
+        self.synced_orders = {
+            order_id: [(accounts[account_id], acc_order_id) for account_id, acc_order_id in pairs
+                       if account_id in accounts]
+            for order_id, pairs in state.get('synced', {}).items()
+        }
+        # В старых журналах вместо времени исполнения - True: отсчёт начинается заново
+        self.limit_positions = {key: marked if isinstance(marked, float) else time.time()
+                                for key, marked in state.get('limits', {}).items()}
+        self.limit_fills = {key: list(credit) for key, credit in state.get('fills', {}).items()}
+
+    async def recover(self, master_view=None):
+        """Старт: состояние из журнала сверяется с живыми данными главного и всех ведомых,
+        запрошенными одновременно. Недостающее досылается только аккаунтам без копии -
+        перезапуск не дублирует ни позиции, ни лимитные ордера.
+        master_view - (позиции, ордера) главного от координатора: шард главный не запрашивает"""
+        started = time.perf_counter()
+        if self.journal is not None:
+            self.restore(self.journal.load())
+        restored = (len(self.opened_positions), len(self.opened_orders))
+
+        with dispatch_priority(PRIORITY_CLOSE):
+            master = ([asyncio.sleep(0, result) for result in master_view] if master_view is not None
+                      else [self.main_mexc.get_open_positions(), self.main_mexc.get_open_orders()])
+            positions, orders, *slaves = await asyncio.gather(
+                *master,
+                *[self._slave_state(mexc) for mexc in self.accounts_mexc],
+                return_exceptions=True
+            )
+        for result in (positions, orders):
+            if isinstance(result, Exception):
+                raise result
+
+        # {account_id: (ключи позиций, {orderId: открытый ордер})}; не ответившие не трогаем
+        live = {}
+        for mexc, result in zip(self.accounts_mexc, slaves):
+            if isinstance(result, Exception):
+                print(f"⚠️ Аккаунт {mexc.account_id} не ответил при восстановлении: {result}")
+                continue
+            slave_positions, slave_orders = result
+            ledger.update_from_positions(mexc, slave_positions)
+            live[mexc.account_id] = ({(position['symbol'], position['side']) for position in slave_positions},
+                                     {order['orderId']: order for order in slave_orders})
+
+        # 1. Связи с ордерами ведомых: исполненные и отменённые за время простоя убираем
+        for order_id, acc_orders in self.synced_orders.items():
+            self.synced_orders[order_id] = [
+                (mexc, acc_order_id) for mexc, acc_order_id in acc_orders
+                if mexc.account_id not in live or acc_order_id in live[mexc.account_id][1]
+            ]
+
+        # 2. Лимитные ордера главного: копия ищется по связи и по детерминированному externalOid.
+        # Аккаунт, у которого копия уже была (исполнилась или отменена), повторно не получает
+        catch_up = 0
         for order in orders:
             order_id = order['orderId']
-            if order_id in opened_orders:
-                # Проверяем изменились ли параметры
-                old_order = opened_orders[order_id]
-                new_price = str(order['price'])
-                new_vol = order['vol']
+            self.opened_orders.setdefault(order_id, self._order_info(order))
+            acc_orders = self.synced_orders.setdefault(order_id, [])
+            placed = {mexc.account_id for mexc, _ in acc_orders}
+            missing = []
+            for mexc in self.accounts_mexc:
+                if mexc.account_id in placed or mexc.account_id not in live:
+                    continue
+                external_oid = client_order_id(f"limit:{order_id}", mexc.account_id)
+                copy = next((acc_order for acc_order in live[mexc.account_id][1].values()
+                             if acc_order.get('externalOid') == external_oid), None)
+                if copy is not None:
+                    acc_orders.append((mexc, copy['orderId']))
+                else:
+                    missing.append(mexc)
+            if missing:
+                catch_up += 1
+                trace = tracer.start('open_limit_order', order_id=order_id, symbol=order['symbol'],
+                                     side=order['side'], recovery=True)
+                trace.mark('detection')
+                self.submit(('order', order_id), 'open_limit', trace, order_id=order_id,
+                            order_info=self._order_info(order), accounts=missing)
+
+        # 3. Лимитные ордера, исполнившиеся за время простоя: их позиции не открываются по маркету
+        master_keys = {(position['symbol'], position['side']) for position in positions}
+        current_order_ids = {order['orderId'] for order in orders}
+        for order_id in [order_id for order_id in self.opened_orders if order_id not in current_order_ids]:
+            order_info = self.opened_orders[order_id]
+            if (order_info['symbol'], order_info['side']) in master_keys:
+                del self.opened_orders[order_id]
+                self.synced_orders.pop(order_id, None)
+                key = (order_info['symbol'], order_info['side'])
+                if any((pos['symbol'], pos['side']) == key for pos in self.opened_positions.values()):
+                    # Исполнение в открытую позицию - её рост на остаток ордера не добор
+                    self._credit_limit_fill(*key, order_info['vol'] - (order_info['dealVol'] or 0))
+                else:
+                    self.limit_positions[key] = time.time()
 
-                if old_order['price'] != new_price or old_order['vol'] != new_vol:
-                    print(
-                        f"✏️ Ордер {order_id} изменён (price: {old_order['price']}→{new_price}, vol: {old_order['vol']}→{new_vol})")
+        # 4. Позиции главного: открываем только у аккаунтов без позиции и без ожидающей лимитной копии
+        for position in positions:
+            position_id = position['positionId']
+            key = (position['symbol'], position['side'])
+            if position_id not in self.opened_positions:
+                self.opened_positions[position_id] = self._position_info(position)
+                self.limit_fills.pop(key, None)
+                if key in self.limit_positions:
+                    del self.limit_positions[key]
+                    continue
+            missing = [
+                mexc for mexc in self.accounts_mexc
+                if mexc.account_id in live and key not in live[mexc.account_id][0] and not any(
+                    (acc_order['symbol'], acc_order['side']) == key for acc_order in live[mexc.account_id][1].values())
+            ]
+            if missing:
+                catch_up += 1
+                trace = tracer.start('open_position', position_id=position_id, symbol=key[0], side=key[1],
+                                     recovery=True)
+                trace.mark('detection')
+                self.submit(('position', *key), 'open_position', trace, position=position, accounts=missing)
+
+        # 5. Закрытия, отмены и изменения за время простоя - обычным сравнением со снимком
+        self.apply_snapshot(positions, orders, time.time())
+        if self.journal is not None:
+            self.journal.compact()
+
+        elapsed = time.perf_counter() - started
+        metrics.observe('startup_recovery_seconds', elapsed)
+        print(f"♻️ Состояние восстановлено за {elapsed:.2f}s: из журнала позиций {restored[0]}, "
+              f"ордеров {restored[1]}; досылок {catch_up}; аккаунтов без ответа "
+              f"{len(self.accounts_mexc) - len(live)}")
+
+    @staticmethod
+    async def _slave_state(mexc: Mexc):
+        return await asyncio.gather(mexc.get_open_positions(), mexc.get_open_orders())
+
+    # ========== ОЧЕРЕДЬ ДЕЙСТВИЙ ==========
+
+    def submit(self, key, kind: str, trace, **params):
+        """Ставит действие в очередь; ключ определяет порядок действий над одной позицией/ордером"""
+        self.actions.put_nowait(self._action(key, kind, trace, **params))
+
+    @staticmethod
+    def _action(key, kind: str, trace, **params):
+        return {'key': key, 'kind': kind, 'trace': trace, 'queued': time.perf_counter(), **params}
+
+    def _reserve_key(self, key):
+        """Встаёт в очередь ключа (синхронно, в порядке очереди действий). Возвращает future,
+        готовый, когда очередь дошла"""
+        waiters = self.key_locks.setdefault(key, collections.deque())
+        turn = asyncio.get_running_loop().create_future()
+        if not waiters:
+            turn.set_result(None)
+        waiters.append(turn)
+        return turn
+
+    def _release_key(self, key, turn):
+        waiters = self.key_locks[key]
+        waiters.remove(turn)
+        if not waiters:
+            del self.key_locks[key]
+        elif not waiters[0].done():
+            waiters[0].set_result(None)
+
+    async def worker(self):
+        """Забирает действия из очереди. Место в очереди ключа занимается сразу после get() -
+        действия по ключу выполняются строго в порядке очереди"""
+        while True:
+            action = await self.actions.get()
+            try:
+                if action['kind'] in ('limit_batch', 'close_batch', 'adjust_batch'):
+                    await self._run_batch(action)
+                    continue
+                metrics.observe('action_queue_seconds', time.perf_counter() - action['queued'], kind=action['kind'])
+                turn = self._reserve_key(action['key'])
+                try:
+                    await turn
+                    await self._execute(action)
+                finally:
+                    self._release_key(action['key'], turn)
+            finally:
+                self.persist()
+                self.actions.task_done()
+
+    def _submit_batch(self, kind: str, actions: list):
+        """Действия одного снимка: одно - как есть, несколько - пачкой kind"""
+        if len(actions) > 1:
+            self.actions.put_nowait({'kind': kind, 'actions': actions, 'queued': time.perf_counter()})
+        elif actions:
+            self.actions.put_nowait(actions[0])
+
+    async def _run_batch(self, batch):
+        """Пачка действий одного снимка. Места в очередях всех её ключей занимаются разом, до
+        первого ожидания - действие следующего снимка по любому из ключей не обгонит пачку"""
+        actions = batch['actions']
+        for action in actions:
+            metrics.observe('action_queue_seconds', time.perf_counter() - action['queued'], kind=action['kind'])
+        turns = {key: self._reserve_key(key) for key in dict.fromkeys(action['key'] for action in actions)}
+        try:
+            await asyncio.gather(*turns.values())
+            await getattr(self, f"_run_{batch['kind']}")(actions)
+        finally:
+            for key, turn in turns.items():
+                self._release_key(key, turn)
+
+    async def _run_limit_batch(self, actions: list):
+        """Лимитные ордера: символы рассылаются одновременно, внутри символа отмены идут
+        раньше изменений и созданий - освобождают маржу"""
+        by_symbol = {}
+        for action in actions:
+            by_symbol.setdefault(action['trace'].attrs.get('symbol'), []).append(action)
+        await asyncio.gather(*[self._run_symbol_limits(symbol_actions) for symbol_actions in by_symbol.values()])
+
+    async def _run_symbol_limits(self, actions: list):
+        for kinds in (('cancel_limit',), ('change_limit', 'open_limit', 'limit_filled')):
+            await asyncio.gather(*[self._execute(action) for action in actions if action['kind'] in kinds])
+
+    async def _execute(self, action):
+        kind = action['kind']
+        started = time.perf_counter()
+        error = None
+        try:
+            with dispatch_priority(ACTION_PRIORITY[kind]):
+                await getattr(self, f'_run_{kind}')(action)
+        except Exception as e:
+            error = e
+            print(f"❌ [{action['trace'].id}] Ошибка обработки события {kind}: {e}")
+            action['trace'].finish()
+        if self.on_action_done is not None:
+            self.on_action_done(action, time.perf_counter() - started, error)
+
+    # ========== ЗДОРОВЬЕ АККАУНТОВ ==========
+
+    def _split_accounts(self, action):
+        """Аккаунты для рассылки и аккаунты с открытым breaker (им нужна досинхронизация)"""
+        healthy, skipped = [], []
+        # Действия досылки после перезапуска адресованы только части аккаунтов
+        for mexc in action.get('accounts') or self.accounts_mexc:
+            (healthy if mexc.health.available else skipped).append(mexc)
+        if skipped:
+            metrics.inc('accounts_skipped_total', len(skipped), kind=action['kind'])
+            print(f"⏭️ [{action['trace'].id}] Пропускаем {len(skipped)} недоступных аккаунтов: "
+                  f"{', '.join(mexc.account_id for mexc in skipped)}")
+        return healthy, skipped
+
+    def _pending_resync(self, mexc: Mexc):
+        """Что аккаунт пропустил, пока был исключён"""
+        return self.resync.setdefault(mexc.account_id, {
+            'mexc': mexc,
+            'opens': set(),  # positionId главного - пропущенные открытия
+            'limits': set(),  # orderId главного - пропущенные лимитные ордера
+            'changes': set(),  # orderId главного - пропущенные изменения
+            'cancels': [],  # orderId ведомого - пропущенные отмены
+        })
 
-                    # Изменяем на всех аках
-                    if order_id in synced_orders:
-                        new_acc_orders = await change_limit_orders(
-                            synced_orders[order_id], new_price, new_vol)
-                        synced_orders[order_id] = new_acc_orders
+    async def health_loop(self, interval: float):
+        """Пробует аккаунты с открытым breaker; восстановившиеся досинхронизирует"""
+        while True:
+            await asyncio.sleep(interval)
+            for mexc in self.accounts_mexc:
+                if mexc.health.probe_due():
+                    mexc.health.start_probe()
+                    spawn(self._probe(mexc))
+
+    async def _probe(self, mexc: Mexc):
+        current_priority.set(PRIORITY_REPORT)
+        try:
+            # Дешёвый авторизованный запрос, заодно обновляет кэш позиций
+            await ledger.refresh(mexc)
+        except Exception as e:
+            print(f"⚠️ Проба аккаунта {mexc.account_id} не прошла: {e}")
+        if mexc.health.state == HALF_OPEN:
+            # Ответ пришёл, но успехом не засчитан (например, отказ авторизации)
+            mexc.health.record_failure('probe')
+        if mexc.health.available:
+            # Даже без пропущенных событий сверяем позиции: операции могли сорваться до открытия breaker
+            self._pending_resync(mexc)
+            trace = tracer.start('resync_account', account=mexc.account_id)
+            self.submit(('account', mexc.account_id), 'resync_account', trace, mexc=mexc)
+
+    # ========== ДЕЙСТВИЯ ==========
+
+    async def _run_close_position(self, action):
+        pos_info = action['pos_info']
+        healthy, skipped = self._split_accounts(action)
+        for mexc in skipped:
+            # Лишние позиции закроет досинхронизация по живым данным
+            self._pending_resync(mexc)
+
+        # ПРОВЕРКА: Убедимся что главный аккаунт доступен
+        if self.main_mexc is not None:
+            print(f"🔍 Проверка главного аккаунта: {self.main_mexc.cookies.get('u_id', 'N/A')}")
+        await run_traced(action['trace'], close_positions(
+            self.main_mexc, healthy, [close_request(pos_info, f"close:{action['position_id']}")]))
+        print(f"✅ Позиция {action['position_id']} закрыта на всех аккаунтах")
+
+    async def _run_close_batch(self, actions: list):
+        """Позиции, закрытые главным в одном снимке: один снимок позиций на ведомый аккаунт,
+        все закрывающие ордера - одной рассылкой, общий отчёт"""
+        healthy, skipped = self._split_accounts(actions[0])
+        for mexc in skipped:
+            # Лишние позиции закроет досинхронизация по живым данным
+            self._pending_resync(mexc)
+        if await self._run_as_one(actions, PRIORITY_CLOSE, close_positions(self.main_mexc, healthy, [
+            close_request(action['pos_info'], f"close:{action['position_id']}") for action in actions
+        ])):
+            print(f"✅ Позиции {[action['position_id'] for action in actions]} закрыты на всех аккаунтах")
+
+    async def _run_adjust_position(self, action):
+        healthy = self._adjust_accounts(action)
+        with dispatch_priority(self._adjust_priority([action])):
+            await run_traced(action['trace'], adjust_positions(healthy, [action['adjustment']]))
+
+    async def _run_adjust_batch(self, actions: list):
+        """Изменения позиций главного одного снимка - одной рассылкой"""
+        healthy = self._adjust_accounts(actions[0])
+        await self._run_as_one(actions, self._adjust_priority(actions),
+                               adjust_positions(healthy, [action['adjustment'] for action in actions]))
+
+    def _adjust_accounts(self, action):
+        healthy, skipped = self._split_accounts(action)
+        for mexc in skipped:
+            # Изменение такой аккаунт пропускает - позиции сверит досинхронизация
+            self._pending_resync(mexc)
+        return healthy
+
+    @staticmethod
+    def _adjust_priority(actions: list):
+        """Частичные закрытия и стоп-лоссы снижают риск - идут с приоритетом закрытий"""
+        if any(action['adjustment']['vol_delta'] < 0 or action['adjustment']['stop_loss_changed']
+               for action in actions):
+            return PRIORITY_CLOSE
+        return PRIORITY_OPEN
+
+    async def _run_as_one(self, actions: list, priority: int, coro) -> bool:
+        """Пачка действий одной рассылкой: событие ведёт трассировка первого действия,
+        остальные завершаются после рассылки"""
+        started = time.perf_counter()
+        error = None
+        lead = actions[0]['trace']
+        for action in actions[1:]:
+            action['trace'].mark('batched', lead=lead.id)
+        try:
+            with dispatch_priority(priority):
+                await run_traced(lead, coro)
+        except Exception as e:
+            error = e
+            print(f"❌ [{lead.id}] Ошибка обработки пачки {actions[0]['kind']}: {e}")
+            lead.finish()
+        for action in actions[1:]:
+            action['trace'].finish()
+        if self.on_action_done is not None:
+            elapsed = time.perf_counter() - started
+            for action in actions:
+                self.on_action_done(action, elapsed, error)
+        return error is None
+
+    async def _run_open_position(self, action):
+        position = action['position']
+        healthy, skipped = self._split_accounts(action)
+        for mexc in skipped:
+            self._pending_resync(mexc)['opens'].add(position['positionId'])
+
+        results = await run_traced(action['trace'], open_positions(
+            self.main_mexc,
+            healthy, position['symbol'], position['side'], position['leverage'],
+            position['stopLossPrice'], position['vol'], position['openType'], f"open:{position['positionId']}"))
+
+        for result in results:
+            print(result if isinstance(result, Exception) else result.json())
+
+    @staticmethod
+    def _created_orders(mexcs: list[Mexc], results):
+        """Связь ведомых ордеров с ответами order/create"""
+        acc_orders = []
+        for mexc, result in zip(mexcs, results):
+            try:
+                r_json = result.json()
+                if r_json.get("success"):
+                    acc_order_id = r_json['data']['orderId']
+                    acc_orders.append((mexc, acc_order_id))
+                    print(f"  ✅ Ордер создан: {acc_order_id}")
+                else:
+                    print(f"  ❌ Ошибка создания ордера: {r_json}")
+            except Exception as e:
+                print(f"  ❌ Ошибка парсинга: {e}")
+        return acc_orders
+
+    async def _run_open_limit(self, action):
+        order_info = action['order_info']
+        healthy, skipped = self._split_accounts(action)
+        for mexc in skipped:
+            self._pending_resync(mexc)['limits'].add(action['order_id'])
+
+        # Открываем на всех аках
+        results = await run_traced(action['trace'], open_limit_orders(
+            healthy, order_info['symbol'], order_info['side'], order_info['leverage'],
+            order_info['price'], order_info['vol'], order_info['openType'], f"limit:{action['order_id']}"),
+            finish=True)
+
+        # Сохраняем связь (после перезапуска досылаются не все аккаунты - дополняем)
+        self.synced_orders.setdefault(action['order_id'], []).extend(self._created_orders(healthy, results))
+
+    async def _run_limit_filled(self, action):
+        self.synced_orders.pop(action['order_id'], None)
+        # Сверка могла пройти между обнаружением и этим действием, до исполнения копий
+        ledger.mark_stale(action['symbol'], action['side'])
+        action['trace'].finish()
+
+    def _linked_orders(self) -> dict:
+        """orderId ведомых, связанные с ордерами главного: {account_id: {orderId}}"""
+        linked = {}
+        for acc_orders in self.synced_orders.values():
+            for mexc, acc_order_id in acc_orders:
+                linked.setdefault(mexc.account_id, set()).add(str(acc_order_id))
+        return linked
+
+    async def _run_cancel_limit(self, action):
+        acc_orders = self.synced_orders.pop(action['order_id'], None) or []
+        healthy = []
+        for mexc, acc_order_id in acc_orders:
+            if mexc.health.available:
+                healthy.append((mexc, acc_order_id))
+            else:
+                self._pending_resync(mexc)['cancels'].append(acc_order_id)
+        if healthy:
+            await run_traced(action['trace'], cancel_limit_orders(healthy), finish=True)
+        else:
+            action['trace'].finish()
+
+    async def _run_change_limit(self, action):
+        # Изменяем на всех аках
+        order_id = action['order_id']
+        if order_id not in self.synced_orders:
+            action['trace'].finish()
+            return
+        healthy, kept = [], []
+        for mexc, acc_order_id in self.synced_orders[order_id]:
+            if mexc.health.available:
+                healthy.append((mexc, acc_order_id))
+            else:
+                # Старый ордер остаётся, изменение применит досинхронизация
+                kept.append((mexc, acc_order_id))
+                self._pending_resync(mexc)['changes'].add(order_id)
+        new_acc_orders = await run_traced(action['trace'], change_limit_orders(
+            healthy, action['price'], action['vol'], action['trace'].attrs.get('symbol'), self._linked_orders()),
+            finish=True)
+        self.synced_orders[order_id] = new_acc_orders + kept
+
+    async def _run_resync_account(self, action):
+        """Досинхронизация восстановившегося аккаунта с главным"""
+        mexc = action['mexc']
+        pending = self.resync.pop(mexc.account_id, None)
+        if pending is None:
+            action['trace'].finish()
+            return
+        if not mexc.health.available:
+            # Снова упал - попробуем после следующей пробы
+            self.resync[mexc.account_id] = pending
+            action['trace'].finish()
+            return
+        print(f"🔄 [{action['trace'].id}] Досинхронизация аккаунта {mexc.account_id}...")
+        await run_traced(action['trace'], self._resync_account(mexc, pending), finish=True)
+
+    async def _resync_account(self, mexc: Mexc, pending: dict):
+        # 1. Позиции, которых у главного уже нет, закрываем
+        positions = await ledger.refresh(mexc)
+        master_keys = {(position['symbol'], position['side']) for position in self.master_positions.values()}
+        slave_keys = {(position['symbol'], position['side']) for position in positions}
+        closes = [close_request(position, f"resync:{position['positionId']}") for position in positions
+                  if (position['symbol'], position['side']) not in master_keys]
+        if closes:
+            await close_account_positions(mexc, closes, 1, 1, time.perf_counter())
+
+        # 2. Пропущенные открытия - если позиция главного ещё открыта
+        for position_id in pending['opens']:
+            position = self.master_positions.get(position_id)
+            if position is None or (position['symbol'], position['side']) in slave_keys:
+                continue
+            await open_positions(self.main_mexc, [mexc], position['symbol'], position['side'], position['leverage'],
+                                 position['stopLossPrice'], position['vol'], position['openType'],
+                                 f"open:{position_id}")
+
+        # 3. Лимитные ордера: пропущенные отмены, создания и изменения
+        if pending['cancels']:
+            await cancel_limit_orders([(mexc, acc_order_id) for acc_order_id in pending['cancels']])
+        for order_id in pending['limits']:
+            order_info = self.opened_orders.get(order_id)
+            if order_info is None:
+                continue
+            results = await open_limit_orders([mexc], order_info['symbol'], order_info['side'], order_info['leverage'],
+                                              order_info['price'], order_info['vol'], order_info['openType'],
+                                              f"limit:{order_id}")
+            self.synced_orders.setdefault(order_id, []).extend(self._created_orders([mexc], results))
+        for order_id in pending['changes'] - pending['limits']:
+            order_info = self.opened_orders.get(order_id)
+            acc_orders = self.synced_orders.get(order_id, [])
+            stale = [(acc, acc_order_id) for acc, acc_order_id in acc_orders if acc is mexc]
+            if order_info is None or not stale:
+                continue
+            changed = await change_limit_orders(stale, order_info['price'], order_info['vol'],
+                                                order_info['symbol'], self._linked_orders())
+            self.synced_orders[order_id] = [pair for pair in acc_orders if pair[0] is not mexc] + changed
+        print(f"✅ Аккаунт {mexc.account_id} досинхронизирован")
+
+
+def configure_dispatch(shards: int = 1):
+    """Лимиты запросов и политика повторов процесса. Общий лимит делится между шардами"""
+    # Ограничение одновременных запросов к бирже (всего и на один прокси)
+    global_limit = max(1, DISPATCH_CONCURRENCY // shards) if DISPATCH_CONCURRENCY else 0
+    scheduler.configure(global_limit, DISPATCH_PROXY_CONCURRENCY)
+
+    # Общая политика повторов: ордера - короткий срок, запросы данных - подольше
+    ORDER_POLICY.configure(deadline=ORDER_REQUEST_DEADLINE, attempt_timeout=ORDER_REQUEST_TIMEOUT,
+                           base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
+    ORDER_CHANGE_POLICY.configure(deadline=ORDER_REQUEST_DEADLINE, attempt_timeout=ORDER_CHANGE_TIMEOUT,
+                                  base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
+    QUERY_POLICY.configure(deadline=QUERY_REQUEST_DEADLINE, attempt_timeout=QUERY_REQUEST_TIMEOUT,
+                           base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
+
+
+def _shard_path(path, shard: int = None):
+    """Файл процесса-шарда рядом с общим: metrics.json -> metrics.shard0.json"""
+    if not path or shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+def start_telemetry(shard: int = None):
+    # Трассировки событий (JSON Lines)
+    tracer.path = _shard_path(TRACE_FILE, shard)
+
+    # Метрики задержек: Prometheus-эндпоинт и периодический JSON-снимок (у шардов - свой порт)
+    if METRICS_PORT:
+        spawn(metrics.serve(METRICS_HOST, METRICS_PORT if shard is None else METRICS_PORT + shard + 1))
+    if METRICS_DUMP_FILE:
+        spawn(metrics.dump_loop(_shard_path(METRICS_DUMP_FILE, shard), METRICS_DUMP_INTERVAL))
+
+
+def configure_account(mexc: Mexc):
+    """Breaker, кэш истории и объединение запросов аккаунта; соединения держим тёплыми между сделками"""
+    mexc.health.configure(failure_threshold=CIRCUIT_FAILURE_THRESHOLD, open_seconds=CIRCUIT_OPEN_SECONDS)
+    mexc.history.configure(page_size=ORDER_HISTORY_PAGE_SIZE, max_pages=ORDER_HISTORY_MAX_PAGES,
+                           keep=ORDER_HISTORY_KEEP)
+    mexc.cancels.configure(window=COALESCE_WINDOW)
+    mexc.order_queries.configure(window=COALESCE_WINDOW)
+    spawn(mexc.keep_alive(KEEP_ALIVE_INTERVAL))
+
+
+def configure_main_account(main_mexc: Mexc):
+    configure_account(main_mexc)
+    # Главный аккаунт из опроса не исключаем никогда
+    main_mexc.health.configure(breaker=False)
+
+
+async def start_engine(main_mexc: Mexc, accounts_mexc: list[Mexc], shard: int = None, master_view=None):
+    """Рассылка ведомым: прогрев аккаунтов, воркеры действий, восстановление состояния.
+    В шарде main_mexc=None: главный аккаунт обслуживает координатор, его вид приходит в master_view"""
+    if main_mexc is not None:
+        configure_main_account(main_mexc)
+    for mexc in accounts_mexc:
+        configure_account(mexc)
+
+    # Соединения и u_id проверяются сразу - первая сделка не платит за DNS, прокси и TLS
+    await warm_up_accounts(main_mexc, accounts_mexc)
+
+    # Периодическая сверка кэша позиций ведомых аккаунтов
+    spawn(ledger.run(accounts_mexc, LEDGER_RECONCILE_INTERVAL, REPORT_CONCURRENCY))
+
+    # Опрос главного аккаунта и рассылка действий ведомым работают независимо
+    engine = CopyEngine(main_mexc, accounts_mexc)
+    if STATE_JOURNAL_FILE:
+        engine.journal = StateJournal(_shard_path(STATE_JOURNAL_FILE, shard),
+                                      _shard_path(STATE_SNAPSHOT_FILE, shard), STATE_COMPACT_EVERY)
+    metrics.add_collector(engine.collect_metrics)
+    for _ in range(ACTION_WORKERS):
+        spawn(engine.worker())
+    # Аккаунты с открытым breaker пробуются в фоне и досинхронизируются после восстановления
+    spawn(engine.health_loop(HEALTH_PROBE_INTERVAL))
+
+    # Состояние до перезапуска сверяется с биржей до начала опроса
+    while True:
+        try:
+            await engine.recover(master_view)
+            break
+        except Exception as e:
+            print(f"❌ Ошибка восстановления состояния: {e}")
+            await asyncio.sleep(DELAY_BETWEEN_CHECK_POSITIONS)
+    return engine
+
+
+def start_stream(main_mexc: Mexc, engine):
+    # Изменения главного аккаунта приходят из потока, опрос тогда редкий и страхующий
+    if MASTER_STREAM_ENABLED:
+        engine.stream = MasterStream(main_mexc, engine, ping_interval=MASTER_STREAM_PING_INTERVAL,
+                                     reconnect_max_delay=MASTER_STREAM_RECONNECT_MAX_DELAY)
+        spawn(engine.stream.run())
+
+
+# ========== ШАРДИРОВАННЫЙ РЕЖИМ ==========
+
+class ShardCoordinator(CopyEngine):
+    """Главный процесс шардированного режима: опрашивает главный аккаунт (и слушает поток)
+    и рассылает снимки и обновления процессам-шардам. Изменения ищет каждый шард сам
+    по своей копии вида главного - сравнение детерминировано, события у всех одни и те же.
+    Главный аккаунт запрашивает только координатор; отчёты о событиях шарды присылают
+    строками ведомых, координатор добавляет данные главного и отправляет одно сообщение"""
+
+    def __init__(self, main_mexc: Mexc):
+        super().__init__(main_mexc, [])
+        self.shards = []  # ShardProcess
+        self.sequence = 0
+        self.reports = {}  # {ключ события: {kind, meta, rows: {индекс шарда: строки ведомых}}}
+
+    def broadcast(self, kind: str, *args):
+        self.sequence += 1
+        sent_at = time.time()
+        for shard in self.shards:
+            shard.send(kind, self.sequence, sent_at, *args)
+
+    def apply_snapshot(self, positions, orders, received_at, version=None):
+        if not super().apply_snapshot(positions, orders, received_at, version):
+            return False
+        self.broadcast('apply_snapshot', positions, orders, received_at)
+        return True
 
-                    # Обновляем информацию
-                    opened_orders[order_id]['price'] = new_price
-                    opened_orders[order_id]['vol'] = new_vol
+    def apply_position_update(self, position, closed: bool, received_at):
+        super().apply_position_update(position, closed, received_at)
+        self.broadcast('apply_position_update', position, closed, received_at)
+
+    def apply_order_update(self, order, removed: bool, filled: bool, received_at):
+        super().apply_order_update(order, removed, filled, received_at)
+        self.filled_orders.clear()
+        self.broadcast('apply_order_update', order, removed, filled, received_at)
+
+    def _view_changed(self, received_at):
+        # Вид главного ведём для новых шардов, изменения ищут сами шарды
+        self.version += 1
+
+    def on_start(self, shard):
+        """Новый (или перезапущенный) шард восстанавливается по текущему виду главного"""
+        self.sequence += 1
+        shard.send('master_view', self.sequence, time.time(),
+                   list(self.master_positions.values()), list(self.master_orders.values()))
+
+    def on_message(self, shard, message):
+        kind, *args = message
+        labels = {'shard': str(shard.index)}
+        if kind == 'ready':
+            print(f"🧩 Шард {shard.index} готов: {args[0]} ведомых аккаунтов")
+        elif kind == 'ack':
+            sequence, sent_at = args
+            # Время от рассылки снимка до его разбора шардом
+            metrics.observe('shard_ack_seconds', time.time() - sent_at, **labels)
+        elif kind == 'result':
+            action_kind, seconds, error = args
+            metrics.inc('shard_actions_total', kind=action_kind, status='error' if error else 'ok', **labels)
+            metrics.observe('shard_action_seconds', seconds, kind=action_kind, **labels)
+            if error:
+                print(f"❌ Шард {shard.index}: ошибка {action_kind}: {error}")
+        elif kind == 'report':
+            self.collect_report(shard, *args)
+
+    def collect_report(self, shard, kind: str, events: list):
+        """Строки ведомых шарда по событиям. Событие, по которому ответили все шарды, уходит
+        в отчёт сразу; закрытия одной рассылки, завершённые одним сообщением, - общим отчётом"""
+        complete = []
+        for key, meta, rows in events:
+            pending = self.reports.get(key)
+            if pending is None:
+                pending = self.reports[key] = {'kind': kind, 'meta': meta, 'rows': {}}
+                spawn(self._report_deadline(key, pending))
+            pending['rows'][shard.index] = rows
+            if len(pending['rows']) == len(self.shards):
+                complete.append(self.reports.pop(key))
+        if complete:
+            spawn(self.send_report(kind, complete))
+
+    async def _report_deadline(self, key, pending):
+        await asyncio.sleep(SHARD_REPORT_WAIT)
+        if self.reports.get(key) is pending:
+            del self.reports[key]
+            print(f"⚠️ Отчёт {key}: строки прислали шарды {sorted(pending['rows'])} из {len(self.shards)}")
+            await self.send_report(pending['kind'], [pending])
+
+    async def send_report(self, kind: str, events: list):
+        """Один отчёт: данные главного аккаунта и строки ведомых всех шардов по порядку шардов"""
+        current_priority.set(PRIORITY_REPORT)
+        semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+        rows = [[row for index in sorted(event['rows']) for row in event['rows'][index]] for event in events]
+        with metrics.timer('report_seconds', kind=kind):
+            if kind == 'open':
+                main_data = await asyncio.gather(*[open_main_data(self.main_mexc, event['meta']['symbol'], semaphore)
+                                                   for event in events])
+                messages = [open_report_message(event['meta']['symbol'], event['meta']['side'],
+                                                event['meta']['leverage'], entry_price, margin, event_rows)
+                            for event, (entry_price, margin), event_rows in zip(events, main_data, rows)]
+            else:
+                main_data = await asyncio.gather(*[self._main_close_data(event['meta'], semaphore)
+                                                   for event in events])
+                messages = [close_report_message(event['meta']['symbol'], event['meta']['side'],
+                                                 event['meta']['leverage'], main_rows + event_rows)
+                            for event, main_rows, event_rows in zip(events, main_data, rows)]
+        # Сообщения позиций заканчиваются переводом строки - между ними остаётся пустая строка
+        await send_telegram_message("\n".join(messages))
+
+    async def _main_close_data(self, close: dict, semaphore: asyncio.Semaphore) -> list:
+        if not close['position_id']:
+            return []
+        return [await collect_close_data(main_close_info(self.main_mexc, close), None, semaphore)]
+
+
+async def run_coordinator(main_mexc: Mexc, accounts: list):
+    """Главный аккаунт опрашивается здесь, ведомые распределены по SHARD_PROCESSES процессам"""
+    configure_dispatch()
+    configure_main_account(main_mexc)
+    start_telemetry()
+    await warm_up_accounts(main_mexc, [])
+
+    coordinator = ShardCoordinator(main_mexc)
+    metrics.add_collector(coordinator.collect_metrics)
+    # Шарды восстанавливаются по виду главного из этого опроса, а не запрашивают его сами
+    while True:
+        try:
+            await coordinator.poll()
+            break
+        except Exception as e:
+            print(f"❌ Ошибка опроса главного аккаунта: {e}")
+            await asyncio.sleep(DELAY_BETWEEN_CHECK_POSITIONS)
+
+    for index, shard_accounts in enumerate(split_accounts(accounts, SHARD_PROCESSES)):
+        if shard_accounts:
+            coordinator.shards.append(ShardProcess(index, run_shard, (shard_accounts,),
+                                                   coordinator.on_message, coordinator.on_start))
+    print(f"🧩 Запуск {len(coordinator.shards)} шардов: "
+          f"{', '.join(str(len(shard.args[0])) for shard in coordinator.shards)} аккаунтов")
+    for shard in coordinator.shards:
+        spawn(shard.run())
+    await asyncio.gather(*[shard.ready.wait() for shard in coordinator.shards])
+
+    start_stream(main_mexc, coordinator)
+    try:
+        await coordinator.poll_loop(DELAY_BETWEEN_CHECK_POSITIONS, MASTER_STREAM_POLL_INTERVAL)
+    finally:
+        await asyncio.gather(*[shard.stop() for shard in coordinator.shards])
+
+
+async def shard_main(index: int, connection, accounts: list):
+    """Процесс-шард: свой event loop, свои ведомые; вид главного приходит от координатора,
+    отчёты уходят ему же - главный аккаунт и Telegram шард не трогает"""
+    global report_sink
+    channel = Channel(connection)
+    accounts_mexc = [Mexc(uid, proxy) for uid, proxy in accounts]
+    print(f"🧩 Шард {index}: {len(accounts_mexc)} ведомых аккаунтов")
+
+    # Первым сообщением координатор присылает текущий вид главного - по нему шард восстанавливается
+    message = await channel.recv()
+    if message is None or message[0] == 'stop':
+        return
+    _, _, _, positions, orders = message
+    report_sink = lambda kind, events: channel.send('report', kind, events)
+
+    configure_dispatch(SHARD_PROCESSES)
+    start_telemetry(index)
+    engine = await start_engine(None, accounts_mexc, index, (positions, orders))
+    engine.on_action_done = lambda action, seconds, error: channel.send(
+        'result', action['kind'], seconds, str(error) if error else None)
+    channel.send('ready', len(accounts_mexc))
+
+    while True:
+        message = await channel.recv()
+        if message is None or message[0] == 'stop':
+            break
+        method, sequence, sent_at, *args = message
+        getattr(engine, method)(*args)
+        channel.send('ack', sequence, sent_at)
+
+
+def run_shard(index: int, connection, accounts: list):
+    """Точка входа процесса-шарда"""
+    try:
+        asyncio.run(shard_main(index, connection, accounts))
+    except KeyboardInterrupt:
+        pass
+
+
+async def main(main_mexc: Mexc = None, accounts_mexc: list[Mexc] = None):
+    """Основной цикл. Аккаунты можно передать готовыми (симуляция), иначе читаются из ./accounts"""
+    print("🟢 Бот запущен пользователем.")
+    notifier.start()
+    if main_mexc is None:
+        with open("./accounts/main.txt", "r") as file:
+            for line in file:
+                parts = line.strip().split("|")
+                uid = parts[0]
+                proxy = parts[1] if len(parts) > 1 else None
+                main_mexc = Mexc(uid, proxy)
+
+    if accounts_mexc is None:
+        accounts = load_accounts()
+        print(f"\nУспешно загружено {len(accounts)} ведомых аккаунтов\n")
+        if SHARD_PROCESSES > 1:
+            # Подпись, разбор JSON и логирование сотен аккаунтов распределяются по ядрам
+            await run_coordinator(main_mexc, accounts)
+            return
+        accounts_mexc = [Mexc(uid, proxy) for uid, proxy in accounts]
+    else:
+        print(f"\nУспешно загружено {len(accounts_mexc)} ведомых аккаунтов\n")
 
-        await asyncio.sleep(DELAY_BETWEEN_CHECK_POSITIONS)
+    configure_dispatch()
+    start_telemetry()
+    engine = await start_engine(main_mexc, accounts_mexc)
+    start_stream(main_mexc, engine)
+    await engine.poll_loop(DELAY_BETWEEN_CHECK_POSITIONS, MASTER_STREAM_POLL_INTERVAL)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм (сек): от миллисекунд до таймаутов запросов
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, q: float):
+        """Приблизительный квантиль: верхняя граница корзины, в которую он попадает"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+def process_memory_bytes():
+    """Резидентная память процесса (RSS) или None, если платформа её не отдаёт"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Без /proc - пиковое значение (на Linux в КБ, на macOS в байтах)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class Metrics:
+    """Гистограммы задержек, счётчики и текущие значения с метками; отдаются в формате Prometheus и в JSON"""
+
+    def __init__(self):
+        self.histograms = {}  # {(name, ((метка, значение), ...)): Histogram}
+        self.counters = {}  # {(name, ((метка, значение), ...)): число}
+        self.gauges = {}  # {(name, ((метка, значение), ...)): текущее значение}
+        self.collectors = []  # Функции, обновляющие текущие значения перед отдачей метрик
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"⚠️ Ошибка сбора метрик: {e}")
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Замер длительности блока (в том числе с await внутри)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render_prometheus(self) -> str:
+        self.collect()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted(self.gauges.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        escaped = (f'{key}="{value.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                   for key, value in labels)
+        return "{" + ",".join(escaped) + "}"
+
+    def snapshot(self) -> dict:
+        self.collect()
+        histograms = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            histograms.append({
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': round(histogram.sum, 6),
+                'avg': round(histogram.sum / histogram.count, 6) if histogram.count else None,
+                'p50': self._finite(histogram.quantile(0.5)),
+                'p99': self._finite(histogram.quantile(0.99)),
+            })
+        counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())]
+        gauges = [{'name': name, 'labels': dict(labels), 'value': value}
+                  for (name, labels), value in sorted(self.gauges.items())]
+        return {
+            'timestamp': time.time(),
+            'uptime': time.time() - self.started,
+            'histograms': histograms,
+            'counters': counters,
+            'gauges': gauges,
+        }
+
+    @staticmethod
+    def _finite(value):
+        # JSON не умеет Infinity - значение выше последней корзины отдаём строкой
+        return '+Inf' if value == float('inf') else value
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            path = request_line.decode('latin-1').split(' ')[1] if request_line else '/'
+            if path.startswith('/metrics.json'):
+                body, content_type = json.dumps(self.snapshot()), 'application/json'
+            else:
+                body, content_type = self.render_prometheus(), 'text/plain; version=0.0.4'
+            data = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data
+            )
+            await writer.drain()
+        except Exception as e:
+            print(f"⚠️ Ошибка отдачи метрик: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        """Локальный эндпоинт /metrics (Prometheus) и /metrics.json"""
+        server = await asyncio.start_server(self._handle, host, port)
+        print(f"📈 Метрики: http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    async def dump_loop(self, path: str, interval: float):
+        """Периодически сохраняет снимок метрик в JSON-файл"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                snapshot = json.dumps(self.snapshot())
+                await asyncio.to_thread(self._write, path, snapshot)
+            except Exception as e:
+                print(f"⚠️ Ошибка сохранения метрик: {e}")
+
+    @staticmethod
+    def _write(path: str, data: str):
+        with open(path, 'w') as file:
+            file.write(data)
+
+
+# Общий реестр метрик процесса
+metrics = Metrics()
@@ -1,13 +1,88 @@
 import hashlib
 import json
 import time
-from curl_cffi import AsyncSession
 import asyncio
+from transport import Transport, CurlTransport, JsonResponse
+from metrics import metrics
+from tracing import span, tag
+from scheduler import scheduler, PRIORITY_REPORT
+from retry import (RetryPolicy, ORDER_POLICY, ORDER_CHANGE_POLICY, QUERY_POLICY, response_retry_cause, response_auth_failed,
+                   exception_retry_cause, retry_after, QueueDeadlineExceeded)
+from health import AccountHealth, AccountUnavailable
+from history import OrderHistory
+from coalesce import Coalescer
+
+FUTURES_HOST = "https://futures.mexc.com"
+WWW_HOST = "https://www.mexc.com"
+
+# Приватные эндпоинты фьючерсов
+PRIVATE_API = f"{WWW_HOST}/api/platform/futures/api/v1/private"
+ORDER_CREATE_URL = f"{FUTURES_HOST}/api/v1/private/order/create"
+ORDER_CANCEL_URL = f"{PRIVATE_API}/order/cancel"
+CHANGE_LIMIT_ORDER_URL = f"{PRIVATE_API}/order/change_limit_order"
+HISTORY_ORDERS_URL = f"{PRIVATE_API}/order/list/history_orders"
+OPEN_ORDERS_URL = f"{PRIVATE_API}/order/list/open_orders"
+OPEN_POSITIONS_URL = f"{PRIVATE_API}/position/open_positions"
+EXTERNAL_ORDER_URL = f"{PRIVATE_API}/order/external/{{symbol}}/{{external_oid}}"
+ORDER_BATCH_QUERY_URL = f"{PRIVATE_API}/order/batch_query"
+ORDER_BATCH_QUERY_LIMIT = 50  # orderId в одном запросе batch_query
+ORDER_CANCEL_LIMIT = 50  # orderId в одном запросе order/cancel
+STOP_ORDERS_URL = f"{PRIVATE_API}/stoporder/list/orders"
+STOP_ORDER_CHANGE_URL = f"{PRIVATE_API}/stoporder/change_plan_price"
+
+# Поток приватных обновлений (позиции и ордера)
+FUTURES_WS_URL = "wss://contract.mexc.com/edge"
+
+# Лёгкие запросы для поддержания соединений
+KEEP_ALIVE_URLS = {
+    FUTURES_HOST: f"{FUTURES_HOST}/api/v1/contract/ping",
+    WWW_HOST: f"{WWW_HOST}/api/platform/futures/api/v1/contract/ping",
+}
+
+
+def endpoint_name(url: str) -> str:
+    """Короткое имя эндпоинта для метрик: order/create, position/open_positions, ..."""
+    path = url.split('?', 1)[0]
+    if '/private/' in path:
+        return path.split('/private/', 1)[1]
+    return path.rsplit('/', 1)[-1]
+
+
+def client_order_id(event_id: str, account_id: str) -> str:
+    """Детерминированный externalOid: одно событие главного аккаунта - один ордер на аккаунт"""
+    return "cp" + hashlib.md5(f"{event_id}:{account_id}".encode('utf-8')).hexdigest()[:30]
+
+
+def format_position(position: dict) -> dict:
+    """Позиция биржи (REST или WebSocket) в формате бота"""
+    # Преобразуем positionType в side для совместимости
+    # positionType: 1 - LONG, 2 - SHORT
+    # Наш side: 1 - LONG, 3 - SHORT
+    position_type = position.get('positionType')
+    return {
+        'positionId': position.get('positionId'),
+        'symbol': position.get('symbol'),
+        'side': 1 if position_type == 1 else 3,  # Конвертируем positionType в side
+        'vol': position.get('holdVol'),
+        'leverage': position.get('leverage'),
+        'openType': position.get('openType'),
+        'openAvgPrice': position.get('openAvgPrice'),
+        'holdVol': position.get('holdVol'),
+        'holdAvgPrice': position.get('holdAvgPrice'),
+        'profit': position.get('closeProfitLoss', 0),
+        'stopLossPrice': position.get('stopLossPrice'),
+        'liquidatePrice': position.get('liquidatePrice'),
+        'realised': position.get('realised'),
+    }
 
 
 class Mexc:
-    def __init__(self, uid: str, proxy: str):
+    def __init__(self, uid: str, proxy: str, transport: Transport = None, host_map: dict = None):
         self.proxy = proxy
+        # Короткий идентификатор аккаунта для логов и внутренних ключей (без самого токена)
+        self.account_id = hashlib.md5(uid.encode('utf-8')).hexdigest()[:10]
+        # Прокси для меток метрик - без логина и пароля
+        self.proxy_label = proxy.rsplit('@', 1)[-1] if proxy else 'direct'
         self.cookies = {
             'u_id': uid,
         }
@@ -31,15 +106,77 @@ class Mexc:
             'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36',
             'x-language': 'ru-RU',
         }
-        if self.proxy:
-            proxy = f"socks5://{self.proxy}"
-            self.ses = AsyncSession(
-                proxy=proxy, headers=self.headers, cookies=self.cookies, impersonate="chrome136", verify=False
-            )
-        else:
-            self.ses = AsyncSession(
-                headers=self.headers, cookies=self.cookies, impersonate="chrome136", verify=False
-            )
+        # Последнее использование соединения по хостам (для keep-alive)
+        self.last_used = {FUTURES_HOST: 0.0, WWW_HOST: 0.0}
+        # HTTP-движок: по умолчанию curl_cffi, в симуляции - биржа в памяти
+        self.transport = transport or CurlTransport(self.headers, self.cookies, proxy, host_map)
+        # Успехи и ошибки запросов; при открытом breaker аккаунт исключается из рассылок
+        self.health = AccountHealth(self.account_id)
+        # Кэш исполненных ордеров для отчётов: догружаются только новые
+        self.history = OrderHistory(self)
+        # Отмены и запросы ордеров, пришедшие почти одновременно, уходят одним запросом
+        self.cancels = Coalescer('cancel', self.account_id, self.cancel_order, limit=ORDER_CANCEL_LIMIT)
+        self.order_queries = Coalescer('batch_query', self.account_id, self.get_orders, limit=ORDER_BATCH_QUERY_LIMIT)
+
+    async def reset_session(self):
+        """Пересоздаёт соединения (битое соединение, умерший прокси)"""
+        await self.transport.reset()
+        self.last_used = {host: 0.0 for host in self.last_used}
+
+    async def close(self):
+        await self.transport.close()
+
+    async def keep_alive(self, interval: float = 20):
+        """Держит соединения тёплыми: пингует хосты, простаивающие дольше interval"""
+        while True:
+            await asyncio.sleep(interval / 2)
+            for host, url in KEEP_ALIVE_URLS.items():
+                if time.monotonic() - self.last_used[host] < interval or not self.health.allow_request():
+                    continue
+                try:
+                    # Код ответа не важен - достаточно, что соединение живое
+                    async with scheduler.slot(self.proxy, PRIORITY_REPORT):
+                        await self.transport.request('GET', url, timeout=5)
+                    self.last_used[host] = time.monotonic()
+                except Exception as e:
+                    # Транспорт уже пересоздал соединение
+                    print(f"⚠️ Keep-alive {host} не прошёл: {e}")
+
+    async def warm_up(self) -> dict:
+        """Прогрев соединений с обоими хостами и проверка u_id дешёвым авторизованным запросом.
+        Возвращает время первого запроса по хостам (DNS, прокси, TLS), проверки u_id и ошибку"""
+        report = {'hosts': {}, 'auth': None, 'error': None}
+
+        async def connect(host):
+            started = time.perf_counter()
+            try:
+                async with scheduler.slot(self.proxy, PRIORITY_REPORT):
+                    await self.transport.request('GET', KEEP_ALIVE_URLS[host], timeout=QUERY_POLICY.attempt_timeout)
+            except Exception as e:
+                report['hosts'][host] = None
+                report['error'] = report['error'] or f"{host}: {e}"
+                return
+            self.last_used[host] = time.monotonic()
+            report['hosts'][host] = time.perf_counter() - started
+            metrics.observe('startup_handshake_seconds', report['hosts'][host],
+                            host=host.split('//', 1)[-1], proxy=self.proxy_label)
+
+        async def authenticate():
+            # Приватные запросы идут на www - проверяем по уже прогретому соединению
+            await connect(WWW_HOST)
+            started = time.perf_counter()
+            try:
+                r_json = (await self._request_with_retry('GET', OPEN_POSITIONS_URL)).json()
+            except Exception as e:
+                report['error'] = report['error'] or f"проверка u_id: {e}"
+                return
+            if r_json.get("success"):
+                report['auth'] = time.perf_counter() - started
+            else:
+                report['error'] = f"u_id отклонён: {r_json.get('message') or r_json.get('code')}"
+
+        await asyncio.gather(connect(FUTURES_HOST), authenticate())
+        return report
 
     def md5(self, value):
         return hashlib.md5(value.encode('utf-8')).hexdigest()
@@ -51,86 +188,218 @@ class Mexc:
         sign = self.md5(date_now + s + g)
         return {'time': date_now, 'sign': sign}
 
-    async def get_order_history(self, symbol: str = None, limit: int = 50):
+    async def get_order_history(self, symbol: str = None, limit: int = 50, page_num: int = 1):
         """Получение истории ордеров с улучшенной фильтрацией"""
-        url = "https://www.mexc.com/api/platform/futures/api/v1/private/order/list/history_orders"
         params = {
-            'page_num': 1,
+            'page_num': page_num,
             'page_size': limit,
             'state': 3  # Выполненные ордера
         }
         if symbol:
             params['symbol'] = symbol
 
-        r = await self._request_with_retry('GET', url, params=params)
-        r_json = r.json()
-
-        if not r_json.get("success"):
-            print(f"❌ Ошибка получения истории ордеров: {r_json.get('message', 'Unknown error')}")
-            return []
-
-        orders = r_json.get("data", [])
+        orders = await self._get_json(HISTORY_ORDERS_URL, "Ошибка получения истории ордеров", params=params)
 
         # Сортируем ордера по времени создания (новые сначала)
         orders.sort(key=lambda x: x.get('createTime', 0), reverse=True)
 
         return orders
 
-    async def _request_with_retry(self, method, url, max_retries=3, timeout=10, **kwargs):
-        """Выполняет запрос с retry логикой и таймаутом"""
-        for attempt in range(max_retries):
-            try:
-                if method.upper() == 'GET':
-                    response = await self.ses.get(url, timeout=timeout, **kwargs)
-                elif method.upper() == 'POST':
-                    response = await self.ses.post(url, timeout=timeout, **kwargs)
-                else:
-                    raise ValueError(f"Unsupported HTTP method: {method}")
-                return response
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
-                    print(f"⚠️ Ошибка запроса (попытка {attempt + 1}/{max_retries}): {e}. Повтор через {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    print(f"❌ Все попытки запроса исчерпаны: {e}")
-                    raise
+    async def get_orders(self, order_ids: list):
+        """Детали ордеров по orderId (исполнение, маржа, PNL) - пачками по ORDER_BATCH_QUERY_LIMIT"""
+        batches = [order_ids[i:i + ORDER_BATCH_QUERY_LIMIT] for i in range(0, len(order_ids), ORDER_BATCH_QUERY_LIMIT)]
+        results = await asyncio.gather(*[
+            self._get_json(ORDER_BATCH_QUERY_URL, "Ошибка получения ордеров",
+                           params={'order_ids': ','.join(str(order_id) for order_id in batch)})
+            for batch in batches
+        ])
+        return [order for orders in results for order in orders]
+
+    async def _get_json(self, url, error_text, params=None):
+        """GET-запрос: возвращает data из ответа или [] при ошибке биржи"""
+        r = await self._request_with_retry('GET', url, params=params)
+        r_json = r.json()
 
-    async def place_order(self, obj):
-        signature = self.mexc_crypto(self.cookies["u_id"], obj)
-        headers = {
+        if not r_json.get("success"):
+            print(f"❌ {error_text}: {r_json.get('message', 'Unknown error')}")
+            return []
+
+        return r_json.get("data", [])
+
+    def _signed_headers(self, obj):
+        """Заголовки подписи поверх заголовков постоянной сессии"""
+        with span('sign', account=self.account_id):
+            signature = self.mexc_crypto(self.cookies["u_id"], obj)
+        return {
             'Content-Type': 'application/json',
             'x-mxc-sign': signature['sign'],
             'x-mxc-nonce': signature['time'],
-            'Authorization': self.cookies["u_id"],
         }
 
-        # Создаём новую сессию для каждого ордера с retry логикой
-        for attempt in range(3):
+    async def _request_with_retry(self, method, url, policy: RetryPolicy = QUERY_POLICY, signed=None, recover=None,
+                                  **kwargs):
+        """Выполняет запрос по политике повторов: общий срок операции, короткие попытки,
+        повтор только временных ошибок (сеть, 5xx, лимиты). signed - тело POST, которое
+        подписывается заново на каждой попытке (свежий nonce). recover - проверка перед
+        повтором после неясного исхода (таймаут, 5xx): если запрос всё же дошёл до биржи,
+        возвращает готовый ответ и повтора не будет"""
+        host = FUTURES_HOST if url.startswith(FUTURES_HOST) else WWW_HOST
+        labels = {'endpoint': endpoint_name(url), 'account': self.account_id, 'proxy': self.proxy_label}
+        if not self.health.allow_request():
+            # Мёртвый прокси или истёкший u_id не должен тратить слоты и повторы
+            metrics.inc('mexc_requests_rejected_total', **labels)
+            raise AccountUnavailable(f"аккаунт {self.account_id} временно исключён ({self.health.last_error})")
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            response, error = None, None
             try:
-                async with AsyncSession(
-                    proxy=self.proxy,
-                    headers=headers,
-                    cookies=self.cookies,
-                    impersonate="chrome136",
-                    verify=False
-                ) as ses:
-                    r = await ses.post(
-                        "https://futures.mexc.com/api/v1/private/order/create",
-                        json=obj,
-                        timeout=10
-                    )
-                    return r
-            except Exception as e:
-                if attempt < 2:
-                    wait_time = 2 ** attempt
-                    print(f"⚠️ Ошибка place_order (попытка {attempt + 1}/3): {e}. Повтор через {wait_time}s...")
-                    await asyncio.sleep(wait_time)
+                # Слот планировщика держим только на время запроса, не на паузу перед повтором
+                async with scheduler.slot(self.proxy):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise QueueDeadlineExceeded(f"срок операции {policy.deadline}s истёк в очереди")
+                    if signed is not None:
+                        kwargs['json'] = signed
+                        kwargs['headers'] = self._signed_headers(signed)
+                    started = time.perf_counter()
+                    # Спан запроса: start - отправка, end - ответ биржи
+                    with span('request', attempt=attempt, **labels) as request_span:
+                        response = await self.transport.request(
+                            method, url, timeout=min(policy.attempt_timeout, remaining), **kwargs)
+                        if request_span is not None:
+                            request_span['status'] = response.status_code
+                self.last_used[host] = time.monotonic()
+                elapsed = time.perf_counter() - started
+                metrics.observe('mexc_request_seconds', elapsed, **labels)
+
+                cause = response_retry_cause(response)
+                if cause is None:
+                    if response_auth_failed(response):
+                        self.health.record_auth_failure()
+                    else:
+                        self.health.record_success(elapsed)
+                    return response
+                if cause == 'rate_limit':
+                    delay = retry_after(response, policy.rate_limit_delay)
                 else:
-                    print(f"❌ Все попытки place_order исчерпаны: {e}")
-                    raise
+                    delay = policy.backoff(attempt)
+            except ValueError:
+                raise
+            except Exception as e:
+                metrics.inc('mexc_request_errors_total', **labels)
+                error, cause = e, exception_retry_cause(e)
+                delay = policy.backoff(attempt)
+
+            reason = error if error is not None else f"HTTP {response.status_code} {response.text[:200]}"
+            # Таймаут или ошибка сервера: запрос мог быть исполнен
+            ambiguous = recover is not None and cause != 'rate_limit'
+            if time.monotonic() + delay >= deadline:
+                if ambiguous:
+                    recovered = await self._recover(recover, labels)
+                    if recovered is not None:
+                        return recovered
+                if cause != 'queue':
+                    # Перегрузка планировщика - не вина аккаунта
+                    self.health.record_failure(cause)
+                metrics.inc('mexc_retries_exhausted_total', cause=cause, **labels)
+                print(f"❌ {tag()}Срок запроса {labels['endpoint']} аккаунта {self.account_id} исчерпан "
+                      f"после {attempt} попыток ({cause}): {reason}")
+                if error is not None:
+                    raise error
+                return response
+
+            metrics.inc('mexc_retries_total', cause=cause, **labels)
+            print(f"⚠️ {tag()}Ошибка запроса {labels['endpoint']} аккаунта {self.account_id} "
+                  f"(попытка {attempt}, {cause}): {reason}. Повтор через {delay:.2f}s...")
+            await asyncio.sleep(delay)
+            if ambiguous:
+                recovered = await self._recover(recover, labels)
+                if recovered is not None:
+                    return recovered
+
+    async def _recover(self, recover, labels):
+        try:
+            recovered = await recover()
+        except Exception as e:
+            print(f"⚠️ {tag()}Не удалось проверить исход запроса {labels['endpoint']} аккаунта {self.account_id}: {e}")
+            return None
+        if recovered is not None:
+            metrics.inc('mexc_retries_recovered_total', **labels)
+            print(f"✅ {tag()}Запрос {labels['endpoint']} аккаунта {self.account_id} уже исполнен биржей - не повторяем")
+        return recovered
+
+    async def get_external_order(self, symbol: str, external_oid: str):
+        """Ордер по клиентскому externalOid или None, если биржа его не видела"""
+        url = EXTERNAL_ORDER_URL.format(symbol=symbol, external_oid=external_oid)
+        # Одна короткая попытка: проверка стоит между повторами ордера
+        async with scheduler.slot(self.proxy):
+            r = await self.transport.request('GET', url, timeout=ORDER_POLICY.attempt_timeout)
+        r_json = r.json()
+        if not r_json.get("success") or not r_json.get("data"):
+            return None
+        return r_json["data"]
+
+    async def _open_orders_once(self):
+        """Открытые ордера одной попыткой или None: проверка стоит между повторами отмены и изменения"""
+        async with scheduler.slot(self.proxy):
+            r = await self.transport.request('GET', OPEN_ORDERS_URL, params={'page_size': 200},
+                                             timeout=ORDER_CHANGE_POLICY.attempt_timeout)
+        r_json = r.json()
+        if not r_json.get("success"):
+            return None
+        return r_json.get("data") or []
+
+    async def _recover_changed_order(self, order_id, price: str, vol: int, symbol: str = None, linked=()):
+        """Ответ change_limit_order для изменения, уже исполненного биржей, или None.
+        Старый ордер ещё открыт - изменения не было; исчез - новым считается единственный открытый
+        ордер символа с той же ценой и объёмом, не связанный с другими ордерами главного (linked).
+        Несколько кандидатов - не угадываем, изменение считается неудачным"""
+        orders = await self._open_orders_once()
+        if orders is None or any(str(order['orderId']) == str(order_id) for order in orders):
+            return None
+        changed = [order for order in orders
+                   if (symbol is None or order['symbol'] == symbol) and str(order['orderId']) not in linked
+                   and float(order['price']) == float(price) and order['vol'] == vol]
+        if len(changed) != 1:
+            if changed:
+                print(f"⚠️ {tag()}Изменённый ордер {order_id} аккаунта {self.account_id} не опознан: "
+                      f"{len(changed)} ордеров с ценой {price} и объёмом {vol}")
+            return None
+        return JsonResponse({'success': True, 'code': 0, 'data': changed[0]['orderId']})
+
+    async def _recover_cancelled_orders(self, order_ids: list):
+        """Ответ order/cancel, если ни одного из ордеров уже нет среди открытых, иначе None"""
+        orders = await self._open_orders_once()
+        if orders is None:
+            return None
+        open_ids = {str(order['orderId']) for order in orders}
+        if any(str(order_id) in open_ids for order_id in order_ids):
+            return None
+        return JsonResponse({'success': True, 'code': 0, 'data': [
+            {'orderId': order_id, 'errorCode': 0, 'errorMsg': 'success'} for order_id in order_ids]})
+
+    async def _recover_external_order(self, obj):
+        """Ответ order/create для ордера, уже созданного биржей по externalOid, или None"""
+        order = await self.get_external_order(obj["symbol"], obj["externalOid"])
+        if order is None:
+            return None
+        return JsonResponse({'success': True, 'code': 0,
+                             'data': {'orderId': order.get('orderId'), 'ts': order.get('createTime')}})
 
-    async def open_position(self, symbol: str, side: int, leverage: int, stop_loss_price: str, vol: int, open_type: int):
+    async def place_order(self, obj):
+        return await self._request_with_retry(
+            'POST',
+            ORDER_CREATE_URL,
+            policy=ORDER_POLICY,
+            signed=obj,
+            # После таймаута сначала ищем ордер по externalOid - повтор не создаст дубль
+            recover=(lambda: self._recover_external_order(obj)) if obj.get("externalOid") else None,
+        )
+
+    async def open_position(self, symbol: str, side: int, leverage: int, stop_loss_price: str, vol: int, open_type: int,
+                            external_oid: str = None):
         # ЛОНГ; МАРЖА 3$; пчеле 3x; позиция 11$; стоп лосс 101 454,1;
 
         # side; 1 - LONG; 3 - SHORT; 4 - CLOSE LONG; 2 - CLOSE SHORT;
@@ -168,6 +437,8 @@ class Mexc:
             "lossTrend": "1",
             "priceProtect": "0",
         }
+        if external_oid:
+            object["externalOid"] = external_oid
 
         # return {
         #     "success": true,
@@ -180,7 +451,8 @@ class Mexc:
 
         return await self.place_order(object)
 
-    async def open_position_limit(self, symbol: str, side: int, leverage: int, price: str, vol: int, open_type: int):
+    async def open_position_limit(self, symbol: str, side: int, leverage: int, price: str, vol: int, open_type: int,
+                                  external_oid: str = None):
         # side; 1 - LONG; 3 - SHORT; 4 - CLOSE LONG; 2 - CLOSE SHORT;
         # openType; 1 - isolated margin, 2 - cross margin;
         # type; 1 - limit, 5 - market;
@@ -210,10 +482,13 @@ class Mexc:
             "price": price,
             "priceProtect": "0",
         }
+        if external_oid:
+            object["externalOid"] = external_oid
 
         return await self.place_order(object)
 
-    async def close_position(self, symbol: str, position_id: int, leverage: int, vol: int, side: int, open_type: int):
+    async def close_position(self, symbol: str, position_id: int, leverage: int, vol: int, side: int, open_type: int,
+                             external_oid: str = None):
         # side; 1 - LONG; 3 - SHORT; 4 - CLOSE LONG; 2 - CLOSE SHORT;
         template = {
             'symbol': 'BTC_USDT',
@@ -238,25 +513,14 @@ class Mexc:
             "flashClose": True,
             "priceProtect": "0",
         }
+        if external_oid:
+            object["externalOid"] = external_oid
         return await self.place_order(object)
 
     async def get_open_positions(self, symbol: str = None):
         """📊 Получение открытых позиций через open_positions API"""
         # Используем новый эндпоинт для получения открытых позиций
-        url = "https://www.mexc.com/api/platform/futures/api/v1/private/position/open_positions"
-
-        # Используем retry логику
-        r = await self._request_with_retry('GET', url)
-        r_json = r.json()
-
-        # print(f"📊 get_open_positions response: {r_json}")
-
-        if not r_json.get("success"):
-            print(
-                f"❌ Ошибка получения позиций: {r_json.get('message', 'Unknown error')}")
-            return []
-
-        positions = r_json.get("data", [])
+        positions = await self._get_json(OPEN_POSITIONS_URL, "Ошибка получения позиций")
 
         # Структура позиции из open_positions:
         # {
@@ -279,43 +543,10 @@ class Mexc:
         #     ...
         # }
 
-        # Преобразуем positionType в side для совместимости
-        # positionType: 1 - LONG, 2 - SHORT
-        # Наш side: 1 - LONG, 3 - SHORT
-        formatted_positions = []
-        for position in positions:
-            position_type = position.get('positionType')
-
-            formatted_position = {
-                'positionId': position.get('positionId'),
-                'symbol': position.get('symbol'),
-                'side': 1 if position_type == 1 else 3,  # Конвертируем positionType в side
-                'vol': position.get('holdVol'),
-                'leverage': position.get('leverage'),
-                'openType': position.get('openType'),
-                'openAvgPrice': position.get('openAvgPrice'),
-                'holdVol': position.get('holdVol'),
-                'holdAvgPrice': position.get('holdAvgPrice'),
-                'profit': position.get('closeProfitLoss', 0),
-                'stopLossPrice': position.get('stopLossPrice'),
-                'liquidatePrice': position.get('liquidatePrice'),
-                'realised': position.get('realised'),
-            }
-            formatted_positions.append(formatted_position)
-
-        return formatted_positions
+        return [format_position(position) for position in positions]
 
     async def get_open_orders(self):
-        url = "https://www.mexc.com/api/platform/futures/api/v1/private/order/list/open_orders?page_size=200"
-        r = await self._request_with_retry('GET', url)
-        r_json = r.json()
-
-        if not r_json.get("success"):
-            print(
-                f"❌ Ошибка получения ордеров: {r_json.get('message', 'Unknown error')}")
-            return []
-
-        orders = r_json.get("data", [])
+        orders = await self._get_json(OPEN_ORDERS_URL, "Ошибка получения ордеров", params={'page_size': 200})
         return orders
         # {
         #     "success": true,
@@ -359,76 +590,63 @@ class Mexc:
         #     ]
         # }
 
+    async def cancel_orders(self, order_ids: list):
+        """Отмена ордеров вместе с другими отменами аккаунта в том же окне"""
+        return await self.cancels.submit(order_ids)
+
+    async def query_orders(self, order_ids: list):
+        """Детали ордеров; запросы аккаунта в том же окне объединяются в один batch_query"""
+        wanted = {str(order_id) for order_id in order_ids}
+        orders = await self.order_queries.submit(order_ids)
+        return [order for order in orders if str(order.get('orderId')) in wanted]
+
     async def cancel_order(self, order_ids: list):
         """Отмена ордеров по списку ID"""
-        signature = self.mexc_crypto(self.cookies["u_id"], order_ids)
-        headers = {
-            'Content-Type': 'application/json',
-            'x-mxc-sign': signature['sign'],
-            'x-mxc-nonce': signature['time'],
-            'Authorization': self.cookies["u_id"],
+        return await self._request_with_retry(
+            'POST',
+            ORDER_CANCEL_URL,
+            policy=ORDER_CHANGE_POLICY,
+            signed=order_ids,
+            # Повторная отмена исполненной отмены вернёт "ордер не существует" - сначала проверяем
+            recover=lambda: self._recover_cancelled_orders(order_ids),
+        )
+
+    async def get_stop_orders(self, symbol: str):
+        """Действующие стоп-ордера (TP/SL позиций) символа"""
+        return await self._get_json(STOP_ORDERS_URL, "Ошибка получения стоп-ордеров",
+                                    params={'symbol': symbol, 'is_finished': 0, 'page_size': 100})
+        # [{"id": 12345, "symbol": "BTC_USDT", "positionId": 1105037265, "stopLossPrice": 101454.1,
+        #   "takeProfitPrice": null, "state": 1, ...}]
+
+    async def change_stop_loss(self, stop_order_id, stop_loss_price: str, take_profit_price: str = None):
+        """Новая цена стоп-лосса стоп-ордера позиции (тейк-профит сохраняется)"""
+        obj = {
+            "stopPlanOrderId": stop_order_id,
+            "stopLossPrice": stop_loss_price,
         }
-
-        for attempt in range(3):
-            try:
-                async with AsyncSession(
-                    proxy=self.proxy,
-                    headers=headers,
-                    cookies=self.cookies,
-                    impersonate="chrome136",
-                    verify=False
-                ) as ses:
-                    r = await ses.post(
-                        "https://www.mexc.com/api/platform/futures/api/v1/private/order/cancel",
-                        json=order_ids,
-                        timeout=10
-                    )
-                    return r
-            except Exception as e:
-                if attempt < 2:
-                    wait_time = 2 ** attempt
-                    print(f"⚠️ Ошибка cancel_order (попытка {attempt + 1}/3): {e}. Повтор через {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    print(f"❌ Все попытки cancel_order исчерпаны: {e}")
-                    raise
-
-    async def change_limit_order(self, order_id: str, price: str, vol: int):
-        """Изменение лимитного ордера. Возвращает новый orderId"""
+        if take_profit_price:
+            obj["takeProfitPrice"] = take_profit_price
+        return await self._request_with_retry(
+            'POST',
+            STOP_ORDER_CHANGE_URL,
+            policy=ORDER_POLICY,
+            signed=obj,
+        )
+
+    async def change_limit_order(self, order_id: str, price: str, vol: int, symbol: str = None, linked=()):
+        """Изменение лимитного ордера. Возвращает новый orderId. symbol и linked (orderId, уже
+        связанные с другими ордерами главного) сужают поиск нового ордера после неясного исхода"""
         obj = {
             "orderId": order_id,
             "price": price,
             "vol": vol
         }
 
-        signature = self.mexc_crypto(self.cookies["u_id"], obj)
-        headers = {
-            'Content-Type': 'application/json',
-            'x-mxc-sign': signature['sign'],
-            'x-mxc-nonce': signature['time'],
-            'Authorization': self.cookies["u_id"],
-        }
-
-        for attempt in range(3):
-            try:
-                async with AsyncSession(
-                    proxy=self.proxy,
-                    headers=headers,
-                    cookies=self.cookies,
-                    impersonate="chrome136",
-                    verify=False
-                ) as ses:
-                    r = await ses.post(
-                        "https://www.mexc.com/api/platform/futures/api/v1/private/order/change_limit_order",
-                        json=obj,
-                        timeout=10
-                    )
-                    return r
-            except Exception as e:
-                if attempt < 2:
-                    wait_time = 2 ** attempt
-                    print(f"⚠️ Ошибка change_limit_order (попытка {attempt + 1}/3): {e}. Повтор через {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    print(f"❌ Все попытки change_limit_order исчерпаны: {e}")
-                    raise
+        return await self._request_with_retry(
+            'POST',
+            CHANGE_LIMIT_ORDER_URL,
+            policy=ORDER_CHANGE_POLICY,
+            signed=obj,
+            # Изменение заменяет ордер новым - после неясного исхода ищем новый, а не повторяем
+            recover=lambda: self._recover_changed_order(order_id, price, vol, symbol, linked),
+        )
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from curl_cffi import AsyncSession
+
+# Telegram не принимает сообщения длиннее 4096 символов
+TELEGRAM_MAX_LENGTH = 4096
+
+
+class TelegramNotifier:
+    """Асинхронная отправка уведомлений: очередь, один фоновый отправитель, дайджесты"""
+
+    def __init__(self, token: str, chat_id: str, queue_size: int = 100, digest_window: float = 2,
+                 min_interval: float = 3, timeout: float = 10):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.digest_window = digest_window
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.ses = None
+        self.task = None
+        self.last_sent = 0.0
+        self.dropped = 0
+        # Выключается в симуляции и бенчмарках
+        self.enabled = True
+
+    def start(self):
+        if self.task is None:
+            self.ses = AsyncSession()
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.ses:
+            await self.ses.close()
+            self.ses = None
+
+    def notify(self, message: str):
+        """Ставит сообщение в очередь и сразу возвращает управление"""
+        if not self.enabled:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"⚠️ Очередь Telegram переполнена, сообщение пропущено (всего пропущено: {self.dropped})")
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+
+            # Собираем всплеск событий в один дайджест
+            await asyncio.sleep(self.digest_window)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            for chunk in self._pack(batch):
+                await self._send(chunk)
+
+    def _pack(self, messages: list[str]):
+        """Склеивает сообщения в куски не длиннее лимита Telegram (режет только по строкам)"""
+        chunks = []
+        current = ""
+        for message in messages:
+            for part in self._split(message):
+                candidate = f"{current}\n\n{part}" if current else part
+                if len(candidate) <= TELEGRAM_MAX_LENGTH:
+                    current = candidate
+                else:
+                    chunks.append(current)
+                    current = part
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _split(self, message: str):
+        if len(message) <= TELEGRAM_MAX_LENGTH:
+            return [message]
+
+        parts = []
+        current = ""
+        for line in message.split("\n"):
+            line = line[:TELEGRAM_MAX_LENGTH]
+            candidate = f"{current}\n{line}" if current else line
+            if len(candidate) <= TELEGRAM_MAX_LENGTH:
+                current = candidate
+            else:
+                parts.append(current)
+                current = line
+        if current:
+            parts.append(current)
+        return parts
+
+    async def _send(self, text: str):
+        # Соблюдаем лимит частоты сообщений в чат
+        wait = self.last_sent + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        payload = {
+            'chat_id': self.chat_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+        for attempt in range(2):
+            try:
+                response = await self.ses.post(self.url, json=payload, timeout=self.timeout)
+                self.last_sent = time.monotonic()
+                if response.status_code == 429:
+                    # Telegram сообщает, сколько ждать до следующей отправки
+                    retry_after = response.json().get('parameters', {}).get('retry_after', self.min_interval)
+                    print(f"⚠️ Telegram rate limit, повтор через {retry_after}s")
+                    await asyncio.sleep(retry_after)
+                    continue
+                if response.status_code != 200:
+                    print(f"❌ Ошибка отправки в Telegram: {response.text}")
+                return
+            except Exception as e:
+                self.last_sent = time.monotonic()
+                print(f"❌ Ошибка отправки в Telegram: {e}")
+                return
@@ -0,0 +1,53 @@
+class Record:
+    """Компактная запись состояния: поля в __slots__, без словаря на каждый экземпляр.
+
+    Читается и как словарь (record['symbol'], record.get(...), dict(record)) - код
+    копирования и журнал состояния работают с записями так же, как со словарями.
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Запись из словаря (журнала); лишние ключи старых версий отбрасываются"""
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    def keys(self):
+        return self.__slots__
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self.__slots__
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self.__slots__ else default
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and dict(self) == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class PositionRecord(Record):
+    """Отслеживаемая позиция главного аккаунта"""
+    __slots__ = ('positionId', 'symbol', 'side', 'leverage', 'vol', 'openType', 'stopLossPrice')
+
+
+class OrderRecord(Record):
+    """Отслеживаемый лимитный ордер главного аккаунта"""
+    __slots__ = ('symbol', 'price', 'vol', 'leverage', 'side', 'openType', 'dealVol')
@@ -0,0 +1,94 @@
+import asyncio
+import random
+
+# Коды ошибок MEXC, при которых повтор имеет смысл
+RATE_LIMIT_CODES = {510}  # Слишком частые запросы
+RETRYABLE_CODES = {500, 501, 9999}  # Внутренняя ошибка, система занята
+AUTH_ERROR_CODES = {401}  # Не авторизован: u_id истёк или отозван
+
+
+class QueueDeadlineExceeded(TimeoutError):
+    """Срок операции истёк, пока запрос ждал слот планировщика"""
+
+
+class RetryPolicy:
+    """Повторы запроса в пределах общего срока операции.
+
+    deadline - сколько всего может занять операция вместе с очередью и паузами,
+    attempt_timeout - таймаут одной попытки. Пауза между попытками - экспоненциальная
+    со случайным разбросом, чтобы сотни аккаунтов не повторяли запросы синхронно.
+    """
+
+    def __init__(self, deadline: float, attempt_timeout: float, base_delay: float = 0.2, max_delay: float = 2.0,
+                 rate_limit_delay: float = 1.0):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_delay = rate_limit_delay
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(self.base_delay, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+# Ордера: короткие попытки - устаревший ордер хуже пропущенного. Запросы данных могут ждать дольше
+ORDER_POLICY = RetryPolicy(deadline=5, attempt_timeout=2)
+# Отмена и изменение не находятся по externalOid - попытка длиннее, чтобы реже гадать об исходе
+ORDER_CHANGE_POLICY = RetryPolicy(deadline=5, attempt_timeout=2)
+QUERY_POLICY = RetryPolicy(deadline=15, attempt_timeout=5)
+
+
+def response_retry_cause(response):
+    """Причина повтора для ответа биржи или None, если ответ окончательный"""
+    status = response.status_code
+    if status == 429:
+        return 'rate_limit'
+    if status >= 500:
+        return 'server_error'
+    if status >= 400:
+        return None
+
+    # Успешные ответы не разбираем повторно - биржа отдаёт компактный JSON
+    if '"success":false' not in (getattr(response, 'text', '') or ''):
+        return None
+    try:
+        code = response.json().get('code')
+    except Exception:
+        return None
+    if code in RATE_LIMIT_CODES:
+        return 'rate_limit'
+    if code in RETRYABLE_CODES:
+        return 'server_error'
+    return None
+
+
+def response_auth_failed(response) -> bool:
+    if response.status_code == 401:
+        return True
+    if '"success":false' not in (getattr(response, 'text', '') or ''):
+        return False
+    try:
+        return response.json().get('code') in AUTH_ERROR_CODES
+    except Exception:
+        return False
+
+
+def exception_retry_cause(error: Exception) -> str:
+    if isinstance(error, QueueDeadlineExceeded):
+        return 'queue'
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or 'timed out' in str(error).lower():
+        return 'timeout'
+    return 'connection'
+
+
+def retry_after(response, default: float) -> float:
+    """Пауза из заголовка Retry-After (сек) или default"""
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return max(0.0, float(headers.get('Retry-After') or headers.get('retry-after')))
+    except (TypeError, ValueError):
+        return default
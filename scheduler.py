@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from metrics import metrics
+
+# Приоритеты запросов к бирже (меньше - важнее)
+PRIORITY_CLOSE = 0  # Закрытия, отмены и опрос главного аккаунта
+PRIORITY_OPEN = 1  # Открытия и изменения ордеров
+PRIORITY_REPORT = 2  # Отчёты, история, сверки и keep-alive
+PRIORITY_NAMES = {PRIORITY_CLOSE: 'close', PRIORITY_OPEN: 'open', PRIORITY_REPORT: 'report'}
+
+# Приоритет текущей задачи; наследуется задачами asyncio, созданными внутри
+current_priority = contextvars.ContextVar('current_priority', default=PRIORITY_REPORT)
+
+
+@contextmanager
+def dispatch_priority(priority: int):
+    """Задаёт приоритет запросов для блока (и задач, созданных в нём)"""
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class DispatchScheduler:
+    """Ограничивает число одновременных запросов к бирже - всего и на один прокси.
+
+    Когда свободных слотов нет, запросы ждут в очередях по приоритетам: освободившийся
+    слот получает самый важный ожидающий запрос, чей прокси не упёрся в свой лимит.
+    """
+
+    def __init__(self, global_limit: int = 0, proxy_limit: int = 0):
+        self.global_limit = global_limit  # 0 - без ограничения
+        self.proxy_limit = proxy_limit
+        self.active = 0
+        self.proxy_active = {}  # {proxy: запросов в работе}
+        self.waiting = {priority: deque() for priority in PRIORITY_NAMES}  # (proxy, future)
+
+    def configure(self, global_limit: int, proxy_limit: int):
+        self.global_limit = global_limit
+        self.proxy_limit = proxy_limit
+        self._wake()
+
+    def _has_capacity(self, proxy):
+        if self.global_limit and self.active >= self.global_limit:
+            return False
+        # Прямые подключения (без прокси) ограничены только общим лимитом
+        if proxy and self.proxy_limit and self.proxy_active.get(proxy, 0) >= self.proxy_limit:
+            return False
+        return True
+
+    def _take(self, proxy):
+        self.active += 1
+        if proxy:
+            self.proxy_active[proxy] = self.proxy_active.get(proxy, 0) + 1
+
+    def _release(self, proxy):
+        self.active -= 1
+        if proxy:
+            left = self.proxy_active[proxy] - 1
+            if left:
+                self.proxy_active[proxy] = left
+            else:
+                del self.proxy_active[proxy]
+        self._wake()
+
+    def _waiting_ahead(self, priority):
+        return any(self.waiting[level] for level in PRIORITY_NAMES if level <= priority)
+
+    def _wake(self):
+        for priority in sorted(self.waiting):
+            queue = self.waiting[priority]
+            skipped = deque()
+            while queue:
+                if self.global_limit and self.active >= self.global_limit:
+                    queue.extendleft(reversed(skipped))
+                    return
+                proxy, future = queue.popleft()
+                if future.done():
+                    continue
+                if not self._has_capacity(proxy):
+                    # Прокси занят - пропускаем, но сохраняем место в очереди
+                    skipped.append((proxy, future))
+                    continue
+                self._take(proxy)
+                future.set_result(None)
+            queue.extend(skipped)
+
+    @asynccontextmanager
+    async def slot(self, proxy: str = None, priority: int = None):
+        """Слот на один запрос. Приоритет по умолчанию - из current_priority"""
+        if priority is None:
+            priority = current_priority.get()
+        if self._has_capacity(proxy) and not self._waiting_ahead(priority):
+            self._take(proxy)
+        else:
+            started = time.perf_counter()
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[priority].append((proxy, future))
+            self._wake()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Слот успели выдать - возвращаем его
+                    self._release(proxy)
+                raise
+            metrics.observe('dispatch_wait_seconds', time.perf_counter() - started,
+                            priority=PRIORITY_NAMES[priority])
+        try:
+            yield
+        finally:
+            self._release(proxy)
+
+
+# Общий планировщик запросов процесса (лимиты задаются при старте)
+scheduler = DispatchScheduler()
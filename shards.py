@@ -0,0 +1,165 @@
+import asyncio
+import collections
+import hashlib
+import multiprocessing
+import time
+from metrics import metrics
+
+
+def shard_index(uid: str, proxy: str, shards: int) -> int:
+    """Шард аккаунта: аккаунты одного прокси - в одном процессе (лимит на прокси остаётся общим),
+    прямые - по u_id. Разбиение стабильно между перезапусками при том же числе шардов"""
+    key = proxy or uid
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16) % shards
+
+
+def split_accounts(accounts: list, shards: int) -> list[list]:
+    """[(uid, proxy), ...] -> список аккаунтов по шардам"""
+    result = [[] for _ in range(shards)]
+    for uid, proxy in accounts:
+        result[shard_index(uid, proxy, shards)].append((uid, proxy))
+    return result
+
+
+class Channel:
+    """Сторона канала в event loop: сообщения (pickle через pipe) читаются по готовности
+    дескриптора и складываются в очередь. Отправка не ждёт получателя: сообщения копятся
+    в outbox, а пишет их отдельная задача вне event loop - полный pipe (получатель занят
+    или перезапускается) не останавливает цикл. Из сообщений видов coalesce в outbox
+    остаётся только последнее - устаревший снимок не отправляется"""
+
+    def __init__(self, connection, coalesce=()):
+        self.connection = connection
+        self.messages = asyncio.Queue()
+        self.closed = False
+        self.coalesce = set(coalesce)
+        self.outbox = collections.deque()
+        self.outbox_ready = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        loop = asyncio.get_running_loop()
+        loop.add_reader(connection.fileno(), self._on_readable)
+        self.writer = loop.create_task(self._write_loop())
+
+    def _on_readable(self):
+        try:
+            while self.connection.poll():
+                self.messages.put_nowait(self.connection.recv())
+        except (EOFError, OSError):
+            self.close()
+            # None в очереди - канал закрыт
+            self.messages.put_nowait(None)
+
+    def send(self, *message):
+        if self.closed:
+            return False
+        if message[0] in self.coalesce:
+            queued = len(self.outbox)
+            self.outbox = collections.deque(item for item in self.outbox if item[0] != message[0])
+            if len(self.outbox) < queued:
+                metrics.inc('shard_messages_coalesced_total', queued - len(self.outbox), kind=message[0])
+        self.outbox.append(message)
+        self.idle.clear()
+        self.outbox_ready.set()
+        return True
+
+    async def _write_loop(self):
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            while self.outbox:
+                message = self.outbox.popleft()
+                try:
+                    # connection.send блокируется, пока получатель не разберёт pipe
+                    await asyncio.to_thread(self.connection.send, message)
+                except (BrokenPipeError, OSError):
+                    self.close()
+                    return
+            self.idle.set()
+
+    async def drain(self, timeout: float):
+        """Ждёт отправки накопленных сообщений (не дольше timeout)"""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def recv(self):
+        return await self.messages.get()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.idle.set()
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            asyncio.get_running_loop().remove_reader(self.connection.fileno())
+        except Exception:
+            pass
+        self.connection.close()
+
+
+class ShardProcess:
+    """Процесс-шард со своим event loop. Упавший процесс перезапускается с нарастающей паузой:
+    состояние шард восстанавливает из своего журнала и сверки с биржей"""
+
+    def __init__(self, index: int, target, args: tuple, on_message, on_start=None, restart_max_delay: float = 30):
+        self.index = index
+        self.target = target
+        self.args = args
+        self.on_message = on_message  # on_message(shard, message)
+        self.on_start = on_start  # on_start(shard) - первые сообщения каждому новому процессу
+        self.restart_max_delay = restart_max_delay
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.channel = None
+        self.ready = asyncio.Event()
+
+    def send(self, *message):
+        return self.channel is not None and self.channel.send(*message)
+
+    async def run(self):
+        delay = 1
+        while True:
+            started = time.monotonic()
+            parent, child = self.context.Pipe()
+            self.process = self.context.Process(target=self.target, args=(self.index, child, *self.args),
+                                                name=f"shard-{self.index}", daemon=True)
+            self.process.start()
+            child.close()
+            # Снимок главного полный - шарду, который не успевает читать, нужен только последний
+            self.channel = Channel(parent, coalesce=('apply_snapshot',))
+            if self.on_start is not None:
+                self.on_start(self)
+            try:
+                while True:
+                    message = await self.channel.recv()
+                    if message is None:
+                        break
+                    if message[0] == 'ready':
+                        self.ready.set()
+                    self.on_message(self, message)
+            finally:
+                self.channel.close()
+                self.ready.clear()
+                self.process.join(timeout=1)
+                if self.process.is_alive():
+                    self.process.kill()
+
+            if time.monotonic() - started > self.restart_max_delay:
+                # Шард успел поработать - это не продолжение прошлых сбоев
+                delay = 1
+            metrics.inc('shard_restarts_total', shard=str(self.index))
+            print(f"⚠️ Шард {self.index} завершился (код {self.process.exitcode}), перезапуск через {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.restart_max_delay)
+
+    async def stop(self):
+        if self.send('stop'):
+            await self.channel.drain(timeout=5)
+        if self.process is not None and self.process.is_alive():
+            await asyncio.to_thread(self.process.join, 5)
+            if self.process.is_alive():
+                self.process.kill()
@@ -0,0 +1,428 @@
+import argparse
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit, parse_qsl
+
+from transport import Transport, JsonResponse
+
+# Размер контракта по умолчанию: 1 vol = 0.0001 BTC (~11$ при цене 110 000)
+DEFAULT_CONTRACT_SIZE = 0.0001
+DEFAULT_PRICE = 110000.0
+
+
+class SimAccount:
+    def __init__(self, uid: str):
+        self.uid = uid
+        self.positions = {}  # {positionId: позиция в формате open_positions}
+        self.open_orders = {}  # {orderId: ордер в формате open_orders}
+        self.history = []  # Все ордера (исполненные и отменённые)
+
+
+class SimulatedExchange:
+    """Фьючерсная биржа MEXC в памяти: позиции, лимитные ордера, история, исполнения
+
+    Понимает те же приватные эндпоинты, что использует Mexc, поэтому копировщик
+    можно гонять на сотнях фейковых аккаунтов без сети.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, contract_size: float = DEFAULT_CONTRACT_SIZE):
+        self.latency = latency
+        self.jitter = jitter
+        self.account_latency = {}  # {uid: задержка} - медленные аккаунты
+        self.lost_responses = Counter()  # {uid: сколько ответов потерять} - запрос исполнен, ответ не дошёл
+        self.contract_size = contract_size
+        self.prices = {}
+        self.accounts = {}
+        self.requests = Counter()
+        self._order_ids = itertools.count(746397375190355968)
+        self._position_ids = itertools.count(1105037265)
+
+    # === Управление симуляцией ===
+
+    def account(self, uid: str) -> SimAccount:
+        if uid not in self.accounts:
+            self.accounts[uid] = SimAccount(uid)
+        return self.accounts[uid]
+
+    def price(self, symbol: str) -> float:
+        return self.prices.get(symbol, DEFAULT_PRICE)
+
+    def set_price(self, symbol: str, price: float):
+        """Меняет цену и исполняет пересечённые лимитные ордера"""
+        self.prices[symbol] = price
+        for account in self.accounts.values():
+            for order in list(account.open_orders.values()):
+                if order['symbol'] != symbol:
+                    continue
+                crossed = price <= order['price'] if order['side'] == 1 else price >= order['price']
+                if crossed:
+                    del account.open_orders[order['orderId']]
+                    self._fill_open(account, order, order['price'])
+
+    async def delay(self, uid: str):
+        latency = self.account_latency.get(uid, self.latency)
+        if latency or self.jitter:
+            await asyncio.sleep(latency + random.uniform(0, self.jitter))
+
+    # === Обработка запросов ===
+
+    def handle(self, uid: str, method: str, url: str, params=None, body=None) -> JsonResponse:
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query))
+        query.update({key: str(value) for key, value in (params or {}).items()})
+        path = parts.path
+        endpoint = path.rsplit('/private/', 1)[-1]
+        if endpoint.startswith('order/external/'):
+            endpoint = 'order/external'
+        self.requests[endpoint] += 1
+        account = self.account(uid)
+
+        if path.endswith('/contract/ping'):
+            return self._ok(int(time.time() * 1000))
+        if path.endswith('/position/open_positions') and method == 'GET':
+            return self._ok([dict(position) for position in account.positions.values()])
+        if path.endswith('/order/list/open_orders') and method == 'GET':
+            page_size = int(query.get('page_size', 20))
+            return self._ok([dict(order) for order in account.open_orders.values()][:page_size])
+        if path.endswith('/order/list/history_orders') and method == 'GET':
+            return self._ok(self._history(account, query))
+        if path.endswith('/order/create') and method == 'POST':
+            return self._create_order(account, body)
+        if path.endswith('/order/cancel') and method == 'POST':
+            return self._ok([self._cancel(account, order_id) for order_id in body])
+        if path.endswith('/order/change_limit_order') and method == 'POST':
+            return self._change_limit_order(account, body)
+        if path.endswith('/order/batch_query') and method == 'GET':
+            order_ids = set(query.get('order_ids', '').split(','))
+            return self._ok([dict(order) for order in list(account.open_orders.values()) + account.history
+                             if order['orderId'] in order_ids])
+        if '/order/external/' in path and method == 'GET':
+            return self._external_order(account, path.rsplit('/', 1)[-1])
+        if path.endswith('/stoporder/list/orders') and method == 'GET':
+            return self._ok(self._stop_orders(account, query.get('symbol')))
+        if path.endswith('/stoporder/change_plan_price') and method == 'POST':
+            return self._change_stop_loss(account, body)
+
+        return JsonResponse({'success': False, 'code': 404, 'message': f'Unknown endpoint {path}'}, 404)
+
+    def _ok(self, data):
+        return JsonResponse({'success': True, 'code': 0, 'data': data})
+
+    def _error(self, code: int, message: str):
+        return JsonResponse({'success': False, 'code': code, 'message': message})
+
+    def _history(self, account: SimAccount, query: dict):
+        orders = account.history
+        if 'symbol' in query:
+            orders = [order for order in orders if order['symbol'] == query['symbol']]
+        if 'state' in query:
+            orders = [order for order in orders if order['state'] == int(query['state'])]
+        orders = sorted(orders, key=lambda order: order['createTime'], reverse=True)
+        page_num = int(query.get('page_num', 1))
+        page_size = int(query.get('page_size', 20))
+        start = (page_num - 1) * page_size
+        return [dict(order) for order in orders[start:start + page_size]]
+
+    def _stop_orders(self, account: SimAccount, symbol: str = None):
+        # Стоп-ордер позиции - её стоп-лосс; id совпадает с positionId
+        return [{'id': position['positionId'], 'symbol': position['symbol'], 'positionId': position['positionId'],
+                 'stopLossPrice': position['stopLossPrice'], 'takeProfitPrice': None, 'state': 1}
+                for position in account.positions.values()
+                if position.get('stopLossPrice') and (symbol is None or position['symbol'] == symbol)]
+
+    def _change_stop_loss(self, account: SimAccount, obj: dict):
+        position = account.positions.get(obj['stopPlanOrderId'])
+        if position is None or not position.get('stopLossPrice'):
+            return self._error(2040, 'Stop order does not exist')
+        position['stopLossPrice'] = obj['stopLossPrice']
+        return self._ok(None)
+
+    def _external_order(self, account: SimAccount, external_oid: str):
+        for order in list(account.open_orders.values()) + account.history:
+            if order['externalOid'] == external_oid:
+                return self._ok(dict(order))
+        return self._error(2040, 'Order does not exist')
+
+    def _new_order(self, obj: dict, state: int, price: float):
+        now = int(time.time() * 1000)
+        vol = int(obj['vol'])
+        leverage = int(obj.get('leverage') or 1)
+        return {
+            'orderId': str(next(self._order_ids)),
+            'symbol': obj['symbol'],
+            'positionId': obj.get('positionId', 0),
+            'price': price,
+            'priceStr': str(price),
+            'vol': vol,
+            'leverage': leverage,
+            'side': int(obj['side']),
+            'category': 1,
+            'orderType': int(obj.get('type', 5)),
+            'dealAvgPrice': 0,
+            'dealAvgPriceStr': '0',
+            'dealVol': 0,
+            'orderMargin': round(vol * self.contract_size * price / leverage, 4),
+            'profit': 0,
+            'feeCurrency': 'USDT',
+            'openType': int(obj.get('openType', 1)),
+            'state': state,
+            'externalOid': obj.get('externalOid') or f"_m_{uuid.uuid4().hex}",
+            'stopLossPrice': obj.get('stopLossPrice'),
+            'errorCode': 0,
+            'createTime': now,
+            'updateTime': now,
+        }
+
+    def _create_order(self, account: SimAccount, obj: dict):
+        side = int(obj['side'])
+        if int(obj.get('vol', 0)) < 1:
+            return self._error(2015, 'Volume must be positive')
+
+        if int(obj.get('type', 5)) == 1:
+            # Лимитный ордер ждёт пересечения цены
+            order = self._new_order(obj, 2, float(obj['price']))
+            account.open_orders[order['orderId']] = order
+            return self._ok({'orderId': order['orderId'], 'ts': order['createTime']})
+
+        price = self.price(obj['symbol'])
+        if side in (1, 3):
+            order = self._new_order(obj, 3, price)
+            self._fill_open(account, order, price)
+            return self._ok({'orderId': order['orderId'], 'ts': order['createTime']})
+
+        position = account.positions.get(obj.get('positionId'))
+        expected_type = 1 if side == 4 else 2
+        if not position or position['positionType'] != expected_type:
+            return self._error(2009, 'Position does not exist')
+
+        order = self._new_order(obj, 3, price)
+        self._fill_close(account, position, order, price)
+        return self._ok({'orderId': order['orderId'], 'ts': order['createTime']})
+
+    def _fill_open(self, account: SimAccount, order: dict, price: float):
+        position_type = 1 if order['side'] == 1 else 2
+        position = next((p for p in account.positions.values()
+                         if p['symbol'] == order['symbol'] and p['positionType'] == position_type), None)
+        if position is None:
+            position = {
+                'positionId': next(self._position_ids),
+                'symbol': order['symbol'],
+                'positionType': position_type,
+                'openType': order['openType'],
+                'state': 1,
+                'holdVol': 0,
+                'frozenVol': 0,
+                'closeVol': 0,
+                'holdAvgPrice': price,
+                'openAvgPrice': price,
+                'closeAvgPrice': 0,
+                'liquidatePrice': 0,
+                'leverage': order['leverage'],
+                'realised': 0,
+                'closeProfitLoss': 0,
+                'stopLossPrice': order.get('stopLossPrice'),
+            }
+            account.positions[position['positionId']] = position
+
+        total = position['holdVol'] + order['vol']
+        position['holdAvgPrice'] = round((position['holdAvgPrice'] * position['holdVol'] + price * order['vol']) / total, 2)
+        position['openAvgPrice'] = position['holdAvgPrice']
+        position['holdVol'] = total
+        if order.get('stopLossPrice'):
+            position['stopLossPrice'] = order['stopLossPrice']
+
+        order.update({
+            'state': 3,
+            'positionId': position['positionId'],
+            'dealAvgPrice': price,
+            'dealAvgPriceStr': str(price),
+            'dealVol': order['vol'],
+            'updateTime': int(time.time() * 1000),
+        })
+        account.history.append(order)
+
+    def _fill_close(self, account: SimAccount, position: dict, order: dict, price: float):
+        vol = min(order['vol'], position['holdVol'])
+        direction = 1 if position['positionType'] == 1 else -1
+        profit = round((price - position['holdAvgPrice']) * vol * self.contract_size * direction, 4)
+
+        position['holdVol'] -= vol
+        position['closeVol'] += vol
+        position['closeProfitLoss'] = round(position['closeProfitLoss'] + profit, 4)
+        if position['holdVol'] <= 0:
+            del account.positions[position['positionId']]
+
+        order.update({
+            'vol': vol,
+            'positionId': position['positionId'],
+            'dealAvgPrice': price,
+            'dealAvgPriceStr': str(price),
+            'dealVol': vol,
+            'profit': profit,
+            'orderMargin': round(vol * self.contract_size * position['holdAvgPrice'] / position['leverage'], 4),
+            'updateTime': int(time.time() * 1000),
+        })
+        account.history.append(order)
+
+    def _cancel(self, account: SimAccount, order_id):
+        order = account.open_orders.pop(str(order_id), None)
+        if order is None:
+            return {'orderId': order_id, 'errorCode': 2040, 'errorMsg': 'Order does not exist'}
+        order['state'] = 4
+        order['updateTime'] = int(time.time() * 1000)
+        account.history.append(order)
+        return {'orderId': order_id, 'errorCode': 0, 'errorMsg': 'success'}
+
+    def _change_limit_order(self, account: SimAccount, obj: dict):
+        old_order = account.open_orders.get(str(obj['orderId']))
+        if old_order is None:
+            return self._error(2040, 'Order does not exist')
+
+        self._cancel(account, old_order['orderId'])
+        order = self._new_order({**old_order, 'type': 1, 'vol': obj['vol']}, 2, float(obj['price']))
+        account.open_orders[order['orderId']] = order
+        return self._ok(order['orderId'])
+
+    # === Действия главного аккаунта для сценариев ===
+
+    def open_market(self, uid: str, symbol: str, side: int, vol: int, leverage: int = 5, open_type: int = 1,
+                    stop_loss_price: str = None):
+        obj = {'symbol': symbol, 'side': side, 'openType': open_type, 'type': 5, 'vol': vol,
+               'leverage': leverage, 'stopLossPrice': stop_loss_price}
+        return self._create_order(self.account(uid), obj).json()
+
+    def close_market(self, uid: str, symbol: str, side: int):
+        account = self.account(uid)
+        position_type = 1 if side == 1 else 2
+        for position in list(account.positions.values()):
+            if position['symbol'] == symbol and position['positionType'] == position_type:
+                obj = {'symbol': symbol, 'side': 4 if side == 1 else 2, 'type': 5, 'vol': position['holdVol'],
+                       'positionId': position['positionId'], 'leverage': position['leverage'],
+                       'openType': position['openType']}
+                return self._create_order(account, obj).json()
+
+    def reduce_market(self, uid: str, symbol: str, side: int, vol: int):
+        position = self.position(uid, symbol, side)
+        obj = {'symbol': symbol, 'side': 4 if side == 1 else 2, 'type': 5, 'vol': vol,
+               'positionId': position['positionId'], 'leverage': position['leverage'],
+               'openType': position['openType']}
+        return self._create_order(self.account(uid), obj).json()
+
+    def set_stop_loss(self, uid: str, symbol: str, side: int, price: str):
+        self.position(uid, symbol, side)['stopLossPrice'] = price
+
+    def position(self, uid: str, symbol: str, side: int):
+        position_type = 1 if side == 1 else 2
+        return next((p for p in self.account(uid).positions.values()
+                     if p['symbol'] == symbol and p['positionType'] == position_type), None)
+
+    def place_limit(self, uid: str, symbol: str, side: int, vol: int, price: float, leverage: int = 5,
+                    open_type: int = 1):
+        obj = {'symbol': symbol, 'side': side, 'openType': open_type, 'type': 1, 'vol': vol,
+               'leverage': leverage, 'price': str(price)}
+        return self._create_order(self.account(uid), obj).json()
+
+    def cancel_orders(self, uid: str, order_ids: list):
+        account = self.account(uid)
+        return [self._cancel(account, order_id) for order_id in order_ids]
+
+    def has_position(self, uid: str, symbol: str, side: int) -> bool:
+        position_type = 1 if side == 1 else 2
+        return any(p['symbol'] == symbol and p['positionType'] == position_type
+                   for p in self.account(uid).positions.values())
+
+
+class SimulatedTransport(Transport):
+    """Транспорт Mexc поверх SimulatedExchange (без сети)"""
+
+    def __init__(self, exchange: SimulatedExchange, uid: str):
+        self.exchange = exchange
+        self.uid = uid
+
+    async def request(self, method: str, url: str, params=None, json=None, headers=None, timeout: float = 10):
+        try:
+            await asyncio.wait_for(self.exchange.delay(self.uid), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Simulated timeout after {timeout}s: {url}")
+        response = self.exchange.handle(self.uid, method.upper(), url, params, json)
+        if self.exchange.lost_responses[self.uid] > 0:
+            self.exchange.lost_responses[self.uid] -= 1
+            raise TimeoutError(f"Simulated lost response: {url}")
+        return response
+
+
+def make_accounts(exchange: SimulatedExchange, count: int):
+    """Главный и count ведомых аккаунтов поверх симулятора"""
+    from api.mexc import Mexc
+
+    main_mexc = Mexc("SIM-main", None, SimulatedTransport(exchange, "SIM-main"))
+    accounts_mexc = [
+        Mexc(f"SIM-{i}", None, SimulatedTransport(exchange, f"SIM-{i}"))
+        for i in range(count)
+    ]
+    return main_mexc, accounts_mexc
+
+
+async def wait_until(condition, timeout: float):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.005)
+    return True
+
+
+async def run_simulation(accounts: int = 100, events: int = 5, latency: float = 0.02, jitter: float = 0.01,
+                         symbol: str = "BTC_USDT"):
+    """Гоняет main() против симулятора: открытия и закрытия на главном, замер времени копирования"""
+    import main as bot
+
+    exchange = SimulatedExchange(latency, jitter)
+    main_mexc, accounts_mexc = make_accounts(exchange, accounts)
+    slave_uids = [mexc.cookies['u_id'] for mexc in accounts_mexc]
+    bot.notifier.enabled = False
+    bot.STATE_JOURNAL_FILE = None
+
+    bot_task = asyncio.create_task(bot.main(main_mexc, accounts_mexc))
+    await asyncio.sleep(0.5)
+
+    started = time.monotonic()
+    open_times, close_times = [], []
+    for n in range(events):
+        side = 1 if n % 2 == 0 else 3
+
+        t = time.monotonic()
+        exchange.open_market("SIM-main", symbol, side, 10)
+        if await wait_until(lambda: all(exchange.has_position(uid, symbol, side) for uid in slave_uids), 30):
+            open_times.append(time.monotonic() - t)
+
+        t = time.monotonic()
+        exchange.close_market("SIM-main", symbol, side)
+        if await wait_until(lambda: not any(exchange.has_position(uid, symbol, side) for uid in slave_uids), 30):
+            close_times.append(time.monotonic() - t)
+
+    elapsed = time.monotonic() - started
+    bot_task.cancel()
+
+    total_requests = sum(exchange.requests.values())
+    print(f"\n📊 Симуляция: {accounts} ведомых аккаунтов, {events} событий, задержка {latency * 1000:.0f} мс")
+    for name, times in (("Открытие", open_times), ("Закрытие", close_times)):
+        if times:
+            print(f"  {name}: среднее {sum(times) / len(times):.3f}s, максимум {max(times):.3f}s "
+                  f"({len(times)}/{events} событий скопировано полностью)")
+    print(f"  Запросов: {total_requests} ({total_requests / elapsed:.0f}/сек)")
+    print(f"  По эндпоинтам: {dict(exchange.requests)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запуск копировщика против симулятора MEXC")
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--events", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    args = parser.parse_args()
+    asyncio.run(run_simulation(args.accounts, args.events, args.latency, args.jitter))
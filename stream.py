@@ -0,0 +1,92 @@
+import asyncio
+import time
+from api.mexc import Mexc, FUTURES_WS_URL, format_position
+from metrics import metrics
+
+# Состояния из приватного потока MEXC
+POSITION_CLOSED = 3  # push.personal.position: 1 - держим, 2 - системное удержание, 3 - закрыта
+ORDER_OPEN_STATES = (1, 2)  # push.personal.order: 1 - не информирован, 2 - не исполнен
+ORDER_FILLED = 3
+MARKET_ORDER_TYPES = (5, 6)  # Рыночные ордера в открытых не задерживаются - не отслеживаем
+
+
+class MasterStream:
+    """Приватный WebSocket-поток главного аккаунта: изменения позиций и ордеров без опроса.
+
+    После каждого (пере)подключения состояние восстанавливается из REST-снимков -
+    события, пропущенные за время разрыва, не теряются. Обновления идут в ту же
+    логику сравнения, что и опрос (engine.apply_*).
+    """
+
+    def __init__(self, mexc: Mexc, engine, url: str = FUTURES_WS_URL, ping_interval: float = 15,
+                 reconnect_max_delay: float = 30):
+        self.mexc = mexc
+        self.engine = engine
+        self.url = url
+        self.ping_interval = ping_interval
+        self.reconnect_max_delay = reconnect_max_delay
+        self.connected = False
+
+    async def run(self):
+        """Держит подключение, переподключаясь с нарастающей паузой"""
+        delay = 1
+        while True:
+            try:
+                await self._session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Поток главного аккаунта прерван: {e}")
+            if self.connected:
+                # Соединение успело поработать - следующую попытку делаем сразу
+                delay = 1
+            self.connected = False
+            metrics.inc('master_stream_reconnects_total')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    async def _session(self):
+        ws = await self.mexc.transport.ws_connect(self.url)
+        try:
+            await ws.send_json({'method': 'login', 'param': {'token': self.mexc.cookies['u_id']}})
+            reply = await asyncio.wait_for(ws.recv_json(), self.ping_interval)
+            if reply.get('channel') != 'rs.login' or reply.get('data') != 'success':
+                raise ValueError(f"Вход в поток отклонён: {reply}")
+
+            # Пропущенное за время разрыва догоняем по REST; новые события ждут в сокете
+            await self.engine.poll()
+            self.connected = True
+            print("📡 Поток главного аккаунта подключён")
+
+            pinger = asyncio.create_task(self._ping(ws))
+            try:
+                while True:
+                    # Сервер отвечает на ping - тишина дольше нескольких интервалов значит мёртвое соединение
+                    message = await asyncio.wait_for(ws.recv_json(), self.ping_interval * 3)
+                    self.handle(message)
+            finally:
+                pinger.cancel()
+        finally:
+            try:
+                await ws.close()
+            except Exception:
+                pass
+
+    async def _ping(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await ws.send_json({'method': 'ping'})
+
+    def handle(self, message: dict):
+        channel = message.get('channel')
+        data = message.get('data')
+        if channel == 'push.personal.position':
+            metrics.inc('master_stream_events_total', channel='position')
+            self.engine.apply_position_update(
+                format_position(data), data.get('state') == POSITION_CLOSED or not data.get('holdVol'), time.time())
+        elif channel == 'push.personal.order':
+            if data.get('orderType') in MARKET_ORDER_TYPES:
+                return
+            metrics.inc('master_stream_events_total', channel='order')
+            state = data.get('state')
+            self.engine.apply_order_update(data, state not in ORDER_OPEN_STATES, state == ORDER_FILLED, time.time())
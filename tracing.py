@@ -0,0 +1,132 @@
+import contextvars
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+# Трассировка текущего события главного аккаунта и текущий спан.
+# contextvars копируются в задачи asyncio, поэтому ID доходит до каждого запроса Mexc.
+current_trace = contextvars.ContextVar('current_trace', default=None)
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Trace:
+    """Дерево спанов одного события (открытие, закрытие, лимитный ордер)"""
+
+    def __init__(self, tracer, name: str, **attrs):
+        self.tracer = tracer
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self.spans = []
+        self.finished = False
+
+    def mark(self, name: str, at: float = None, **attrs):
+        """Мгновенная отметка (например, момент обнаружения события)"""
+        parent = current_span.get()
+        self.spans.append({
+            'id': uuid.uuid4().hex[:8],
+            'parent': parent['id'] if parent else None,
+            'name': name,
+            'start': at or time.time(),
+            'end': at or time.time(),
+            **attrs,
+        })
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        parent = current_span.get()
+        span = {
+            'id': uuid.uuid4().hex[:8],
+            'parent': parent['id'] if parent else None,
+            'name': name,
+            'start': time.time(),
+            'end': None,
+            **attrs,
+        }
+        self.spans.append(span)
+        token = current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span['error'] = str(e)
+            raise
+        finally:
+            span['end'] = time.time()
+            current_span.reset(token)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.tracer.write(self)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.id,
+            'name': self.name,
+            'start': self.started,
+            'end': time.time(),
+            **self.attrs,
+            'spans': self.spans,
+        }
+
+
+class Tracer:
+    """Пишет завершённые трассировки в JSON Lines файл"""
+
+    def __init__(self, path: str = None):
+        self.path = path
+
+    def start(self, name: str, **attrs) -> Trace:
+        return Trace(self, name, **attrs)
+
+    def write(self, trace: Trace):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"⚠️ Ошибка записи трассировки: {e}")
+
+
+def span(name: str, **attrs):
+    """Спан в текущей трассировке (или пустой контекст, если события нет)"""
+    trace = current_trace.get()
+    if trace is None:
+        return _null_span()
+    return trace.span(name, **attrs)
+
+
+@contextmanager
+def _null_span():
+    yield None
+
+
+def tag() -> str:
+    """Префикс correlation ID для логов: '[a1b2c3d4e5f6] ' или пустая строка"""
+    trace = current_trace.get()
+    return f"[{trace.id}] " if trace else ""
+
+
+async def run_traced(trace: Trace, coro, finish: bool = False):
+    """Выполняет корутину внутри трассировки события"""
+    token = current_trace.set(trace)
+    try:
+        return await coro
+    finally:
+        current_trace.reset(token)
+        if finish:
+            trace.finish()
+
+
+def finish_trace():
+    trace = current_trace.get()
+    if trace is not None:
+        trace.finish()
+
+
+# Общий трассировщик процесса (файл задаётся при старте)
+tracer = Tracer()
@@ -0,0 +1,160 @@
+import json
+from curl_cffi import AsyncSession
+
+# Коды ошибок libcurl, после которых соединения сессии считаются мёртвыми: прокси или хост
+# недоступен, соединение разорвано, сбой TLS/HTTP2. Таймаут запроса сюда не входит -
+# соединение при нём обычно живо, а сессию делят все запросы аккаунта и поток главного
+CONNECTION_ERROR_CODES = {5, 6, 7, 16, 35, 52, 55, 56, 92, 97}
+
+
+def connection_broken(error: Exception) -> bool:
+    return getattr(error, 'code', None) in CONNECTION_ERROR_CODES
+
+
+class JsonResponse:
+    """Минимальный ответ с тем же интерфейсом, что и у curl_cffi (status_code, text, json())"""
+
+    def __init__(self, data, status_code: int = 200):
+        self.status_code = status_code
+        self.text = json.dumps(data, separators=(',', ':'))
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Transport:
+    """HTTP-движок, через который Mexc ходит на биржу"""
+
+    async def request(self, method: str, url: str, params=None, json=None, headers=None, timeout: float = 10):
+        raise NotImplementedError
+
+    async def ws_connect(self, url: str):
+        """WebSocket-соединение (send_json/recv_json/close) для потоков биржи"""
+        raise NotImplementedError
+
+    async def reset(self):
+        """Пересоздаёт соединения (битое соединение, умерший прокси)"""
+
+    async def close(self):
+        pass
+
+
+class SessionWebSocket:
+    """WebSocket, который держит сессию: пересозданная сессия закрывается только после него"""
+
+    def __init__(self, ws, release):
+        self.ws = ws
+        self.release = release
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+    async def close(self):
+        try:
+            await self.ws.close()
+        finally:
+            release, self.release = self.release, None
+            if release is not None:
+                await release()
+
+
+class CurlTransport(Transport):
+    """Транспорт по умолчанию: постоянная сессия curl_cffi с отпечатком Chrome"""
+
+    def __init__(self, headers: dict, cookies: dict, proxy: str = None, host_map: dict = None):
+        self.headers = headers
+        self.cookies = cookies
+        self.proxy = proxy
+        # Подмена хостов биржи (например, на локальный мок-сервер в бенчмарках)
+        self.host_map = host_map or {}
+        self.ses = self._new_session()
+        self.in_flight = {}  # {сессия: запросов и WebSocket в работе}
+        self.retired = set()  # Заменённые сессии, ждущие завершения своих запросов
+
+    def _new_session(self):
+        """Постоянная сессия: соединения с обоими хостами переиспользуются между запросами"""
+        if self.proxy:
+            proxy = f"socks5://{self.proxy}"
+            return AsyncSession(
+                proxy=proxy, headers=self.headers, cookies=self.cookies, impersonate="chrome136", verify=False
+            )
+        return AsyncSession(
+            headers=self.headers, cookies=self.cookies, impersonate="chrome136", verify=False
+        )
+
+    def _url(self, url: str):
+        for host, target in self.host_map.items():
+            if url.startswith(host):
+                return target + url[len(host):]
+        return url
+
+    def _hold(self):
+        ses = self.ses
+        self.in_flight[ses] = self.in_flight.get(ses, 0) + 1
+        return ses
+
+    async def _release(self, ses):
+        self.in_flight[ses] -= 1
+        if self.in_flight[ses]:
+            return
+        del self.in_flight[ses]
+        if ses in self.retired:
+            self.retired.discard(ses)
+            await self._close_session(ses)
+
+    async def request(self, method: str, url: str, params=None, json=None, headers=None, timeout: float = 10):
+        ses = self._hold()
+        url = self._url(url)
+        try:
+            if method.upper() == 'GET':
+                return await ses.get(url, params=params, headers=headers, timeout=timeout)
+            elif method.upper() == 'POST':
+                return await ses.post(url, params=params, json=json, headers=headers, timeout=timeout)
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        except ValueError:
+            raise
+        except Exception as e:
+            if connection_broken(e):
+                # Соединение умерло - следующие запросы пойдут через новую сессию
+                await self._retire(ses)
+            raise
+        finally:
+            await self._release(ses)
+
+    async def ws_connect(self, url: str):
+        # Тот же отпечаток, прокси и cookies, что и у HTTP-запросов аккаунта
+        ses = self._hold()
+        try:
+            ws = await ses.ws_connect(self._url(url))
+        except Exception as e:
+            if connection_broken(e):
+                await self._retire(ses)
+            await self._release(ses)
+            raise
+        return SessionWebSocket(ws, lambda: self._release(ses))
+
+    async def _retire(self, broken):
+        """Заменяет сессию новой; старая закрывается, когда завершатся её запросы"""
+        if broken is not self.ses:
+            # Сессию уже пересоздал другой запрос
+            return
+        self.ses = self._new_session()
+        if broken in self.in_flight:
+            self.retired.add(broken)
+        else:
+            await self._close_session(broken)
+
+    @staticmethod
+    async def _close_session(ses):
+        try:
+            await ses.close()
+        except Exception as e:
+            print(f"⚠️ Ошибка закрытия старой сессии: {e}")
+
+    async def reset(self):
+        await self._retire(self.ses)
+
+    async def close(self):
+        for ses in [*self.retired, self.ses]:
+            await self._close_session(ses)
+        self.retired.clear()